@@ -1,6 +1,9 @@
 # sys
 import sys
 
+# command line options
+import argparse
+
 # GUI
 from ui.gui import EVB1000ViewerMainWindow
 from PyQt5.QtWidgets import QApplication
@@ -9,27 +12,104 @@ from PyQt5.QtWidgets import QApplication
 from device.device_manager import DeviceManager
 from device.device_manager import DeviceVIDPIDList
 
+# simulated EVB1000 tags
+from device.simulator import Simulator
+
+# raw capture of the serial data
+from device.capture import CaptureRecorder
+
+# replay of captures
+from device.replay import Replayer
+
+# persistent store of the tag poses
+from storage.position_store import PositionStore
+
 if __name__ == '__main__':
 
+    # parse options, remaining arguments are passed to Qt
+    parser = argparse.ArgumentParser(description = 'DecaWave EVB1000 Viewer')
+    parser.add_argument('--io-backend', choices = DeviceManager.io_backends, default = 'threads',
+                        help = 'read each serial port in its own thread (threads) ' +\
+                               'or all of them in a single thread (selectors, POSIX only)')
+    parser.add_argument('--simulate-tags', type = int, default = 0, metavar = 'N',
+                        help = 'add N simulated tags connected through pseudo-terminals (POSIX only)')
+    parser.add_argument('--simulate-rate', type = float, default = 100.0, metavar = 'HZ',
+                        help = 'rate of the messages of each simulated tag')
+    parser.add_argument('--simulate-messages', choices = ['both', 'kmf', 'tpr'], default = 'both',
+                        help = 'messages sent by each simulated tag, raw positions (tpr), ' +\
+                               'estimated poses (kmf) or both, as the EVB1000 boards do')
+    parser.add_argument('--capture', metavar = 'FILE',
+                        help = 'record the raw bytes received from all the devices in FILE')
+    parser.add_argument('--replay', metavar = 'FILE',
+                        help = 'replay the capture FILE as if its devices were connected')
+    parser.add_argument('--replay-speed', type = float, default = 1.0, metavar = 'X',
+                        help = 'speed factor of the replay, 0 replays as fast as possible')
+    parser.add_argument('--store', metavar = 'DIR',
+                        help = 'append the poses of the tags to the position store in DIR')
+    args, qt_args = parser.parse_known_args()
+
     # load VIDs and PIDs from config.ini
     vid_pid_list = DeviceVIDPIDList('config.ini')
 
+    # record the raw bytes received, if required
+    recorder = None
+    if args.capture is not None:
+        recorder = CaptureRecorder(args.capture)
+        recorder.start()
+
     # instantiate device_manager
-    dev_man = DeviceManager(vid_pid_list)
+    dev_man = DeviceManager(vid_pid_list, args.io_backend, recorder = recorder)
+
+    # instantiate the simulated tags, if required
+    if args.simulate_tags > 0:
+        simulator = Simulator(args.simulate_tags, args.simulate_rate, args.simulate_messages)
+        dev_man.attach_ports(simulator.port_infos())
+        simulator.start()
 
     # instantiate a QApplication
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
+
+    # store the poses of the tags, if required
+    position_store = None
+    if args.store is not None:
+        position_store = PositionStore(args.store)
 
     # instantiate the main window
-    gui = EVB1000ViewerMainWindow(dev_man)
+    gui = EVB1000ViewerMainWindow(dev_man, position_store)
 
     # show the main window
     gui.show()
 
+    # replay a capture, if required
+    replayer = None
+    if args.replay is not None:
+        speed = args.replay_speed if args.replay_speed > 0 else None
+        replayer = Replayer(args.replay, speed)
+        dev_man.register_devices(replayer.get_devices())
+        replayer.start()
+
     # start the device manager
     dev_man.start()
     
-    sys.exit(app.exec_())
+    status = app.exec_()
+
+    # report the frame time measurements, e.g. to compare render modes
+    print(gui.statistics_summary())
+
+    # stop the replay
+    if replayer is not None:
+        replayer.stop()
+        replayer.wait()
+
+    # commit the poses received
+    if position_store is not None:
+        position_store.close()
+
+    # write the pending data to the capture
+    if recorder is not None:
+        recorder.close()
+
+    sys.exit(status)
 
 
     
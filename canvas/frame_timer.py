@@ -0,0 +1,86 @@
+# time measurement
+from time import perf_counter
+
+# bounded history of samples
+from collections import deque
+
+class FrameTimer:
+    """
+    Collects frame time measurements of the Matplotlib view.
+
+    Two kinds of durations are stored:
+    - update time, i.e. the time spent in updating the tag views
+    - render time, i.e. the time spent in drawing the figure (or in blitting it)
+
+    Only the last history_size samples are kept for each kind.
+    """
+
+    def __init__(self, history_size = 250):
+
+        # durations in seconds
+        self.update_times = deque(maxlen = history_size)
+        self.render_times = deque(maxlen = history_size)
+
+        # number of frames that were rendered
+        self.rendered_frames = 0
+
+        # number of frames skipped because no tag was dirty
+        self.skipped_frames = 0
+
+    def now(self):
+        """
+        Return the current time, in seconds, for measuring durations.
+        """
+
+        return perf_counter()
+
+    def record_update(self, start):
+        """
+        Record an update that started at time start.
+        """
+
+        self.update_times.append(perf_counter() - start)
+
+    def record_render(self, start):
+        """
+        Record a rendering that started at time start.
+        """
+
+        self.render_times.append(perf_counter() - start)
+        self.rendered_frames += 1
+
+    def record_skipped(self):
+        """
+        Record a frame that did not require any rendering.
+        """
+
+        self.skipped_frames += 1
+
+    def reset(self):
+        """
+        Clear all the measurements.
+        """
+
+        self.update_times.clear()
+        self.render_times.clear()
+        self.rendered_frames = 0
+        self.skipped_frames = 0
+
+    def statistics(self):
+        """
+        Return a dictionary containing mean and max update and render times,
+        in milliseconds, and the number of rendered and skipped frames.
+        """
+
+        stats = {'rendered_frames': self.rendered_frames,
+                 'skipped_frames': self.skipped_frames}
+
+        for name, times in (('update', self.update_times), ('render', self.render_times)):
+            if len(times) > 0:
+                stats[name + '_mean_ms'] = sum(times) / len(times) * 1000
+                stats[name + '_max_ms'] = max(times) * 1000
+            else:
+                stats[name + '_mean_ms'] = 0.0
+                stats[name + '_max_ms'] = 0.0
+
+        return stats
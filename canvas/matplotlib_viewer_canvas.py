@@ -2,7 +2,6 @@
 import numpy as np
 
 # PyQt
-from PyQt5 import QtWidgets
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 
 # matplotilb
@@ -13,10 +12,15 @@ import matplotlib.animation as animation
 # representation of tag position as a scatter
 from canvas.tag_position_view import TagPositionView
 from canvas.tag_position_view import TagPositionAttitudeView
+from canvas.tag_position_view import MultiTagPositionView
+from canvas.tag_position_view import MultiTagAttitudeView
 
 # reppresentation of the reference frame
 from canvas.reference_frame import ReferenceFrame
 
+# frame time measurements
+from canvas.frame_timer import FrameTimer
+
 # lock
 from threading import Lock
 
@@ -26,8 +30,21 @@ class MatplotlibViewerCanvas(FigureCanvas):
     and the estimated position of the tag(s).
 
     Inherits from FigureCanvasQTAgg in order to integrate with PyQt.
+
+    The view can be rendered in one of the following modes:
+    - 'full': the whole figure is redrawn at each frame
+    - 'on_demand': the whole figure is redrawn only if at least one tag is dirty
+    - 'blit': the static objects are cached as a background and only the
+              tag views are redrawn, only if at least one tag is dirty
+
+    If batch_tags is True the positions of all the tags are drawn using
+    a single scatter and the reference frames of all the tags are drawn
+    using a single collection of segments.
     """
-    def __init__(self, parent, frame_rate, tag_buffer_size):
+
+    render_modes = ('full', 'on_demand', 'blit')
+
+    def __init__(self, parent, frame_rate, tag_buffer_size, render_mode = 'full', batch_tags = False):
         
         # create a new figure
         fig = Figure(dpi = 100)
@@ -54,6 +71,14 @@ class MatplotlibViewerCanvas(FigureCanvas):
         # common height of anchors 0, 1 and 2
         self._anchors_plane_height = -1
         self.anchors_plane_height_lock = Lock()
+
+        # change of basis between "data" frame and Matplotlib frame
+        # (see eval_basis_change())
+        self.basis_change = np.identity(3)
+
+        # homogeneous transformation from "data" frame to Matplotlib frame
+        # (see update_transformation())
+        self.update_transformation()
         
         # save requested frame rate for animation
         self.frame_rate = frame_rate
@@ -61,6 +86,20 @@ class MatplotlibViewerCanvas(FigureCanvas):
         # save requested size of TagPositionsBuffer buffers
         self.tag_buffer_size = tag_buffer_size
 
+        # save requested render mode
+        if render_mode not in self.render_modes:
+            raise ValueError('Unknown render mode ' + str(render_mode) + '.')
+        self.render_mode = render_mode
+
+        # save requested rendering of tags
+        self.batch_tags = batch_tags
+
+        # frame time measurements
+        self.frame_timer = FrameTimer()
+
+        # background used in 'blit' mode
+        self.background = None
+
         # setup the plot
         self.setup_plot(fig)
 
@@ -84,6 +123,9 @@ class MatplotlibViewerCanvas(FigureCanvas):
         self._anchors_plane_height = height
 
         self.anchors_plane_height_lock.release()
+
+        # the shift of the transformation changed
+        self.update_transformation()
         
     def setup_plot(self, figure):
         """
@@ -101,22 +143,163 @@ class MatplotlibViewerCanvas(FigureCanvas):
         # disable drawing of grid
         self.axes.axis('off')
 
+        # views shared by all the tags
+        if self.batch_tags:
+            self.multi_tag_position_view = MultiTagPositionView(self.axes)
+            self.multi_tag_attitude_view = MultiTagAttitudeView(self.axes)
+
         # start tags position animation
         time_step = 1.0 / self.frame_rate * 1000
-        self.anim = animation.FuncAnimation(figure, self.update_tags_view, interval = time_step)
+        if self.render_mode == 'full':
+            self.anim = animation.FuncAnimation(figure, self.update_tags_view, interval = time_step)
+        else:
+            # the figure is drawn only when required
+            # hence the animation is driven by a plain timer
+            self.timer = self.new_timer(interval = int(time_step))
+            self.timer.add_callback(self.render_frame)
+            self.timer.start()
+
+            if self.render_mode == 'blit':
+                # cache the background each time the whole figure is drawn
+                self.mpl_connect('draw_event', self.on_draw)
+
+    def draw(self):
+        """
+        Draw the whole figure measuring the time required.
+        """
+
+        start = self.frame_timer.now()
+
+        FigureCanvas.draw(self)
+
+        self.frame_timer.record_render(start)
+
+    def on_draw(self, event):
+        """
+        Cache the background after the whole figure has been drawn
+        and draw the tag views on top of it.
+
+        Used in 'blit' mode only.
+        """
+
+        # tag views are animated, hence they are not part of the background
+        self.background = self.copy_from_bbox(self.figure.bbox)
+
+        self.draw_dynamic_artists()
+
+    def dynamic_artists(self):
+        """
+        Return the list of Matplotlib artists of all the tag views.
+        """
+
+        if self.batch_tags:
+            return self.multi_tag_position_view.artists + self.multi_tag_attitude_view.artists
+
+        artists = []
+
+        for view_name in self.tags_position_view:
+            artists.extend(self.tags_position_view[view_name].artists)
+
+        for view_name in self.tags_position_attitude_view:
+            artists.extend(self.tags_position_attitude_view[view_name].artists)
+
+        return artists
+
+    def draw_dynamic_artists(self):
+        """
+        Draw the Matplotlib artists of all the tag views.
+        """
+
+        for artist in self.dynamic_artists():
+            # 3D collections are projected by the axes during a full draw only
+            if hasattr(artist, 'do_3d_projection'):
+                artist.do_3d_projection()
+
+            self.axes.draw_artist(artist)
+
+    def render_frame(self):
+        """
+        Update the tag views and render them if at least one tag is dirty.
+
+        Used in 'on_demand' and 'blit' mode.
+        """
+
+        updated_views = self.update_tags_view(None)
+
+        if updated_views == 0:
+            self.frame_timer.record_skipped()
+            return
+
+        if self.render_mode == 'on_demand':
+            self.draw_idle()
+            return
+
+        # artists created after the last full draw are part of the background
+        # so they are excluded from it and the whole figure is drawn again
+        new_artists = [artist for artist in self.dynamic_artists() if not artist.get_animated()]
+        if self.background is None or new_artists:
+            for artist in new_artists:
+                artist.set_animated(True)
+            self.draw()
+            return
+
+        start = self.frame_timer.now()
+
+        # restore the background and draw the tag views only
+        self.restore_region(self.background)
+        self.draw_dynamic_artists()
+        self.blit(self.figure.bbox)
+
+        self.frame_timer.record_render(start)
+
+    def frame_statistics(self):
+        """
+        Return the frame time measurements collected so far.
+
+        See FrameTimer.statistics().
+        """
+
+        return self.frame_timer.statistics()
 
     def update_tags_view(self, frame_number):
         """
         Update each tag position view in self.tags_position_view
+
+        Views whose data did not change since the last frame are skipped.
+
+        Return the number of views that were updated.
         """
+        start = self.frame_timer.now()
+
+        updated_views = 0
+
+        if self.batch_tags:
+            # update the views shared by all the tags
+            position_views = list(self.tags_position_view.values())
+            if self.multi_tag_position_view.update_view(position_views):
+                updated_views += 1
+
+            attitude_views = list(self.tags_position_attitude_view.values())
+            if self.multi_tag_attitude_view.update_view(attitude_views):
+                updated_views += 1
+
+            self.frame_timer.record_update(start)
+
+            return updated_views
+
         # update each tag position view in self.tags_position_view
         for view_name in self.tags_position_view:
-            self.tags_position_view[view_name].update_view()
+            if self.tags_position_view[view_name].update_view():
+                updated_views += 1
 
         # update each tag position attitude view in self.tags_position_attitude_view
         for view_name in self.tags_position_attitude_view:
-            self.tags_position_attitude_view[view_name].update_view()
+            if self.tags_position_attitude_view[view_name].update_view():
+                updated_views += 1
+
+        self.frame_timer.record_update(start)
 
+        return updated_views
 
     def set_axes_limits(self):
         """
@@ -172,12 +355,19 @@ class MatplotlibViewerCanvas(FigureCanvas):
         Register a new tag given its ID and its representing color
         """
         
+        # views of a tag do not need their own artists
+        # if all the tags are drawn together
+        if self.batch_tags:
+            axes = None
+        else:
+            axes = self.axes
+
         # instantiate a new TagPositionView
-        self.tags_position_view[tag_ID] = TagPositionView(self.axes,\
+        self.tags_position_view[tag_ID] = TagPositionView(axes,\
                                                           self.tag_buffer_size,\
                                                           tag_color)
 
-        self.tags_position_attitude_view[tag_ID] = TagPositionAttitudeView(self.axes,\
+        self.tags_position_attitude_view[tag_ID] = TagPositionAttitudeView(axes,\
                                                                            tag_color) 
         
     def is_tag_view(self, tag_ID):
@@ -215,13 +405,7 @@ class MatplotlibViewerCanvas(FigureCanvas):
         """
 
         # perform homogeneous transformation on data
-        position_data_frame = np.array([[x,y,z]]).T
-        position_mpl_frame = self.vector_hom_transformation(position_data_frame)
-
-        # extract coordinates
-        x = position_mpl_frame.item(0)
-        y = position_mpl_frame.item(1)
-        z = position_mpl_frame.item(2)
+        x, y, z = self.transform_position(x, y, z)
 
         # set new position
         self.tags_position_attitude_view[tag_ID].new_pose(x, y, z, roll, pitch, yaw)
@@ -233,17 +417,33 @@ class MatplotlibViewerCanvas(FigureCanvas):
         """
 
         # perform homogeneous transformation on data
-        position_data_frame = np.array([[x,y,z]]).T
-        position_mpl_frame = self.vector_hom_transformation(position_data_frame)
-
-        # extract coordinates
-        x = position_mpl_frame.item(0)
-        y = position_mpl_frame.item(1)
-        z = position_mpl_frame.item(2)
+        x, y, z = self.transform_position(x, y, z)
 
         # set new position
         self.tags_position_view[tag_ID].new_position(x, y, z)
 
+    def set_tags_raw_positions(self, tag_IDs, positions):
+        """
+        Inform the tag position views that a block of new positions is available.
+
+        tag_IDs is a sequence of N tag IDs and positions is an (N, 3) array
+        where the i-th row is the new position of the tag tag_IDs[i].
+        Positions of the same tag are added in the given order.
+        """
+
+        # perform homogeneous transformation on the whole block at once
+        positions_mpl_frame = self.transform_positions(positions)
+
+        # group rows by tag
+        rows_per_tag = dict()
+        for row, tag_ID in enumerate(tag_IDs):
+            rows_per_tag.setdefault(tag_ID, []).append(row)
+
+        # set new positions
+        for tag_ID in rows_per_tag:
+            rows = rows_per_tag[tag_ID]
+            self.tags_position_view[tag_ID].new_positions(positions_mpl_frame[rows])
+
     def eval_basis_change(self, a3_z):
         """
         Evaluate change of basis between the "data" frame, in which
@@ -263,28 +463,79 @@ class MatplotlibViewerCanvas(FigureCanvas):
         if a3_z  < 0:
             rot_angle = -np.pi
         
-        self.basis_change = np.matrix([[np.cos(rot_angle), 0, np.sin(rot_angle)],
-                                       [0, 1, 0],
-                                       [-np.sin(rot_angle), 0, np.cos(rot_angle)]])
+        self.basis_change = np.array([[np.cos(rot_angle), 0, np.sin(rot_angle)],
+                                      [0, 1, 0],
+                                      [-np.sin(rot_angle), 0, np.cos(rot_angle)]])
 
-    def vector_hom_transformation(self, vector):
+        # the basis of the transformation changed
+        self.update_transformation()
+
+    def update_transformation(self):
         """
-        Perform an homogeneous transformation on a numpy column vector expressed
-        in the "data" frame.
+        Evaluate the 4x4 homogeneous transformation from the "data" frame
+        to the Matplotlib frame.
 
         The change of basis of the transformation is given by self.basis_change.
         The shift of the transformation is given by [0, 0, self.anchors_plane_height]'.
         This way a vector expressed in "data" frame is expressed in Matplotlib frame
         and with respect to a new origin placed on the ground plane.
 
-        Return the components of the new vector as a np vector.
+        Called each time the basis or the anchors plane height change.
+        """
+
+        transformation = np.identity(4)
+        transformation[:3, :3] = self.basis_change
+        transformation[2, 3] = self.anchors_plane_height
+
+        # a new array is assigned at once so that readers
+        # never see a partially updated transformation
+        self.transformation = transformation
+
+    def transform_positions(self, positions):
+        """
+        Perform the homogeneous transformation on a block of positions
+        expressed in the "data" frame.
+
+        positions is an (N, 3) array, one position for each row.
+
+        Return an (N, 3) array containing the positions expressed in Matplotlib frame.
+        """
+
+        transformation = self.transformation
+
+        # rows are transformed all at once
+        return np.asarray(positions, dtype = float) @ transformation[:3, :3].T + transformation[:3, 3]
+
+    def transform_position(self, x, y, z):
+        """
+        Perform the homogeneous transformation on a single position
+        expressed in the "data" frame.
+
+        Return the coordinates x, y, z expressed in Matplotlib frame.
+        """
+
+        transformation = self.transformation
+
+        x_new = transformation[0, 0] * x + transformation[0, 1] * y + transformation[0, 2] * z + transformation[0, 3]
+        y_new = transformation[1, 0] * x + transformation[1, 1] * y + transformation[1, 2] * z + transformation[1, 3]
+        z_new = transformation[2, 0] * x + transformation[2, 1] * y + transformation[2, 2] * z + transformation[2, 3]
+
+        return x_new, y_new, z_new
+
+    def vector_hom_transformation(self, vector):
+        """
+        Perform an homogeneous transformation on a numpy column vector expressed
+        in the "data" frame.
+
+        See update_transformation().
+
+        Return the components of the new vector as a np column vector.
         """
 
         # perform transformation
-        shift = np.transpose(np.array([[0, 0, self.anchors_plane_height]]))
-        vector = self.basis_change * vector + shift
+        vector = self.transform_positions(np.reshape(vector, (1, 3)))
 
-        return vector
+        return vector.T
 
     def draw_static_objects(self):               
         """ 
@@ -299,6 +550,10 @@ class MatplotlibViewerCanvas(FigureCanvas):
         self.draw_data_frame_axes()
         self.draw_ground()
 
+        # static objects are drawn once, in 'on_demand' and 'blit' mode
+        # the figure is not redrawn unless a tag is dirty
+        self.draw_idle()
+
         # TODO: remove me!
         #        plt.show()
             
@@ -1,8 +1,33 @@
 # numpy
 import numpy as np
 
-# lock
-from threading import Lock
+def transform_frames(rotations, translations, length = 1):
+    """
+    Perform the rototranslation of many reference frames at once.
+
+    rotations: array of N rotation matrices, of shape (N, 3, 3)
+    translations: array of N translation vectors, of shape (N, 3)
+    length: length of each axis of the reference frames, in meters
+
+    Return an array of shape (N, 3, 2, 3) containing, for each frame,
+    the origin and the end point of the axes x, y and z.
+    """
+
+    rotations = np.asarray(rotations, dtype = float)
+    translations = np.asarray(translations, dtype = float)
+
+    number_of_frames = rotations.shape[0]
+
+    segments = np.empty((number_of_frames, 3, 2, 3))
+
+    # the origin of each axis is the translation
+    segments[:, :, 0, :] = translations[:, np.newaxis, :]
+
+    # the end point of the axis j is the column j of the rotation
+    # scaled by length, i.e. end[n, j, i] = length * R[n, i, j] + t[n, i]
+    segments[:, :, 1, :] = length * np.einsum('nij->nji', rotations) + translations[:, np.newaxis, :]
+
+    return segments
 
 class ReferenceFrame:
     """
@@ -24,16 +49,17 @@ class ReferenceFrame:
         # store translation vector
         self._translation = translation
 
-        # resolution along axis
-        resolution = 100
+        # store the length of the axes
+        self.length = length
 
-        # sample along axis
-        segment = np.linspace(0, length, resolution)
-        
-        # save cononical base
-        self.canonical_base = {'x': np.array([segment, np.zeros(resolution), np.zeros(resolution)]),
-                               'y': np.array([np.zeros(resolution), segment, np.zeros(resolution)]),
-                               'z': np.array([np.zeros(resolution), np.zeros(resolution), segment])}
+        # axes are straight segments, hence they are represented
+        # by their end points only
+        #
+        # save canonical base, one end point for each row
+        self.canonical_base = length * np.identity(3)
+
+        # index of each axis in the canonical base
+        self.axes_index = {'x': 0, 'y': 1, 'z': 2}
 
         # set axes colors
         self.colors = {'x': 'r', 'y':'g', 'z':'b'}
@@ -42,6 +68,22 @@ class ReferenceFrame:
         # empty dictionary of plots obtained returned by matplotlib
         self.axes_plot = dict()
 
+    def segments(self):
+        """
+        Return the three axes of the reference frame as an array of segments
+        of shape (3, 2, 3), i.e. the origin and the end point of the axes
+        x, y and z, after the rototranslation.
+        """
+
+        # all the axes are rotated with a single matrix product
+        end_points = self.canonical_base @ np.asarray(self.rotation).T + self.translation
+
+        segments = np.empty((3, 2, 3))
+        segments[:, 0, :] = self.translation
+        segments[:, 1, :] = end_points
+
+        return segments
+
     @property
     def rotation(self):
         # get the rotation matrix
@@ -66,47 +108,32 @@ class ReferenceFrame:
         # set the translation vector
         self._translation = translation
 
-    def transform_axis(self, axis_name):
-        """
-        Perform rotrotranslation on an axis of the canonical base
-        given the axis name.
-        """
-
-        # extract the axis depending on its name
-        axis = [row[:] for row in self.canonical_base[axis_name]]
-        
-        # rotate the axis
-        axis_rotated = self.rotation * axis
-
-        # loop over the cartesian coordinates
-        # and add the translation
-        for i in range(3):
-            axis_rotated[i] = axis_rotated[i] + self.translation[i]
-
-        return axis_rotated
-        
     def draw(self, axes):
         """
         Draw the reference frame with three coloured axes.
         """
+        # transform the axes using the current rotation and translation vector
+        segments = self.segments()
+
         # x axis (direction [1, 0, 0] expressed in Matplotlib frame)
-        self.draw_axis(axes, 'x', 0.7, 1)
+        self.draw_axis(axes, 'x', segments, 0.7, 1)
         
         # y axis (direction [0, 1, 0] expressed in Matplotlib frame)
-        self.draw_axis(axes, 'y', 0.7, 1)
+        self.draw_axis(axes, 'y', segments, 0.7, 1)
         
         # z axis (direction [0, 0, 1] expressed in Matplotlib frame)
-        self.draw_axis(axes, 'z', 0.7, 1)
+        self.draw_axis(axes, 'z', segments, 0.7, 1)
 
-    def draw_axis(self, axes, axis_name, alpha, linewidth):
+    def draw_axis(self, axes, axis_name, segments, alpha, linewidth):
         """
-        Draw an axis in axes given its name, alpha channel and linewidth.
+        Draw an axis in axes given its name, the segments returned by segments(),
+        alpha channel and linewidth.
         """
-        # transform the axis using the current rotation and translation vector
-        axis = self.transform_axis(axis_name)
+        # extract the segment of the axis
+        axis = segments[self.axes_index[axis_name]]
 
         # draw axis
-        line, = axes.plot(axis[0].A1, axis[1].A1, axis[2].A1,\
+        line, = axes.plot(axis[:, 0], axis[:, 1], axis[:, 2],\
                                               color = self.colors[axis_name],\
                                               alpha=alpha,\
                                               linewidth = linewidth)
@@ -118,25 +145,25 @@ class ReferenceFrame:
         Update the reference frame.
         """
 
+        # transform the axes using the current rotation and translation vector
+        segments = self.segments()
+
         # x axis (direction [1, 0, 0] expressed in Matplotlib frame)
-        self.update_axis('x')
+        self.update_axis('x', segments)
         
         # y axis (direction [0, 1, 0] expressed in Matplotlib frame)
-        self.update_axis('y')
+        self.update_axis('y', segments)
         
         # z axis (direction [0, 0, 1] expressed in Matplotlib frame)
-        self.update_axis('z')
+        self.update_axis('z', segments)
 
-    def update_axis(self, axis_name):
+    def update_axis(self, axis_name, segments):
         """
-        Update the axis plot.
+        Update the axis plot given the segments returned by segments().
         """
-        # transform the axis using the current rotation and translation vector
-        axis = self.transform_axis(axis_name)
+        # extract the segment of the axis
+        axis = segments[self.axes_index[axis_name]]
         
         # update internal matplolib representation
-        self.axes_plot[axis_name].set_data(axis[0].A1, axis[1].A1)
-        self.axes_plot[axis_name].set_3d_properties(axis[2].A1)
-
-        # TODO:
-        # is draw needed?
+        self.axes_plot[axis_name].set_data(axis[:, 0], axis[:, 1])
+        self.axes_plot[axis_name].set_3d_properties(axis[:, 2])
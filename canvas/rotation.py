@@ -0,0 +1,108 @@
+# numpy
+import numpy as np
+
+def rot_x(rot_angle):
+    """
+    Rotation matrix by rot_angle (rad) about x-axis
+    """
+
+    return rpy_to_rotation_matrix(rot_angle, 0, 0)
+
+def rot_y(rot_angle):
+    """
+    Rotation matrix by rot_angle (rad) about y-axis
+    """
+
+    return rpy_to_rotation_matrix(0, rot_angle, 0)
+
+def rot_z(rot_angle):
+    """
+    Rotation matrix by rot_angle (rad) about z-axis
+    """
+
+    return rpy_to_rotation_matrix(0, 0, rot_angle)
+
+def rpy_to_rotation_matrix(roll, pitch, yaw):
+    """
+    Return the rotation matrix M = RotZ(yaw) . RotY(pitch) . RotX(roll)
+    as a (3, 3) numpy array.
+    """
+
+    return rpy_to_rotation_matrices(np.array([[roll, pitch, yaw]]))[0]
+
+def rpy_to_rotation_matrices(attitudes):
+    """
+    Return the rotation matrices M = RotZ(yaw) . RotY(pitch) . RotX(roll)
+    for a block of attitudes.
+
+    attitudes is an (N, 3) array, one [roll, pitch, yaw] triple (rad) for each row.
+
+    Return an (N, 3, 3) array evaluated in closed form, all the attitudes at once.
+    """
+
+    attitudes = np.asarray(attitudes, dtype = float)
+
+    # sines and cosines of all the angles, one column for each angle
+    cosines = np.cos(attitudes)
+    sines = np.sin(attitudes)
+
+    cr, cp, cy = cosines[:, 0], cosines[:, 1], cosines[:, 2]
+    sr, sp, sy = sines[:, 0], sines[:, 1], sines[:, 2]
+
+    matrices = np.empty((attitudes.shape[0], 3, 3))
+
+    matrices[:, 0, 0] = cy * cp
+    matrices[:, 0, 1] = cy * sp * sr - sy * cr
+    matrices[:, 0, 2] = cy * sp * cr + sy * sr
+
+    matrices[:, 1, 0] = sy * cp
+    matrices[:, 1, 1] = sy * sp * sr + cy * cr
+    matrices[:, 1, 2] = sy * sp * cr - cy * sr
+
+    matrices[:, 2, 0] = -sp
+    matrices[:, 2, 1] = cp * sr
+    matrices[:, 2, 2] = cp * cr
+
+    return matrices
+
+if __name__ == '__main__':
+    # benchmark the closed form against the composition
+    # of three np.matrix objects for each tag
+    import timeit
+
+    def legacy_rotation_matrix(roll, pitch, yaw):
+        """
+        Composition of three np.matrix rotations, as done
+        by TagPositionAttitudeView before the closed form was introduced.
+        """
+
+        matrix_x = np.matrix([[1, 0, 0],
+                              [0, np.cos(roll), -np.sin(roll)],
+                              [0, np.sin(roll), np.cos(roll)]])
+        matrix_y = np.matrix([[np.cos(pitch), 0, np.sin(pitch)],
+                              [0, 1, 0],
+                              [-np.sin(pitch), 0, np.cos(pitch)]])
+        matrix_z = np.matrix([[np.cos(yaw), -np.sin(yaw), 0],
+                              [np.sin(yaw), np.cos(yaw), 0],
+                              [0, 0, 1]])
+
+        return matrix_z * matrix_y * matrix_x
+
+    repetitions = 200
+
+    for number_of_tags in (1, 10, 100):
+        attitudes = np.random.uniform(-np.pi, np.pi, (number_of_tags, 3))
+
+        # check that both paths agree
+        legacy = np.array([legacy_rotation_matrix(*attitude) for attitude in attitudes])
+        assert np.allclose(legacy, rpy_to_rotation_matrices(attitudes))
+
+        legacy_time = timeit.timeit(lambda: [legacy_rotation_matrix(*attitude) for attitude in attitudes],\
+                                    number = repetitions) / repetitions
+        closed_form_time = timeit.timeit(lambda: rpy_to_rotation_matrices(attitudes),\
+                                         number = repetitions) / repetitions
+
+        print(str(number_of_tags) + ' tags: ' +\
+              'np.matrix ' + format(legacy_time * 1e6, '.1f') + ' us, ' +\
+              'closed form ' + format(closed_form_time * 1e6, '.1f') + ' us, ' +\
+              'speedup ' + format(legacy_time / closed_form_time, '.1f') + 'x')
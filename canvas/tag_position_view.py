@@ -6,11 +6,25 @@ import numpy as np
 
 # reference frame
 from canvas.reference_frame import ReferenceFrame
+from canvas.reference_frame import transform_frames
+
+# rotations
+from canvas.rotation import rot_y, rot_z, rpy_to_rotation_matrices
+
+# collection of segments used to draw many reference frames at once
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
 
 class TagPositionAttitudeView:
     """
     Represents the tag position and attitude as a Matplotlib plot
+
+    If axes is None the view does not draw anything by itself and
+    its reference frame is drawn by a MultiTagAttitudeView.
     """
+
+    # length of the axes of the reference frame, in meters
+    frame_length = 0.1
+
     def __init__(self, axes, color):
 
         # save matplotlib axes
@@ -20,68 +34,67 @@ class TagPositionAttitudeView:
 
         # this is a constant offset that take into account the attitude of
         # the DecaWave Tag-One body reference frame w.r.t to the ground
-        self.offset_rotation = self.rot_z(np.pi / 2) * self.rot_y(np.pi)
+        self.offset_rotation = rot_z(np.pi / 2) @ rot_y(np.pi)
         # TODO:
         # pass the color to the RefernceFrame constructor
-        self.reference_frame = ReferenceFrame(self.offset_rotation, length = 0.1)
+        self.reference_frame = ReferenceFrame(self.offset_rotation, length = self.frame_length)
 
         # default reference frame origin 
         self.position = [0, 0, 0]
         # default reference frame attitude (R = P = Y = 0)
         self.attitude = [0, 0, 0]
 
+        # rotation matrix of the current attitude, evaluated when
+        # required and cached until a new pose arrives
+        self._rotation = None
+
         # remember if the axes have already been drawn
         self.axes_already_drawn = False
 
-    def rot_x(self, rot_angle):
-        """
-        Rotation matrix by rot_angle (rad) about x-axis 
+        # version of the pose, incremented at each new pose
+        self.version = 0
+
+        # version of the pose currently shown in the view
+        self.drawn_version = 0
+
+    def rotation_matrix(self):
         """
+        Return the composition of three rotation M = RotZ(Y) . RotY(P) . RotX(R)
+        and the constant offset rotation.
 
-        matrix = np.matrix([[1, 0, 0],
-                            [0, np.cos(rot_angle), -np.sin(rot_angle)],
-                            [0, np.sin(rot_angle), np.cos(rot_angle)]])
+        The matrix is cached until a new pose arrives.
+        """
 
-        return matrix
+        if self._rotation is None:
+            TagPositionAttitudeView.update_rotations([self])
 
+        return self._rotation
 
-        
-    def rot_y(self, rot_angle):
-        """
-        Rotation matrix by rot_angle (rad) about y-axis 
+    @staticmethod
+    def update_rotations(views):
         """
-        
-        matrix = np.matrix([[np.cos(rot_angle), 0, np.sin(rot_angle)],
-                            [0, 1, 0],
-                            [-np.sin(rot_angle), 0, np.cos(rot_angle)]])
+        Evaluate the rotation matrices of the TagPositionAttitudeView objects
+        in views whose cached rotation is not valid anymore.
 
-        return matrix
-        
-    def rot_z(self, rot_angle):
+        The attitudes of all the views are converted at once.
         """
-        Rotation matrix by rot_angle (rad) about z-axis 
-        """
-        
-        matrix = np.matrix([[np.cos(rot_angle), -np.sin(rot_angle), 0],
-                            [np.sin(rot_angle), np.cos(rot_angle), 0],
-                            [0, 0, 1]])
 
-        return matrix
-        
-    def rotation_matrix(self):
-        """
-        Return the composition of three rotation M = RotZ(Y) . RotY(P) . RotX(R)
-        """
-        # evaluate the RPY matrix
+        # views that received a new attitude
+        views = [view for view in views if view._rotation is None]
 
-        roll, pitch, yaw = self.attitude
-        
-        matrix_rpy = self.rot_z(yaw) * self.rot_y(pitch) * self.rot_x(roll)
+        if len(views) == 0:
+            return
+
+        # evaluate the RPY matrices
+        attitudes = np.array([view.attitude for view in views])
+        matrices_rpy = rpy_to_rotation_matrices(attitudes)
 
         # compose with constant offset rotation
-        matrix = self.offset_rotation * matrix_rpy
-        
-        return matrix
+        # (the offset is the same for every view)
+        matrices = views[0].offset_rotation @ matrices_rpy
+
+        for view, matrix in zip(views, matrices):
+            view._rotation = matrix
 
     def new_pose(self, x, y, z, roll, pitch, yaw):
         """
@@ -91,62 +104,152 @@ class TagPositionAttitudeView:
         self.position = [x, y, z]
         self.attitude = [roll, pitch, yaw]
 
-        if not self.axes_already_drawn:
+        # invalidate the cached rotation
+        self._rotation = None
+
+        # mark the view as dirty
+        self.version += 1
+
+        if not self.axes_already_drawn and self.axes is not None:
             self.axes_already_drawn = True
             # draw the reference frame for the first time
             self.reference_frame.draw(self.axes)
 
         
+    @property
+    def artists(self):
+        """
+        Return the list of Matplotlib artists used by the view.
+        """
+
+        return list(self.reference_frame.axes_plot.values())
+
+    @property
+    def has_pose(self):
+        """
+        Return True if at least one pose was received.
+        """
+
+        return self.version > 0
+
+    def get_versioned_pose(self):
+        """
+        Return the version of the pose, the position and
+        the rotation matrix of the reference frame.
+        """
+
+        return self.version, self.position, self.rotation_matrix()
+
+    @property
+    def is_dirty(self):
+        """
+        Return True if a new pose arrived since the last update of the view.
+        """
+
+        return self.version != self.drawn_version
+
     def update_view(self):
         """
         Update the reference frame with current data.
+
+        Return True if the view was updated, False if
+        the pose did not change since the last update.
         """
         
-        if self.axes_already_drawn:
-            # update only if the axes were already drawn for the first time
-            self.reference_frame.translation = self.position
-            self.reference_frame.rotation = self.rotation_matrix()
-            self.reference_frame.update()
+        # update only if the axes were already drawn for the first time
+        # and a new pose is available
+        if not self.axes_already_drawn or not self.is_dirty:
+            return False
+
+        self.reference_frame.translation = self.position
+        self.reference_frame.rotation = self.rotation_matrix()
+        self.reference_frame.update()
+
+        self.drawn_version = self.version
+
+        return True
         
 class TagPositionView:
     """
     Represents the tag position as a Matplotlib scatter object
+
+    If axes is None the view does not own a scatter and
+    its positions are drawn by a MultiTagPositionView.
     """
 
     def __init__(self, axes, buffer_size, color):
 
         # instantiate a scatter with no data
-        self.scatter = axes.scatter(np.zeros(0),\
-                                    np.zeros(0),\
-                                    np.zeros(0),\
-                                    depthshade = 0)
+        if axes is not None:
+            self.scatter = axes.scatter(np.zeros(0),\
+                                        np.zeros(0),\
+                                        np.zeros(0),\
+                                        depthshade = 0)
+        else:
+            self.scatter = None
 
         # instantiate a TagPositionsBuffer
         self._buffer = TagPositionsBuffer(buffer_size)
 
         self.color = color
-        
+
+        # version of the buffer currently shown in the view
+        self.drawn_version = 0
         
     @property
     def buffer(self):
         return self._buffer
 
+    @property
+    def artists(self):
+        """
+        Return the list of Matplotlib artists used by the view.
+        """
+
+        if self.scatter is None:
+            return []
+
+        return [self.scatter]
+
+    @property
+    def is_dirty(self):
+        """
+        Return True if new positions arrived since the last update of the view.
+        """
+
+        return self.buffer.version != self.drawn_version
+
     def new_position(self, x, y, z):
         """
         Add a new tag position to the underlying tag positions buffer.
         """
         self.buffer.add_position(x, y, z)
 
+    def new_positions(self, positions):
+        """
+        Add a block of new tag positions, an (N, 3) array,
+        to the underlying tag positions buffer.
+        """
+        self.buffer.add_positions(positions)
+
     def update_view(self):
         """
         Update the scatter with current data.
+
+        Return True if the view was updated, False if
+        the buffer did not change since the last update.
         """
 
-        # extract new data
-        x, y, z = self.buffer.get_positions()
+        # nothing to do if no new position was added
+        if not self.is_dirty:
+            return False
 
-        # extract the number of elements in the buffer
-        number_of_elements = self.buffer.get_number_of_elements()
+        # extract new data together with its version
+        version, (x, y, z) = self.buffer.get_versioned_positions()
+
+        # the number of elements is taken from the snapshot itself
+        # since the buffer may be filled in the meantime
+        number_of_elements = x.size
 
         color_shade = self.color.get_color_shade(number_of_elements)
 
@@ -154,38 +257,214 @@ class TagPositionView:
         self.scatter._offsets3d = (x, y, z)
         self.scatter._edgecolor3d = color_shade
         self.scatter._facecolor3d = color_shade
+
+        self.drawn_version = version
+
+        return True
+        
+class MultiTagPositionView:
+    """
+    Represents the positions of all the tags as a single Matplotlib scatter object.
+
+    Positions are taken from the buffers of TagPositionView objects
+    instantiated without axes.
+    """
+
+    def __init__(self, axes):
+
+        # instantiate a scatter with no data
+        self.scatter = axes.scatter(np.zeros(0),\
+                                    np.zeros(0),\
+                                    np.zeros(0),\
+                                    depthshade = 0)
+
+    @property
+    def artists(self):
+        """
+        Return the list of Matplotlib artists used by the view.
+        """
+
+        return [self.scatter]
+
+    def update_view(self, views):
+        """
+        Update the scatter with current data of the TagPositionView objects in views.
+
+        Return True if the view was updated, False if
+        no buffer changed since the last update.
+        """
+
+        # nothing to do if no new position was added
+        if not any(view.is_dirty for view in views):
+            return False
+
+        # take a snapshot of each buffer
+        positions = []
+        colors = np.empty((len(views), 3))
+        for index, view in enumerate(views):
+            version, (x, y, z) = view.buffer.get_versioned_positions()
+            positions.append((x, y, z))
+            colors[index] = view.color.color
+            view.drawn_version = version
+
+        # number of points for each tag
+        counts = np.array([x.size for x, y, z in positions], dtype = int)
+        number_of_points = counts.sum()
+
+        # concatenate all the positions
+        x = np.concatenate([p[0] for p in positions])
+        y = np.concatenate([p[1] for p in positions])
+        z = np.concatenate([p[2] for p in positions])
+
+        # the shade of each tag goes from alpha = 0 for the oldest
+        # position to alpha = 1 for the newest position, as in Color.get_color_shade
+        first_point = np.repeat(np.cumsum(counts) - counts, counts)
+        index_in_tag = np.arange(number_of_points) - first_point
+        last_index = np.repeat(counts - 1, counts)
+        alpha = np.ones(number_of_points)
+        np.divide(index_in_tag, last_index, out = alpha, where = last_index > 0)
+
+        color_shade = np.empty((number_of_points, 4))
+        color_shade[:, :3] = np.repeat(colors, counts, axis = 0)
+        color_shade[:, 3] = alpha
+
+        # set new data
+        self.scatter._offsets3d = (x, y, z)
+        self.scatter._edgecolor3d = color_shade
+        self.scatter._facecolor3d = color_shade
+
+        return True
+
+class MultiTagAttitudeView:
+    """
+    Represents the reference frames of all the tags as a single
+    Matplotlib collection of segments.
+
+    Poses are taken from TagPositionAttitudeView objects
+    instantiated without axes.
+    """
+
+    def __init__(self, axes):
+
+        # axes colors, as in ReferenceFrame
+        self.axes_colors = ['r', 'g', 'b']
         
+        # instantiate a collection with no segments
+        self.lines = Line3DCollection([], alpha = 0.7, linewidth = 1)
+        axes.add_collection(self.lines, autolim = False)
+
+    @property
+    def artists(self):
+        """
+        Return the list of Matplotlib artists used by the view.
+        """
+
+        return [self.lines]
+
+    def update_view(self, views):
+        """
+        Update the collection with current poses of the
+        TagPositionAttitudeView objects in views.
+
+        Return True if the view was updated, False if
+        no pose changed since the last update.
+        """
+
+        # nothing to do if no new pose arrived
+        if not any(view.is_dirty for view in views):
+            return False
+
+        # only tags that sent at least a pose are drawn
+        views = [view for view in views if view.has_pose]
+
+        # evaluate the new rotations of all the tags at once
+        TagPositionAttitudeView.update_rotations(views)
+
+        translations = np.empty((len(views), 3))
+        rotations = np.empty((len(views), 3, 3))
+        for index, view in enumerate(views):
+            version, translations[index], rotations[index] = view.get_versioned_pose()
+            view.drawn_version = version
+
+        # transform the reference frames of all the tags at once
+        segments = transform_frames(rotations, translations, TagPositionAttitudeView.frame_length)
+
+        # set new data, three segments for each tag
+        self.lines.set_segments(segments.reshape(-1, 2, 3))
+        self.lines.set_color(self.axes_colors * len(views))
+
+        return True
+
 class TagPositionsBuffer:
     """
     Storage for a fixed number of tag cartesian positions.
+
+    Positions are stored in a circular buffer allocated once
+    at construction time.
     """
 
     def __init__(self, size):
 
         self.size = size
         
-        # instantiate an empty numpy array for each cartesian axis
-        self.data_x = np.zeros(0)
-        self.data_y = np.zeros(0)
-        self.data_z = np.zeros(0)
+        # preallocated storage, one row for each position
+        self.data = np.zeros((size, 3))
+
+        # index of the row that will be written next
+        self.head = 0
+
+        # number of valid rows in the buffer
+        self.count = 0
+
+        # incremented each time a position is added
+        self._version = 0
 
         # data mutex
         self.data_lock = Lock()
 
+    @property
+    def version(self):
+        """
+        Return the version of the buffer content.
+
+        The version is incremented each time a position is added, hence
+        two equal versions imply the same content. Reading an int is atomic
+        so the lock is not required here.
+        """
+
+        return self._version
+
     def get_positions(self):
         """
-        Return the tag positions stored in the buffer.
+        Return the tag positions stored in the buffer
+        sorted from the oldest to the newest.
+        """
+
+        version, positions = self.get_versioned_positions()
+
+        return positions
+
+    def get_versioned_positions(self):
+        """
+        Return the version of the buffer and the tag positions stored in it
+        sorted from the oldest to the newest, as a consistent snapshot.
         """
         
         self.data_lock.acquire()
 
-        data_x_copy = np.copy(self.data_x)
-        data_y_copy = np.copy(self.data_y)
-        data_z_copy = np.copy(self.data_z)
+        if self.count < self.size:
+            # the buffer is not filled yet, valid rows
+            # are the first self.count ones
+            ordered = self.data[:self.count].copy()
+        else:
+            # the oldest position is stored at the head
+            ordered = np.concatenate((self.data[self.head:], self.data[:self.head]))
+
+        version = self._version
 
         self.data_lock.release()
 
-        return data_x_copy, data_y_copy, data_z_copy
+        return version, (ordered[:, 0], ordered[:, 1], ordered[:, 2])
 
     def get_number_of_elements(self):
         """
@@ -193,7 +472,7 @@ class TagPositionsBuffer:
         """
         self.data_lock.acquire()
 
-        number_of_elements = self.data_x.size
+        number_of_elements = self.count
 
         self.data_lock.release()
 
@@ -203,28 +482,59 @@ class TagPositionsBuffer:
         """
         Add a new tag position to the buffer.
         
-        If the buffer is not filled yet the new position is appended.
-        Otherwise the buffer is left-shifted and the new position 
-        is inserted in the last field.
+        The new position is written at the head of the circular buffer.
+        If the buffer is already filled the oldest position is overwritten.
         """
 
         self.data_lock.acquire()
 
-        # append if not filled yet
-        if self.data_x.size < self.size:
-            self.data_x = np.append(self.data_x, x)
-            self.data_y = np.append(self.data_y, y)
-            self.data_z = np.append(self.data_z, z)
-        else:
-            # left shift
-            for i in range(self.size-1):
-                self.data_x[i] = self.data_x[i+1]
-                self.data_y[i] = self.data_y[i+1]
-                self.data_z[i] = self.data_z[i+1]
-
-            # insert in the last field
-            self.data_x[self.size-1] = x
-            self.data_y[self.size-1] = y
-            self.data_z[self.size-1] = z
+        # write in place
+        row = self.data[self.head]
+        row[0] = x
+        row[1] = y
+        row[2] = z
+
+        # advance the head
+        self.head += 1
+        if self.head == self.size:
+            self.head = 0
+
+        if self.count < self.size:
+            self.count += 1
+
+        self._version += 1
+
+        self.data_lock.release()
+
+    def add_positions(self, positions):
+        """
+        Add a block of new tag positions to the buffer.
+
+        positions is an (N, 3) array, positions are added
+        from the first row to the last one.
+        """
+
+        positions = np.asarray(positions)
+
+        # only the newest self.size positions may survive
+        positions = positions[-self.size:]
+        number_of_positions = positions.shape[0]
+
+        if number_of_positions == 0:
+            return
+
+        self.data_lock.acquire()
+
+        # write the block in at most two slices
+        first_slice_size = min(number_of_positions, self.size - self.head)
+        self.data[self.head:self.head + first_slice_size] = positions[:first_slice_size]
+        self.data[:number_of_positions - first_slice_size] = positions[first_slice_size:]
+
+        # advance the head
+        self.head = (self.head + number_of_positions) % self.size
+
+        self.count = min(self.count + number_of_positions, self.size)
+
+        self._version += 1
 
         self.data_lock.release()
@@ -0,0 +1,453 @@
+# asyncio
+import asyncio
+
+# sys
+import os
+
+# pyserial
+import serial
+from serial.serialutil import SerialException
+
+# EVB1000 decoder
+from device.decoder import StreamParser
+
+# VIDs and PIDs of the devices
+from device.vid_pid_list import DeviceVIDPIDList
+from device.vid_pid_list import list_matching_ports
+
+# detection of serial devices plugged or unplugged
+from device.hotplug import HotplugMonitor
+
+# serial port options
+from device.serial_tuning import SerialTuning
+
+class AsyncDevice:
+    """
+    Represents an EVB1000 Tag connected through a serial port,
+    read by an asyncio event loop.
+
+    The non-blocking file descriptor of the port is registered
+    with loop.add_reader(), hence a POSIX event loop is required.
+    """
+
+    # maximum number of bytes read at once from the serial
+    read_buffer_size = 4096
+
+    # number of attempts and initial delay, in seconds, used to open the port
+    open_attempts = 10
+    open_retry_delay = 0.05
+
+    def __init__(self, port, session, serial_tuning = None, sysfs_root = '/sys'):
+
+        # save port
+        self.port = port
+
+        # set device id
+        self.id = port.device
+
+        # session receiving the decoded messages
+        self.session = session
+
+        # serial port options, applied as the threaded backend does
+        if serial_tuning is None:
+            serial_tuning = SerialTuning()
+        self.serial_tuning = serial_tuning
+        self.sysfs_root = sysfs_root
+
+        # outcome of the options applied when the port was opened
+        self.tuning_report = []
+
+        # instantiate and configure Serial
+        self.serial = serial.Serial()
+        self.serial.port = self.port.device
+        self.serial_tuning.configure(self.serial)
+
+        # override the size of the reads, if required
+        if self.serial_tuning.read_buffer_size is not None:
+            self.read_buffer_size = self.serial_tuning.read_buffer_size
+
+        # parser of the incoming byte stream
+        self.parser = StreamParser()
+
+        # file descriptor registered with the event loop
+        self.fd = None
+
+    def __str__(self):
+        return self.port.device
+
+    async def open(self):
+        """
+        Open the serial port and start reading from it.
+
+        Even if the device is detected it may be not ready to be opened
+        yet, hence the attempt is repeated with an increasing delay.
+
+        Return True if the port was opened.
+        """
+
+        delay = self.open_retry_delay
+
+        for attempt in range(self.open_attempts):
+            try:
+                self.serial.open()
+                break
+            except SerialException:
+                await asyncio.sleep(delay)
+                delay = delay * 2
+        else:
+            return False
+
+        self.tuning_report = self.serial_tuning.apply(self.serial, self.sysfs_root)
+
+        # pyserial opens the port in non-blocking mode
+        self.fd = self.serial.fileno()
+        asyncio.get_running_loop().add_reader(self.fd, self.on_readable)
+
+        return True
+
+    def on_readable(self):
+        """
+        Read the bytes available and hand the decoded messages to the session.
+        """
+
+        try:
+            chunk = os.read(self.fd, self.read_buffer_size)
+        except BlockingIOError:
+            # spurious wakeup, no data actually available
+            return
+        except OSError:
+            chunk = b''
+
+        if len(chunk) == 0:
+            # the device was disconnected or an i/o error occurred,
+            # the session opens the port again if it is still there
+            self.close()
+            self.session.device_closed(self)
+            return
+
+        for message in self.parser.feed(chunk):
+            self.session.put_sample(self, message)
+
+    def close(self):
+        """
+        Stop reading and close the serial port.
+        """
+
+        if self.fd is not None:
+            asyncio.get_running_loop().remove_reader(self.fd)
+            self.fd = None
+
+        self.serial.close()
+
+class AsyncPortWatcher:
+    """
+    Watch the serial ports matching a list of VIDs and PIDs.
+
+    Ports are scanned in the default executor, so that the event loop is
+    never blocked, each time a serial device is plugged or unplugged or,
+    if this cannot be detected, every scan_interval seconds.
+
+    Ports are scanned at least every rescan_interval seconds
+    anyway, so that missed hotplug events are recovered.
+
+    A port whose device was closed, e.g. after an i/o error, is forgotten
+    using forget_port(), so that it is reported again as new if it is
+    still there at the next scan.
+    """
+
+    # maximum time between two scans if hotplug is detected, in seconds
+    rescan_interval = 5.0
+
+    def __init__(self, vid_pid_list, scan_interval = 1.0):
+
+        # store list of PIDs and VIDs of devices belonging to the EVB1000 system
+        self.target_vid_pid = vid_pid_list.get_vid_pid_list()
+
+        # time between two scans
+        self.scan_interval = scan_interval
+
+        # ports found in the last scan, indexed by device path
+        self.connected_ports = dict()
+
+        # detection of serial devices plugged or unplugged
+        self.hotplug_monitor = HotplugMonitor()
+
+        # set to scan the ports at once
+        self.rescan_event = asyncio.Event()
+
+    def scan(self):
+        """
+        Return a dictionary of the ports matching the target VIDs and PIDs
+        indexed by device path.
+        """
+
+        return {p.device: p for p in list_matching_ports(self.target_vid_pid)}
+
+    def forget_port(self, path):
+        """
+        Remove the port at path from the ports found in the last scan
+        and scan the ports again at once, so that the port is reported
+        as new if it is still connected.
+        """
+
+        self.connected_ports.pop(path, None)
+        self.rescan_event.set()
+
+    async def wait_rescan(self, timeout):
+        """
+        Wait until rescan_event is set or until timeout expires.
+
+        Return True if rescan_event was set.
+        """
+
+        try:
+            await asyncio.wait_for(self.rescan_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+        self.rescan_event.clear()
+
+        return True
+
+    async def wait_for_hotplug(self):
+        """
+        Wait until a serial device is plugged or unplugged, at most
+        rescan_interval seconds, or, if this cannot be detected,
+        wait scan_interval seconds. Return at once if forget_port()
+        was called in the meantime.
+        """
+
+        if self.rescan_event.is_set():
+            self.rescan_event.clear()
+            return
+
+        if not self.hotplug_monitor.available:
+            await self.wait_rescan(self.scan_interval)
+            return
+
+        # nodes may have been created in a directory that just appeared
+        if self.hotplug_monitor.watch_missing_paths():
+            return
+
+        loop = asyncio.get_running_loop()
+        plugged = []
+
+        def on_event():
+            # only events concerning serial devices are relevant
+            if self.hotplug_monitor.read_events():
+                plugged.append(True)
+                self.rescan_event.set()
+
+        loop.add_reader(self.hotplug_monitor.fileno(), on_event)
+        try:
+            # scan the ports anyway when the wait expires
+            await self.wait_rescan(self.rescan_interval)
+        finally:
+            loop.remove_reader(self.hotplug_monitor.fileno())
+
+        if plugged:
+            # devices create several nodes and links in a row
+            # hence the following events are collected too
+            await asyncio.sleep(self.hotplug_monitor.settle_time)
+            self.hotplug_monitor.read_events()
+
+    async def changes(self):
+        """
+        Asynchronous generator of the changes of the connected ports.
+
+        Yield a tuple (new_ports, removed_ports) each time at least
+        one port is connected or removed.
+        """
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            ports = await loop.run_in_executor(None, self.scan)
+
+            new_ports = [ports[path] for path in ports.keys() - self.connected_ports.keys()]
+            removed_ports = [self.connected_ports[path] for path in self.connected_ports.keys() - ports.keys()]
+
+            self.connected_ports = ports
+
+            if new_ports or removed_ports:
+                yield new_ports, removed_ports
+
+            await self.wait_for_hotplug()
+
+    def close(self):
+        """
+        Stop watching the serial device nodes.
+        """
+
+        self.hotplug_monitor.close()
+
+class AsyncSession:
+    """
+    Manage EVB1000 Tag devices using asyncio, without PyQt, e.g.
+
+        async with AsyncSession(DeviceVIDPIDList('config.ini')) as session:
+            async for device, message in session.samples():
+                print(device, message)
+
+    Devices are opened and closed as their ports are connected and removed.
+    Decoded messages of all the devices are collected in a bounded queue
+    consumed using samples(). If the consumer falls behind the oldest
+    samples are dropped and counted in dropped_samples.
+    """
+
+    def __init__(self, vid_pid_list, queue_size = 1024, scan_interval = 1.0, sysfs_root = '/sys'):
+
+        # watcher of the serial ports
+        self.watcher = AsyncPortWatcher(vid_pid_list, scan_interval)
+
+        # store serial port options of the devices
+        self.vid_pid_list = vid_pid_list
+
+        # mount point of sysfs, where some serial options are written
+        self.sysfs_root = sysfs_root
+
+        # configured devices indexed by id
+        self.devices = dict()
+
+        # tasks opening the new ports indexed by device path
+        self.open_tasks = dict()
+
+        # pending samples, i.e. tuples (device, message)
+        self.queue = asyncio.Queue(maxsize = queue_size)
+
+        # number of samples dropped
+        self.dropped_samples = 0
+
+        # task running the watcher
+        self.watcher_task = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def start(self):
+        """
+        Start watching the serial ports.
+        """
+
+        self.watcher_task = asyncio.get_running_loop().create_task(self.watch_ports())
+
+    async def watch_ports(self):
+        """
+        Open new devices and close removed ones.
+        """
+
+        loop = asyncio.get_running_loop()
+
+        async for new_ports, removed_ports in self.watcher.changes():
+            for p in removed_ports:
+                task = self.open_tasks.pop(p.device, None)
+                if task is not None:
+                    task.cancel()
+
+                device = self.devices.pop(p.device, None)
+                if device is not None:
+                    device.close()
+
+            # ports are opened concurrently, so that a port
+            # not ready yet does not delay the others
+            for p in new_ports:
+                self.open_tasks[p.device] = loop.create_task(self.open_device(p))
+
+    async def open_device(self, port):
+        """
+        Open the device connected to port.
+
+        If the port cannot be opened it is forgotten by the watcher,
+        hence another attempt is made at the next scan.
+        """
+
+        device = AsyncDevice(port, self, self.vid_pid_list.get_serial_tuning(port.vid, port.pid), self.sysfs_root)
+
+        try:
+            opened = await device.open()
+        finally:
+            # the port may have been removed and connected again in the meantime
+            if self.open_tasks.get(port.device) is asyncio.current_task():
+                del self.open_tasks[port.device]
+
+        if opened:
+            self.devices[device.id] = device
+        else:
+            self.watcher.connected_ports.pop(port.device, None)
+
+    def device_closed(self, device):
+        """
+        Forget a device that closed itself, e.g. after an i/o error,
+        the port is opened again if it is still connected.
+        """
+
+        if self.devices.get(device.id) is device:
+            del self.devices[device.id]
+
+        self.watcher.forget_port(device.port.device)
+
+    def put_sample(self, device, message):
+        """
+        Add a sample to the queue, dropping the oldest one if the queue is full.
+        """
+
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped_samples += 1
+
+        self.queue.put_nowait((device, message))
+
+    async def samples(self):
+        """
+        Asynchronous generator of the samples received from all the devices.
+
+        Yield tuples (device, message) where message is a MessageRecord.
+        """
+
+        while True:
+            yield await self.queue.get()
+
+    async def close(self):
+        """
+        Stop watching the serial ports and close all the devices.
+
+        The session cannot be started again.
+        """
+
+        if self.watcher_task is not None:
+            self.watcher_task.cancel()
+            try:
+                await self.watcher_task
+            except asyncio.CancelledError:
+                pass
+            self.watcher_task = None
+
+        for task in self.open_tasks.values():
+            task.cancel()
+
+        self.open_tasks = dict()
+
+        for device in self.devices.values():
+            device.close()
+
+        self.devices = dict()
+
+        # release the inotify file descriptor
+        self.watcher.close()
+
+if __name__ == '__main__':
+    # print the samples received from the devices listed in config.ini
+
+    async def print_samples():
+        async with AsyncSession(DeviceVIDPIDList('config.ini')) as session:
+            async for device, message in session.samples():
+                print(str(device) + ' ' + str(message))
+
+    try:
+        asyncio.run(print_samples())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,392 @@
+# binary records
+import struct
+
+# index file
+import json
+
+# multi-threading
+from threading import Thread, Event
+import queue
+
+# time measurement
+from time import monotonic, time
+import bisect
+
+# capture file layout
+#
+# header: magic, wall clock time and monotonic time at the start of the capture
+# followed by records made of a RECORD header and length bytes of payload
+# - RECORD_PORT: definition of a port index, the payload is the port path in utf-8
+# - RECORD_CHUNK: bytes received from a port at timestamp (monotonic time, in seconds)
+MAGIC = b'EVBCAP01'
+HEADER = struct.Struct('<8sdd')
+RECORD = struct.Struct('<BdHI')
+RECORD_PORT = 0
+RECORD_CHUNK = 1
+
+class InvalidCaptureFile(Exception):
+        pass
+
+def index_path(path):
+    """
+    Return the path of the index of the capture file at path.
+    """
+
+    return path + '.idx'
+
+class CaptureRecorder(Thread):
+    """
+    Record the raw bytes received from the devices in an append-only
+    capture file, each chunk with a monotonic timestamp and its port.
+
+    record() is called by the threads reading the ports and never blocks:
+    chunks are handed to a writer thread through a bounded queue and
+    dropped, and counted, if the writer falls behind.
+
+    Every index_interval seconds of capture the offset of the next record
+    is appended to a sparse index (a JSON line file next to the capture)
+    so that CaptureReader can start reading at any time without scanning.
+
+    start_time and wall_start_time, the monotonic and wall clock times at
+    the start of the capture, are given only when a capture is rebuilt,
+    e.g. from an archive, with chunks written using write_chunk().
+    """
+
+    def __init__(self, path, queue_size = 4096, index_interval = 1.0,\
+                 start_time = None, wall_start_time = None):
+        # call Thread constructor
+        Thread.__init__(self, daemon = True)
+
+        self.path = path
+        self.index_interval = index_interval
+
+        # never overwrite a previous capture
+        self.file = open(path, 'xb')
+        self.index_file = open(index_path(path), 'x')
+
+        if start_time is None:
+            start_time = monotonic()
+        if wall_start_time is None:
+            wall_start_time = time()
+
+        self.start_time = start_time
+        self.file.write(HEADER.pack(MAGIC, wall_start_time, self.start_time))
+
+        # chunks waiting to be written, tuples (timestamp, port path, bytes)
+        self.queue = queue.Queue(maxsize = queue_size)
+
+        # port indices indexed by port path
+        self.port_indices = dict()
+
+        # timestamp of the next index entry
+        self.next_index_time = self.start_time
+
+        # set when the recorder has to stop
+        self.stop_event = Event()
+
+        # statistics
+        self.recorded_chunks = 0
+        self.recorded_bytes = 0
+        self.dropped_chunks = 0
+        self.dropped_bytes = 0
+
+    def record(self, port, chunk, timestamp = None):
+        """
+        Record a chunk of bytes received from port, e.g. '/dev/ttyUSB0'.
+
+        chunk is copied, hence it can be a view on a reusable buffer.
+        """
+
+        if timestamp is None:
+            timestamp = monotonic()
+
+        try:
+            self.queue.put_nowait((timestamp, port, bytes(chunk)))
+        except queue.Full:
+            self.dropped_chunks += 1
+            self.dropped_bytes += len(chunk)
+
+    def write_record(self, kind, timestamp, port_index, payload):
+        self.file.write(RECORD.pack(kind, timestamp, port_index, len(payload)))
+        self.file.write(payload)
+
+    def write_index_entry(self, entry):
+        self.index_file.write(json.dumps(entry) + '\n')
+
+    def write_chunk(self, timestamp, port, chunk):
+        """
+        Write a chunk, the definition of its port if new and an index entry if due.
+        """
+
+        if timestamp >= self.next_index_time:
+            self.write_index_entry({'time': timestamp, 'offset': self.file.tell()})
+            self.next_index_time = timestamp + self.index_interval
+
+        port_index = self.port_indices.get(port)
+        if port_index is None:
+            port_index = len(self.port_indices)
+            self.port_indices[port] = port_index
+
+            self.write_record(RECORD_PORT, timestamp, port_index, port.encode('utf-8'))
+            self.write_index_entry({'port': port_index, 'name': port})
+
+        self.write_record(RECORD_CHUNK, timestamp, port_index, chunk)
+
+        self.recorded_chunks += 1
+        self.recorded_bytes += len(chunk)
+
+    def run(self):
+        """
+        Thread main method.
+        """
+
+        while True:
+            try:
+                item = self.queue.get(timeout = 0.1)
+            except queue.Empty:
+                if self.stop_event.is_set():
+                    break
+                continue
+
+            self.write_chunk(*item)
+
+            # write all the chunks available before flushing
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                self.write_chunk(*item)
+
+            self.file.flush()
+            self.index_file.flush()
+
+        self.file.close()
+        self.index_file.close()
+
+    def close(self, timeout = None):
+        """
+        Write the pending chunks and close the capture.
+        """
+
+        self.stop_event.set()
+
+        if self.is_alive():
+            self.join(timeout)
+        elif not self.file.closed:
+            # never started
+            self.file.close()
+            self.index_file.close()
+
+    def statistics(self):
+        """
+        Return a dictionary containing the number of chunks
+        and bytes recorded and dropped.
+        """
+
+        return {'recorded_chunks': self.recorded_chunks,
+                'recorded_bytes': self.recorded_bytes,
+                'dropped_chunks': self.dropped_chunks,
+                'dropped_bytes': self.dropped_bytes}
+
+class CaptureReader:
+    """
+    Read a capture file written by CaptureRecorder.
+
+    The sparse index, if available, is used to start reading at a given
+    time without scanning the file, otherwise it is rebuilt by scanning it.
+    A capture still being written, or truncated, can be read up to its
+    last complete record.
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+
+        if len(header) < HEADER.size:
+            raise InvalidCaptureFile
+
+        magic, self.wall_start_time, self.start_time = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise InvalidCaptureFile
+
+        # port paths indexed by port index
+        self.ports = dict()
+
+        # sparse index, sorted times and the corresponding offsets
+        self.index_times = []
+        self.index_offsets = []
+
+        if not self.load_index():
+            self.rebuild_index()
+
+    def load_index(self):
+        """
+        Load the index file.
+
+        Return False if the index file does not exist.
+        """
+
+        try:
+            index_file = open(index_path(self.path), 'r')
+        except FileNotFoundError:
+            return False
+
+        with index_file:
+            for line in index_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may be incomplete
+                    break
+
+                if 'port' in entry:
+                    self.ports[entry['port']] = entry['name']
+                else:
+                    self.index_times.append(entry['time'])
+                    self.index_offsets.append(entry['offset'])
+
+        return True
+
+    def rebuild_index(self, index_interval = 1.0):
+        """
+        Rebuild the index scanning the whole capture.
+        """
+
+        self.ports = dict()
+        self.index_times = []
+        self.index_offsets = []
+
+        next_index_time = None
+
+        for offset, kind, timestamp, port_index, payload in self.scan(HEADER.size):
+            if next_index_time is None or timestamp >= next_index_time:
+                self.index_times.append(timestamp)
+                self.index_offsets.append(offset)
+                next_index_time = timestamp + index_interval
+
+    def scan(self, offset):
+        """
+        Generator of the records starting at offset.
+
+        Yield tuples (offset, kind, timestamp, port index, payload).
+        Port definitions are stored in ports.
+        """
+
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+
+            while True:
+                header = f.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    break
+
+                kind, timestamp, port_index, length = RECORD.unpack(header)
+
+                payload = f.read(length)
+                if len(payload) < length:
+                    break
+
+                if kind == RECORD_PORT:
+                    self.ports[port_index] = payload.decode('utf-8')
+
+                yield offset, kind, timestamp, port_index, payload
+
+                offset += RECORD.size + length
+
+    def offset_at(self, timestamp):
+        """
+        Return the offset of the record to start from to read the chunks
+        received from time timestamp on.
+        """
+
+        i = bisect.bisect_right(self.index_times, timestamp) - 1
+        if i < 0:
+            return HEADER.size
+
+        return self.index_offsets[i]
+
+    def chunks(self, start_time = None, end_time = None):
+        """
+        Generator of the chunks received between start_time and end_time
+        (monotonic times, as recorded), the whole capture by default.
+
+        Yield tuples (timestamp, port path, bytes).
+        """
+
+        offset = HEADER.size
+        if start_time is not None:
+            offset = self.offset_at(start_time)
+
+        for offset, kind, timestamp, port_index, payload in self.scan(offset):
+            if kind != RECORD_CHUNK:
+                continue
+
+            if start_time is not None and timestamp < start_time:
+                continue
+
+            if end_time is not None and timestamp > end_time:
+                break
+
+            yield timestamp, self.ports[port_index], payload
+
+    def port_paths(self):
+        """
+        Return the list of the paths of all the ports of the capture.
+
+        Ports defined after the last index entry, e.g. if the index is
+        partial, are found scanning the records that follow it.
+        """
+
+        offset = HEADER.size
+        if self.index_offsets:
+            offset = self.index_offsets[-1]
+
+        for record in self.scan(offset):
+            pass
+
+        return [self.ports[port_index] for port_index in sorted(self.ports)]
+
+    def end_time(self):
+        """
+        Return the timestamp of the last chunk, or the start time if the capture is empty.
+        """
+
+        offset = HEADER.size
+        if self.index_offsets:
+            offset = self.index_offsets[-1]
+
+        end = self.start_time
+        for offset, kind, timestamp, port_index, payload in self.scan(offset):
+            end = timestamp
+
+        return end
+
+    def wall_time(self, timestamp):
+        """
+        Return the wall clock time (seconds since the epoch)
+        corresponding to a recorded timestamp.
+        """
+
+        return self.wall_start_time + (timestamp - self.start_time)
+
+if __name__ == '__main__':
+    # print a summary of a capture
+    import sys
+
+    reader = CaptureReader(sys.argv[1])
+
+    chunks = dict()
+    sizes = dict()
+    for timestamp, port, chunk in reader.chunks():
+        chunks[port] = chunks.get(port, 0) + 1
+        sizes[port] = sizes.get(port, 0) + len(chunk)
+
+    print('duration ' + format(reader.end_time() - reader.start_time, '.1f') + ' s, ' +\
+          str(len(reader.index_times)) + ' index entries')
+    for port in sorted(chunks):
+        print(port + ': ' + str(chunks[port]) + ' chunks, ' + str(sizes[port]) + ' bytes')
@@ -0,0 +1,163 @@
+# PyQt
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+
+# time measurement
+from time import monotonic
+
+class DataCoalescer(QObject):
+    """
+    Deliver the messages of all the devices in batches,
+    at most once per delivery interval.
+
+    Devices signal that new data is available at most once until their
+    queue is drained, the coalescer collects these signals and, when the
+    delivery interval has elapsed since the last delivery, drains all the
+    devices that signaled and emits a single batch.
+
+    Lives in the thread of the consumer (the GUI thread).
+    """
+
+    #pyqt signals are class attributes
+    new_batch_available = pyqtSignal(list)
+
+    def __init__(self, device_manager, rate):
+        """
+        device_manager: the DeviceManager owning the devices
+        rate: maximum number of batches delivered per second
+        """
+        # call QObject constructor
+        QObject.__init__(self)
+
+        # save reference to instance of the device manager
+        self.dev_man = device_manager
+
+        # minimum time between two deliveries, in seconds
+        self.interval = 1.0 / rate
+
+        # ids of the devices that have pending messages
+        self.pending_devices = set()
+
+        # time of the last delivery
+        self.last_delivery = 0
+
+        # single shot timer used to schedule the next delivery
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.deliver)
+
+        # metrics
+        self.notifications = 0
+        self.batches = 0
+        self.delivered_messages = 0
+        self.dropped_messages = 0
+        self.last_queue_depth = 0
+        self.max_queue_depth = 0
+
+    def register_device(self, device):
+        """
+        Receive the notifications of a new device.
+        """
+
+        device.register_new_data_available_slot(self.data_pending)
+
+        # the device may have signaled before the slot was connected,
+        # in that case it would not signal again until drained
+        self.data_pending(device.id)
+
+    @pyqtSlot(str)
+    def data_pending(self, device_id):
+        """
+        Take note that device_id has pending messages
+        and schedule a delivery if none is scheduled yet.
+        """
+
+        self.notifications += 1
+
+        self.pending_devices.add(device_id)
+
+        if self.timer.isActive():
+            return
+
+        # deliver as soon as the interval since the last delivery has elapsed
+        remaining = self.interval - (monotonic() - self.last_delivery)
+        self.timer.start(max(0, int(remaining * 1000)))
+
+    @pyqtSlot()
+    def deliver(self):
+        """
+        Drain the devices with pending messages and emit a batch.
+
+        The batch is a list of tuples (device, messages, timestamps, dropped)
+        where messages is the list of pending messages of the device,
+        timestamps the list of their reception times and dropped is the
+        number of messages the device dropped since the last batch.
+        """
+
+        self.last_delivery = monotonic()
+
+        batch = []
+        queue_depth = 0
+
+        for device_id in self.pending_devices:
+            # retrieve device from device manager
+            try:
+                device = self.dev_man.device(device_id)
+            except KeyError:
+                # this could happen if a device has been removed
+                # by the Device Manager but the associated thread
+                # hasn't stopped yet
+                continue
+
+            messages, timestamps = device.drain_with_timestamps()
+            dropped = device.dropped_messages
+
+            # the queue may have been drained after the notification
+            if len(messages) == 0 and dropped == 0:
+                continue
+
+            queue_depth += len(messages)
+            self.dropped_messages += dropped
+
+            batch.append((device, messages, timestamps, dropped))
+
+        self.pending_devices = set()
+
+        if len(batch) == 0:
+            return
+
+        # update metrics
+        self.batches += 1
+        self.delivered_messages += queue_depth
+        self.last_queue_depth = queue_depth
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+        # signal the consumer that a new batch is available
+        self.new_batch_available.emit(batch)
+
+    def metrics(self):
+        """
+        Return a dictionary containing the delivery metrics:
+        - notifications: number of signals received from the devices
+        - batches: number of batches delivered
+        - delivered_messages: number of messages delivered
+        - dropped_messages: number of messages dropped by the devices
+        - last_queue_depth: number of messages in the last batch
+        - max_queue_depth: maximum number of messages in a batch
+        - coalescing_ratio: average number of messages per batch
+        """
+
+        if self.batches > 0:
+            coalescing_ratio = self.delivered_messages / self.batches
+        else:
+            coalescing_ratio = 0.0
+
+        return {'notifications': self.notifications,
+                'batches': self.batches,
+                'delivered_messages': self.delivered_messages,
+                'dropped_messages': self.dropped_messages,
+                'last_queue_depth': self.last_queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'coalescing_ratio': coalescing_ratio}
+
+    def register_new_batch_available_slot(self, slot):
+        self.new_batch_available.connect(slot)
@@ -1,42 +1,341 @@
 import struct
+import binascii
 
-def decode_unsigned_int(string):
+# numpy
+import numpy as np
+
+class InvalidDataFromEVB1000(Exception):
+    pass
+
+# characters allowed in the items of a message coded in hex
+HEX_DIGITS = b'0123456789abcdefABCDEF'
+
+# maximum number of hex digits of a tag id, an unsigned 32 bits integer
+MAX_TAG_ID_DIGITS = 8
+
+def valid_tag_id(tag_id):
     """
-    Return the unsigned int coded in the hex string.
+    Return True if tag_id, as bytes, is made of 1 to MAX_TAG_ID_DIGITS hex digits.
+
+    int(tag_id, 16) alone would accept signs, underscores, the '0x'
+    prefix and values not fitting in 32 bits.
     """
-    return int(string,16)
 
-def decode_float(string):
+    return 0 < len(tag_id) <= MAX_TAG_ID_DIGITS and\
+           len(tag_id.translate(None, HEX_DIGITS)) == 0
+
+class MessageRecord:
     """
-    Return the float coded in the hex string.
+    Base class of the records filled by the decoder, one for each message.
+
+    Records use __slots__ so that each message costs a single small object.
+    Subclasses define msg_type and list tag_id followed by
+    the value fields in __slots__.
     """
-    try:
-        hex_code = bytes.fromhex(string)
-    except ValueError:
-        raise InvalidDataFromEVB1000
-    
-    unpacked = struct.unpack('>f', hex_code)
-    return unpacked[0]
 
-def decode_string(string):
+    __slots__ = ()
+
+    # message type, e.g. 'tpr'
+    msg_type = ''
+
+    @property
+    def fields(self):
+        """
+        Return the names of all the fields, as in MessageSchema.fields.
+        """
+
+        return ('msg_type',) + type(self).__slots__
+
+    def as_dict(self):
+        """
+        Return the record as a dictionary.
+        """
+
+        return {field: getattr(self, field) for field in self.fields}
+
+    def __repr__(self):
+        return type(self).__name__ + '(' + str(self.as_dict()) + ')'
+
+class TagPositionReport(MessageRecord):
+    """
+    Tag position report, msg_type = 'tpr'.
+    """
+
+    __slots__ = ('tag_id', 'x', 'y', 'z')
+
+    msg_type = 'tpr'
+
+    def __init__(self, tag_id, x, y, z):
+        self.tag_id = tag_id
+        self.x = x
+        self.y = y
+        self.z = z
+
+class AnchorPositionsReport(MessageRecord):
     """
-    Return the string as is.
+    Anchors positions report, msg_type = 'apr'.
     """
-    return string
 
-def select_decoder(type_name):
+    __slots__ = ('tag_id',
+                 'a0_x', 'a0_y', 'a0_z',
+                 'a1_x', 'a1_y', 'a1_z',
+                 'a2_x', 'a2_y', 'a2_z',
+                 'a3_x', 'a3_y', 'a3_z')
+
+    msg_type = 'apr'
+
+    def __init__(self, tag_id,
+                 a0_x, a0_y, a0_z,
+                 a1_x, a1_y, a1_z,
+                 a2_x, a2_y, a2_z,
+                 a3_x, a3_y, a3_z):
+        self.tag_id = tag_id
+        self.a0_x = a0_x
+        self.a0_y = a0_y
+        self.a0_z = a0_z
+        self.a1_x = a1_x
+        self.a1_y = a1_y
+        self.a1_z = a1_z
+        self.a2_x = a2_x
+        self.a2_y = a2_y
+        self.a2_z = a2_z
+        self.a3_x = a3_x
+        self.a3_y = a3_y
+        self.a3_z = a3_z
+
+class TagPoseEstimate(MessageRecord):
     """
-    Return a different decoder depending on type_name.
+    Tag estimated position and attitude (roll R, pitch P, yaw Y), msg_type = 'kmf'.
     """
-    if type_name == 'u':
-        return decode_unsigned_int
-    elif type_name == 'f':
-        return decode_float
-    elif type_name == 's':
-        return decode_string
 
-class InvalidDataFromEVB1000(Exception):
-    pass
+    __slots__ = ('tag_id', 'x', 'y', 'z', 'R', 'P', 'Y')
+
+    msg_type = 'kmf'
+
+    def __init__(self, tag_id, x, y, z, R, P, Y):
+        self.tag_id = tag_id
+        self.x = x
+        self.y = y
+        self.z = z
+        self.R = R
+        self.P = P
+        self.Y = Y
+
+class MessageSchema:
+    """
+    Structure of a message type sent by the EVB1000 serial.
+
+    A message is a line of items separated by a space
+
+        msg_type tag_id value_0 ... value_N-1
+
+    where msg_type is a 3 characters long string, tag_id is an unsigned int
+    coded in hex and each value is a big endian float coded in hex.
+
+    The schema is compiled once: all the values of a message are decoded
+    with a single precompiled struct.Struct and stored in a record_class
+    instance, a MessageRecord subclass whose fields are named after the
+    message fields.
+    """
+
+    def __init__(self, record_class):
+
+        # class of the decoded messages
+        self.record_class = record_class
+
+        # message type, e.g. 'tpr'
+        self.msg_type = record_class.msg_type
+
+        # names of the float fields
+        self.value_fields = record_class.__slots__[1:]
+
+        # names of all the fields
+        self.fields = ('msg_type', 'tag_id') + self.value_fields
+
+        # decoder of the concatenated payload
+        self.struct = struct.Struct('>' + 'f' * len(self.value_fields))
+
+        # length of the payload coded in hex, without spaces
+        self.payload_hex_size = 2 * self.struct.size
+
+        # type of the records returned by decode_batch()
+        self.dtype = np.dtype([('tag_id', np.uint32)] +\
+                              [(field, np.float32) for field in self.value_fields])
+
+    def decode(self, line):
+        """
+        Return a record containing the fields decoded from the
+        message line, a string without the trailing '\\r\\n'.
+
+        Raise InvalidDataFromEVB1000 if the line does not match the schema.
+        """
+
+        try:
+            # split type, tag id and payload
+            msg_type, tag_id, payload = line.split(' ', 2)
+
+            # bytes.fromhex skips the spaces between the values
+            # hence the payload is decoded at once
+            values = self.struct.unpack(bytes.fromhex(payload))
+
+            if not valid_tag_id(tag_id.encode('ascii')):
+                raise ValueError
+
+            tag_id = int(tag_id, 16)
+        except (ValueError, struct.error):
+            raise InvalidDataFromEVB1000
+
+        return self.record_class(tag_id, *values)
+
+    def encode(self, record):
+        """
+        Return the message line, as bytes terminated by '\\r\\n',
+        coding a record as the EVB1000 serial does, i.e. the inverse of decode().
+        """
+
+        values = [getattr(record, field) for field in self.value_fields]
+        payload = binascii.hexlify(self.struct.pack(*values))
+
+        # one item of 8 hex digits for each value
+        items = [self.msg_type.encode('ascii'), format(record.tag_id, '02x').encode('ascii')]
+        items += [payload[i:i + 8] for i in range(0, len(payload), 8)]
+
+        return b' '.join(items) + b'\r\n'
+
+# registry of the message types that can be decoded
+message_schemas = dict()
+
+# same registry indexed by the message type as bytes
+message_schemas_by_header = dict()
+
+def register_message_schema(schema):
+    """
+    Add a MessageSchema to the registry of the message types that can be decoded.
+    """
+
+    message_schemas[schema.msg_type] = schema
+    message_schemas_by_header[schema.msg_type.encode('ascii')] = schema
+
+def decode_batch(buffer):
+    """
+    Decode many lines at once.
+
+    buffer is a bytes object containing lines terminated by '\\r\\n' (or '\\n'),
+    e.g. a chunk read from the serial or the content of a capture file.
+
+    Return a tuple (arrays, malformed) where
+    - arrays is a dictionary containing, for each message type found
+      in the buffer, a numpy structured array with fields
+      tag_id, followed by the value fields of the MessageSchema
+    - malformed is the list of the indices of the lines that could
+      not be decoded (an unterminated last line is considered malformed)
+
+    Empty lines are ignored.
+    """
+
+    lines = buffer.split(b'\n')
+
+    # the last item is empty if the buffer ends with a terminator
+    last_line = lines.pop()
+    malformed = []
+    if len(last_line) > 0:
+        malformed.append(len(lines))
+
+    # tag ids, payloads and line indices grouped by message type
+    groups = dict()
+
+    for index, line in enumerate(lines):
+        if line.endswith(b'\r'):
+            line = line[:-1]
+
+        if len(line) == 0:
+            continue
+
+        # split type, tag id and payload
+        items = line.split(b' ', 2)
+        schema = message_schemas_by_header.get(items[0])
+        if schema is None or len(items) != 3:
+            malformed.append(index)
+            continue
+
+        # payload without the spaces between values
+        payload = items[2].replace(b' ', b'')
+        if len(payload) != schema.payload_hex_size or not valid_tag_id(items[1]):
+            malformed.append(index)
+            continue
+
+        group = groups.setdefault(schema.msg_type, ([], [], []))
+        group[0].append(items[1])
+        group[1].append(payload)
+        group[2].append(index)
+
+    arrays = dict()
+
+    for msg_type in groups:
+        schema = message_schemas[msg_type]
+        tag_ids, payloads, indices = groups[msg_type]
+
+        # decode all the payloads at once
+        try:
+            raw = binascii.unhexlify(b''.join(payloads))
+        except ValueError:
+            # at least one payload is not valid hex, keep only the valid ones
+            tag_ids, payloads, indices, invalid = valid_hex_lines(tag_ids, payloads, indices)
+            malformed.extend(invalid)
+            raw = binascii.unhexlify(b''.join(payloads))
+
+        # tag ids were validated, hence they fit in 32 bits
+        tag_ids = [int(tag_id, 16) for tag_id in tag_ids]
+
+        values = np.frombuffer(raw, dtype = '>f4').reshape(-1, len(schema.value_fields))
+
+        records = np.empty(len(tag_ids), dtype = schema.dtype)
+        records['tag_id'] = tag_ids
+        for column, field in enumerate(schema.value_fields):
+            records[field] = values[:, column]
+
+        arrays[msg_type] = records
+
+    malformed.sort()
+
+    return arrays, malformed
+
+def valid_hex_lines(tag_ids, payloads, indices):
+    """
+    Filter the lines whose payload is a valid hex string.
+
+    Return the filtered tag_ids, payloads and indices and
+    the list of indices of the invalid lines.
+    """
+
+    valid_tag_ids = []
+    valid_payloads = []
+    valid_indices = []
+    invalid = []
+
+    for tag_id, payload, index in zip(tag_ids, payloads, indices):
+        try:
+            binascii.unhexlify(payload)
+        except ValueError:
+            invalid.append(index)
+            continue
+
+        valid_tag_ids.append(tag_id)
+        valid_payloads.append(payload)
+        valid_indices.append(index)
+
+    return valid_tag_ids, valid_payloads, valid_indices, invalid
+
+# tag_position_report := msg_type = 'tpr', tag_id, pos_x, pos_y, pos_z
+register_message_schema(MessageSchema(TagPositionReport))
+
+# anch_positions_report := msg_type = 'apr', tag_id,
+#                          pos_x_a0, pos_y_a0, pos_z_a0, ..., pos_x_a3, pos_y_a3, pos_z_a3
+register_message_schema(MessageSchema(AnchorPositionsReport))
+
+# kalman_filter_estimate := msg_type = 'kmf', tag_id,
+#                           est_pos_x, est_pos_y, est_pos_z, est_roll, est_pitch, est_yaw
+register_message_schema(MessageSchema(TagPoseEstimate))
     
 class DataFromEVB1000:
     """
@@ -60,6 +359,9 @@ class DataFromEVB1000:
         # empty msg_fields
         self._msg_fields = []
 
+        # schema of the message type, if known
+        self.schema = None
+
         # tries to decode message type and message
         self.msg_type_decoded = self.decode_msg_type()
         if (self.msg_type_decoded):
@@ -81,7 +383,7 @@ class DataFromEVB1000:
         """
         Determine the type of the message.
 
-        Types implemented are
+        Types implemented are those in the registry message_schemas, i.e.
 
         tag_position_report   := msg_type = 'tpr', tag_id,  
                                  (string),         (unsigned),    
@@ -104,8 +406,17 @@ class DataFromEVB1000:
                                  pos_x_a3,   pos_y_a3,   pos_z_a3
                                  (float),    (float),    (float)
 
-        If the type is valid the field names of the message 
-        and its structure are stored and the function return True.
+        kalman_filter_estimate := msg_type = 'kmf', tag_id,
+                                  (string),         (unsigned),
+
+                                  est_pos_x,  est_pos_y,  est_pos_z
+                                  (float),    (float),    (float)
+
+                                  est_roll,   est_pitch,  est_yaw
+                                  (float),    (float),    (float)
+
+        If the type is valid the schema of the message is stored
+        and the function return True.
 
         Otherwise return False.
         """
@@ -114,57 +425,174 @@ class DataFromEVB1000:
         if len(self.line) < 3:
             return False
 
-        # get msg_type
-        msg_type = self.line[0:3]
-
-        # set field names and structure depending on the msg_type
-        if msg_type == 'tpr':
-            self.msg_fields = ['msg_type', 'tag_id', 'x', 'y', 'z']
-            self.msg_structure = ['s'] + ['u'] + ['f'] * 3
-        elif msg_type == 'apr':
-            self.msg_fields = ['msg_type', 'tag_id',\
-                               'a0_x', 'a0_y', 'a0_z',
-                               'a1_x', 'a1_y', 'a1_z',
-                               'a2_x', 'a2_y', 'a2_z',
-                               'a3_x', 'a3_y', 'a3_z']
-            self.msg_structure = ['s'] + ['u'] + ['f'] * 12
-        else:
+        # get the schema depending on the msg_type
+        self.schema = message_schemas.get(self.line[0:3])
+
+        if self.schema is None:
             return False
 
+        self.msg_type = self.schema.msg_type
+        self.msg_fields = list(self.schema.fields)
+
         return True
 
     def decode(self):
         """
-        Return a dictionary containing the fields
+        Decode a MessageRecord containing the fields
         decoded from the message line.
         """
 
-        # make a list of items from the line string
-        items = self.line.split(' ')
+        self._decoded = self.schema.decode(self.line)
+
+class StreamParser:
+    """
+    Incremental parser of the byte stream coming from the EVB1000 serial.
+
+    The parser is fed with chunks of arbitrary size. Partial lines are carried
+    across chunks and garbage preceding a valid message header is discarded,
+    so that the parser resynchronizes on the next message.
+
+    Invalid data never raises an exception, it is counted in error_counts:
+    - 'unknown_type': lines not containing a known message header
+    - 'malformed': lines with a known header but not matching its schema
+    - 'overflow': unterminated data longer than max_line_length
+    - 'discarded_bytes': total number of bytes thrown away
+    """
+
+    def __init__(self, max_line_length = 256):
+
+        # bytes received but not yet terminated by '\\n'
+        self.buffer = bytearray()
+
+        # unterminated data longer than this is discarded
+        self.max_line_length = max_line_length
+
+        # headers of the known message types, e.g. b'tpr '
+        self.headers = [header + b' ' for header in message_schemas_by_header]
+
+        # number of messages decoded so far
+        self.decoded_messages = 0
+
+        # error counters
+        self.error_counts = {'unknown_type': 0,
+                             'malformed': 0,
+                             'overflow': 0,
+                             'discarded_bytes': 0}
+
+    def feed(self, chunk):
+        """
+        Add a chunk of bytes to the stream.
+
+        Return the list of the messages completed by the chunk,
+        each one decoded as a MessageRecord (see MessageSchema.decode()).
+        """
+
+        buffer = self.buffer
+        buffer += chunk
 
-        # empty list of decoded values
         decoded = []
-        
-        for index, item in enumerate(items):
-            # extract type for the current item
-            item_type_name = self.msg_structure[index]
 
-            # pick the right decoder
-            decoder = select_decoder(item_type_name)
-            
-            decoded.append(decoder(item))
+        # process all the complete lines
+        start = 0
+        end = buffer.find(b'\n', start)
+        while end >= 0:
+            message = self.parse_line(bytes(buffer[start:end]))
+            if message is not None:
+                decoded.append(message)
+
+            start = end + 1
+            end = buffer.find(b'\n', start)
 
-        # return a dictionary
-        self._decoded =  dict(zip(self.msg_fields, decoded))
+        # keep the partial line only
+        del buffer[:start]
+
+        # a line cannot be that long, drop everything up
+        # to the last header found, if any
+        if len(buffer) > self.max_line_length:
+            header_start = self.find_last_header(buffer)
+            if header_start <= 0:
+                header_start = len(buffer)
+
+            self.error_counts['overflow'] += 1
+            self.error_counts['discarded_bytes'] += header_start
+            del buffer[:header_start]
+
+        self.decoded_messages += len(decoded)
+
+        return decoded
+
+    def reset(self):
+        """
+        Discard the partial line, e.g. after the stream was interrupted.
+        """
+
+        self.error_counts['discarded_bytes'] += len(self.buffer)
+        del self.buffer[:]
+
+    def find_last_header(self, line):
+        """
+        Return the position of the last known message header in line, -1 if none.
+
+        Since message payloads are hex strings, a header cannot
+        appear within a valid message.
+        """
+
+        return max([line.rfind(header) for header in self.headers])
+
+    def parse_line(self, line):
+        """
+        Decode a line without its '\\n' terminator.
+
+        Return the decoded message or None if the line is not valid.
+        """
+
+        if line.endswith(b'\r'):
+            line = line[:-1]
+
+        if len(line) == 0:
+            return None
+
+        # resynchronize on the last header, in case
+        # the line starts with garbage
+        header_start = self.find_last_header(line)
+        if header_start < 0:
+            self.error_counts['unknown_type'] += 1
+            self.error_counts['discarded_bytes'] += len(line)
+            return None
+
+        if header_start > 0:
+            self.error_counts['discarded_bytes'] += header_start
+            line = line[header_start:]
+
+        schema = message_schemas_by_header[line[:3]]
+
+        # split type, tag id and payload
+        items = line.split(b' ', 2)
+
+        # validate items before decoding so that no exception can occur
+        if len(items) == 3:
+            tag_id = items[1]
+            payload = items[2].replace(b' ', b'')
+
+            if len(payload) == schema.payload_hex_size and\
+               valid_tag_id(tag_id) and\
+               len(payload.translate(None, HEX_DIGITS)) == 0:
+
+                values = schema.struct.unpack(binascii.unhexlify(payload))
+                return schema.record_class(int(tag_id, 16), *values)
+
+        self.error_counts['malformed'] += 1
+        self.error_counts['discarded_bytes'] += len(line)
+
+        return None
 
 if __name__ == '__main__':
     # some testing
     # tag position report with tag_id = 2, x = y = z = 10.34
-    example_line = 'tpr 02 412570a4 412570a4 412570a4\r\n'
+    example_line = b'tpr 02 412570a4 412570a4 412570a4\r\n'
 
     # instantiate obj
     d = DataFromEVB1000(example_line)
 
-    if (d.decode_msg_type()):
-        print(d.decode())
-    
+    if (d.msg_type_decoded):
+        print(d.decoded)
@@ -1,6 +1,5 @@
 # pyserial
 import serial
-from serial.tools import list_ports
 from serial.tools.list_ports_common import ListPortInfo
 from serial.serialutil import SerialException
 
@@ -10,25 +9,37 @@ def hash_fun(self):
 ListPortInfo.__hash__ = hash_fun
 
 # multi-threading
-from PyQt5.QtCore import pyqtSignal, pyqtSlot, QThread
-from threading import Lock
+from PyQt5.QtCore import pyqtSignal, QThread
+from threading import Lock, Event
 
-# sleep
-from time import sleep
+# time measurement
+from time import monotonic, time
+
+# bounded queue of messages
+from collections import deque
 
 # sys
-import sys
-import errno
+import os
 
-# QtWidgets contains QApplication
-from PyQt5 import QtWidgets
+# i/o multiplexing
+import selectors
+import socket
 
 # EVB1000 decoder
-from device.decoder import DataFromEVB1000
-from device.decoder import InvalidDataFromEVB1000
+from device.decoder import StreamParser
+
+# VIDs and PIDs of the devices, kept in its own module
+# so that it can be used without PyQt, DeviceVIDPIDList and
+# MalformedConfigurationFile are still importable from here
+from device.vid_pid_list import DeviceVIDPIDList
+from device.vid_pid_list import MalformedConfigurationFile
+from device.vid_pid_list import list_matching_ports
 
-# csv required by class DeviceVIDPIDList
-import csv
+# detection of serial devices plugged or unplugged
+from device.hotplug import HotplugMonitor
+
+# serial port options
+from device.serial_tuning import SerialTuning
 
 class Device(QThread):
     """
@@ -36,25 +47,69 @@ class Device(QThread):
 
     Inherits from QThread to handle serial i/o operations
     in background.
+
+    The device goes through the following states:
+    - 'connecting': the port is being opened, attempts are
+      repeated with an exponentially increasing delay
+    - 'running': bytes are being read from the port
+    - 'reconnecting': an i/o error occurred, the port was
+      closed and it is going to be opened again
+    - 'stopped': stop_device() was called, the port is closed
     """
 
     #pyqt signals are class attributes
     new_data_available = pyqtSignal(str)
+    port_opened = pyqtSignal(str)
+
+    # maximum number of bytes read at once from the serial
+    read_buffer_size = 4096
+
+    # maximum number of messages waiting to be consumed
+    message_queue_size = 1024
+
+    # maximum time a read waits for data, in seconds, hence
+    # the maximum time needed to notice that the device was stopped
+    read_timeout = 0.1
+
+    # initial and maximum delay between two attempts to open the port, in seconds
+    open_retry_delay = 0.05
+    max_open_retry_delay = 2.0
 
-    def __init__(self, port):
+    def __init__(self, port, serial_tuning = None, sysfs_root = '/sys'):
         # call Thread constructor
         QThread.__init__(self)
         
         # save port
         self.port = port
 
+        # serial port options, applied when the port is opened
+        if serial_tuning is None:
+            serial_tuning = SerialTuning()
+        self.serial_tuning = serial_tuning
+        self.sysfs_root = sysfs_root
+
+        # outcome of the options applied when the port was last opened
+        self.tuning_report = []
+
+        # CaptureRecorder receiving the raw bytes, if any
+        self.recorder = None
+
         # configure device
         self.configure()
 
         # set device state
-        self._state = 'running'
+        self._state = 'connecting'
         self.state_lock = Lock()
 
+        # set when the device has to stop, wakes up the thread
+        # while it waits before attempting to open the port again
+        self.stop_event = Event()
+
+        # number of i/o errors and of reconnections, last error message
+        self.io_errors = 0
+        self.reconnections = 0
+        self.last_error = None
+
         # set device id
         self.id = str(hash(self.port))
 
@@ -62,6 +117,30 @@ class Device(QThread):
         self._last_data = None
         self.data_lock = Lock()
 
+        # messages not yet consumed, the oldest ones are
+        # dropped if the consumer falls behind
+        self.messages = deque(maxlen = self.message_queue_size)
+
+        # time at which each message was received (seconds since the
+        # epoch), i.e. when the chunk completing it was read
+        self.message_times = deque(maxlen = self.message_queue_size)
+
+        # number of messages dropped since the last read of dropped_messages
+        self._dropped_messages = 0
+
+        # number of messages dropped since the device was created
+        self.total_dropped_messages = 0
+
+        # True if the consumer was signaled and did not drain the queue yet
+        self.consumer_notified = False
+
+        # parser of the incoming byte stream
+        self.parser = StreamParser()
+
+        # reusable buffer for serial reads
+        self.read_buffer = bytearray(self.read_buffer_size)
+        self.read_view = memoryview(self.read_buffer)
+
     def __str__(self):
         return self.port.device
 
@@ -82,6 +161,83 @@ class Device(QThread):
         self._last_data = data
         
         self.data_lock.release()
+
+    @property
+    def dropped_messages(self):
+        """
+        Return the number of messages dropped since the last
+        time this property was read.
+        """
+        self.data_lock.acquire()
+
+        # copy the number of dropped messages
+        dropped = self._dropped_messages
+
+        # clean the counter
+        self._dropped_messages = 0
+
+        self.data_lock.release()
+
+        return dropped
+
+    def push_messages(self, messages, timestamp):
+        """
+        Append a batch of decoded messages, received at timestamp, to the queue.
+
+        If the queue is full the oldest messages are dropped and counted.
+
+        Return True if the consumer has to be signaled, i.e. if it was not
+        already signaled since the last time it drained the queue.
+        """
+        self.data_lock.acquire()
+
+        # number of messages that do not fit in the queue
+        overflow = len(self.messages) + len(messages) - self.message_queue_size
+        if overflow > 0:
+            self._dropped_messages += overflow
+            self.total_dropped_messages += overflow
+
+        self.messages.extend(messages)
+        self.message_times.extend([timestamp] * len(messages))
+
+        self._last_data = messages[-1]
+
+        notify = not self.consumer_notified
+        self.consumer_notified = True
+
+        self.data_lock.release()
+
+        return notify
+
+    def drain(self):
+        """
+        Return the list of all the pending messages, from the oldest
+        to the newest, and empty the queue.
+        """
+
+        messages, timestamps = self.drain_with_timestamps()
+
+        return messages
+
+    def drain_with_timestamps(self):
+        """
+        Return the list of all the pending messages, from the oldest
+        to the newest, and the list of their reception times,
+        then empty the queue.
+        """
+        self.data_lock.acquire()
+
+        messages = list(self.messages)
+        timestamps = list(self.message_times)
+        self.messages.clear()
+        self.message_times.clear()
+
+        # new messages will signal the consumer again
+        self.consumer_notified = False
+
+        self.data_lock.release()
+
+        return messages, timestamps
         
     @property
     def state(self):
@@ -89,69 +245,146 @@ class Device(QThread):
         value = self._state
         self.state_lock.release()
         
-        return self._state
+        return value
 
     @state.setter
     def state(self, new_state):
         self.state_lock.acquire()
-        self._state = new_state
+
+        # a stopped device never changes state again
+        if self._state != 'stopped':
+            self._state = new_state
+
         self.state_lock.release()
 
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
     def stop_device(self):
         """
-        Change the state of the device from 'running' to 'stopped'.
+        Change the state of the device to 'stopped'.
+
+        The thread notices it within read_timeout seconds
+        or immediately if it is waiting to open the port.
         """
 
         self.state = 'stopped'
+        self.stop_event.set()
 
     def run(self):
         """
         Thread main method.
         """
 
-        # gracefully stop thread if the connection is not working
-        # TODO: signal the GUI that an I/O error occured
-        if not self.connect():
-            return
-        
-        while self.state == 'running':
+        while not self.stopped:
+            # open the port, give up only if the device was stopped
+            if not self.connect():
+                break
+
+            self.state = 'running'
+
+            # read until the device is stopped or an i/o error occurs
+            self.read_until_error()
+
+            self.close()
+
+            if not self.stopped:
+                self.reconnections += 1
+                self.state = 'reconnecting'
+
+        self.close()
+
+    def read_until_error(self):
+        """
+        Read and process the incoming bytes until the device is
+        stopped or an i/o error occurs.
+        """
+
+        while not self.stopped:
             try:
-                # attempt reception of a new line
-                line = self.serial.readline()
-
-                # process only non null data
-                if len(line) > 0:
-
-                    # store new line received
-                    # access to last_data here may happen *before*
-                    # the GUI has requested the data related to the last
-                    # signal emission. In this case the old line is overwritten
-                    # by the new one.
-                    #
-                    # TODO: consider a buffered approach
-                    #
-                    
-                    # decode last line received if possible
-                    try:
-                        evb1000_data = DataFromEVB1000(line)
-                    except InvalidDataFromEVB1000:
-                        # ignore this line
-                        continue
+                # attempt reception of all the available bytes
+                chunk = self.read_chunk()
+            except (SerialException, OSError) as e:
+                self.handle_io_error(e)
+                return
+
+            # process only non null data, an empty chunk
+            # means that read_timeout expired
+            if len(chunk) > 0:
+                self.process_chunk(chunk, time())
+
+    def handle_io_error(self, error):
+        """
+        Take note of an i/o error, the partial line received is discarded.
+        """
 
-                    # continue only if message type was decoded successfully
-                    if evb1000_data.msg_type_decoded:
-                        # store data
-                        self.last_data = evb1000_data.decoded
+        self.io_errors += 1
+        self.last_error = str(error)
 
-                        # signal the GUI that new data is available
-                        self.new_data_available.emit(self.id)
+        self.parser.reset()
 
-            except SerialException:
-                pass
+    def process_chunk(self, chunk, timestamp = None):
+        """
+        Decode the bytes received at timestamp (seconds since the epoch,
+        now by default) and store the new messages.
+        """
 
-        if self.state == 'stopped':
-            # stop thread
-            self.close()
+        if timestamp is None:
+            timestamp = time()
+
+        # hand a copy of the raw bytes to the recorder, if any
+        if self.recorder is not None:
+            self.recorder.record(self.port.device, chunk)
+
+        # decode all the lines completed by the chunk, invalid data
+        # is counted by the parser and ignored
+        messages = self.parser.feed(chunk)
+
+        # store new messages received, the GUI
+        # consumes all of them using drain()
+        #
+        # the GUI is signaled only once until it drains
+        # the queue so that Qt events do not pile up
+        if messages and self.push_messages(messages, timestamp):
+            # signal the GUI that new data is available
+            self.new_data_available.emit(self.id)
+
+    def read_available(self):
+        """
+        Read the bytes available on the serial without blocking,
+        at most read_buffer_size bytes.
+
+        Used when the device is handled by a SerialMultiplexer, after the
+        file descriptor of the serial was reported ready to be read.
+
+        Return the bytes read, an empty bytes object means that the
+        device was disconnected.
+        """
+
+        try:
+            return os.read(self.serial.fileno(), self.read_buffer_size)
+        except BlockingIOError:
+            # spurious wakeup, no data actually available
+            return None
+
+    def read_chunk(self):
+        """
+        Read all the bytes available on the serial, at least one byte
+        and at most read_buffer_size bytes.
+
+        Block until at least one byte is available or until
+        read_timeout expires, in that case the chunk is empty.
+
+        Return a memoryview on the reusable read buffer.
+        """
+
+        # wait for one byte if none is available
+        size = min(max(self.serial.in_waiting, 1), self.read_buffer_size)
+
+        number_of_bytes = self.serial.readinto(self.read_view[:size])
+
+        return self.read_view[:number_of_bytes]
 
     def configure(self):
         """
@@ -165,24 +398,60 @@ class Device(QThread):
         self.serial.port = self.port.device
 
         # set baudrate
-        self.serial.baudrate = 115200
+        self.serial_tuning.configure(self.serial)
+
+        # override the size of the reads, if required
+        if self.serial_tuning.read_buffer_size is not None:
+            self.read_buffer_size = self.serial_tuning.read_buffer_size
+
+        # bound the time spent in a read
+        self.serial.timeout = self.read_timeout
+
+    def open_port(self):
+        """
+        Attempt to open the serial port once.
+
+        If the port is opened the serial options are applied
+        and port_opened is emitted.
+
+        return Serial.is_open
+        """
+
+        try:
+            self.serial.open()
+        except (SerialException, OSError) as e:
+            self.last_error = str(e)
+            return False
+
+        self.tuning_report = self.serial_tuning.apply(self.serial, self.sysfs_root)
+        self.port_opened.emit(self.id)
+
+        return True
 
     def connect(self):
         """
         Open the serial port.
 
+        Even if the device is detected it may be not ready to be opened
+        yet (e.g. in Windows), hence attempts are repeated with an
+        exponentially increasing delay until the device is stopped.
+
         return Serial.is_open
         """
 
-        # in Windows even if the device is detected it
-        # may be not ready to be opened yet
-        while not self.serial.is_open:
-            try:
-                self.serial.open()
-            except SerialException:
-                pass
-            
-        return True
+        self.state = 'connecting'
+
+        delay = self.open_retry_delay
+
+        while not self.stopped:
+            if self.open_port():
+                return True
+
+            # wait before the next attempt, stop_device() wakes up the thread
+            self.stop_event.wait(delay)
+            delay = min(2 * delay, self.max_open_retry_delay)
+
+        return False
 
     def close(self):
         """
@@ -196,110 +465,285 @@ class Device(QThread):
     def register_new_data_available_slot(self, slot):
         self.new_data_available.connect(slot)
 
-class MalformedConfigurationFile(Exception):
-        pass
+    def register_port_opened_slot(self, slot):
+        self.port_opened.connect(slot)
 
-class DeviceVIDPIDList:
+class SerialMultiplexer(QThread):
     """
-    Store VIDs and PIDs for devices that are part of the EVB1000 system.
+    Read from all the devices using a single thread.
+
+    The file descriptors of the serial ports are registered with a selector
+    (epoll on Linux), ready ports are read in bulk and the bytes are
+    dispatched to the parser of each device.
+
+    Ports that cannot be opened yet, or that were closed after an i/o
+    error, are opened again later with the same exponential backoff
+    used by Device.connect(), without ever blocking the thread.
+
+    Available on POSIX systems only.
     """
 
-    def __init__(self, filename):
+    # maximum time spent waiting for data, in seconds
+    select_timeout = 1.0
+
+    def __init__(self):
+        # call Thread constructor
+        QThread.__init__(self)
+
+        # selector of the serial file descriptors
+        self.selector = selectors.DefaultSelector()
+
+        # socket pair used to wake up the thread blocked in select()
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.selector.register(self.wakeup_receiver, selectors.EVENT_READ, None)
+
+        # devices waiting to be added or removed by the thread
+        self.devices_to_add = []
+        self.devices_to_remove = []
+        self.requests_lock = Lock()
+
+        # devices waiting to be opened, each one mapped to
+        # a pair (time of the next attempt, delay of the following one)
+        self.pending_connections = dict()
+
+        # set multiplexer state
+        self._state = 'running'
+
+    @property
+    def state(self):
+        self.requests_lock.acquire()
+        value = self._state
+        self.requests_lock.release()
+
+        return value
+
+    def wakeup(self):
+        """
+        Wake up the thread if blocked in select().
+        """
+
+        try:
+            self.wakeup_sender.send(b'\0')
+        except BlockingIOError:
+            # a wakeup is already pending
+            pass
+
+    def add_device(self, device):
+        """
+        Open the serial port of device and start reading from it.
+        """
+
+        self.requests_lock.acquire()
+        self.devices_to_add.append(device)
+        self.requests_lock.release()
+
+        self.wakeup()
+
+    def remove_device(self, device):
+        """
+        Stop reading from device and close its serial port.
+        """
+
+        self.requests_lock.acquire()
+        self.devices_to_remove.append(device)
+        self.requests_lock.release()
+
+        self.wakeup()
+
+    def stop(self):
+        """
+        Stop the thread and close all the serial ports.
+        """
+
+        self.requests_lock.acquire()
+        self._state = 'stopped'
+        self.requests_lock.release()
+
+        self.wakeup()
+
+    def process_requests(self):
+        """
+        Register and unregister the devices as requested by
+        add_device() and remove_device().
+        """
+
+        self.requests_lock.acquire()
+        devices_to_add = self.devices_to_add
+        devices_to_remove = self.devices_to_remove
+        self.devices_to_add = []
+        self.devices_to_remove = []
+        self.requests_lock.release()
+
+        for device in devices_to_add:
+            self.schedule_connection(device, 0, device.open_retry_delay)
+
+        for device in devices_to_remove:
+            self.pending_connections.pop(device, None)
+            self.unregister_device(device)
+
+    def schedule_connection(self, device, delay, next_delay):
+        """
+        Attempt to open the port of device in delay seconds.
+        """
+
+        self.pending_connections[device] = (monotonic() + delay, next_delay)
+
+    def process_connections(self):
+        """
+        Attempt to open the ports whose next attempt is due
+        and register the ones opened with the selector.
+        """
+
+        now = monotonic()
+
+        for device, (attempt_time, delay) in list(self.pending_connections.items()):
+            if attempt_time > now:
+                continue
+
+            if device.stopped:
+                del self.pending_connections[device]
+            elif device.open_port():
+                del self.pending_connections[device]
+                self.selector.register(device.serial.fileno(), selectors.EVENT_READ, device)
+                device.state = 'running'
+            else:
+                self.schedule_connection(device, delay, min(2 * delay, device.max_open_retry_delay))
+
+    def connection_timeout(self):
+        """
+        Return the time to wait in select(), in seconds, so that
+        the next attempt to open a port is not delayed.
+        """
+
+        if len(self.pending_connections) == 0:
+            return self.select_timeout
+
+        next_attempt = min(attempt_time for attempt_time, delay in self.pending_connections.values())
+
+        return min(self.select_timeout, max(0, next_attempt - monotonic()))
+
+    def unregister_device(self, device):
+        """
+        Unregister device from the selector and close its serial port.
+        """
+
+        if device.serial.is_open:
+            try:
+                self.selector.unregister(device.serial.fileno())
+            except KeyError:
+                pass
+
+            device.close()
+
+    def run(self):
+        """
+        Thread main method.
+        """
+
+        while self.state == 'running':
+            for key, events in self.selector.select(self.connection_timeout()):
+                device = key.data
+
+                # wakeup requested
+                if device is None:
+                    try:
+                        self.wakeup_receiver.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+
+                try:
+                    chunk = device.read_available()
+                    timestamp = time()
+                except OSError as e:
+                    device.handle_io_error(e)
+                    chunk = b''
+
+                if chunk is None:
+                    continue
+
+                if len(chunk) == 0:
+                    # the device was disconnected or an i/o error
+                    # occurred, open the port again unless stopped
+                    self.unregister_device(device)
+                    if not device.stopped:
+                        device.reconnections += 1
+                        device.state = 'reconnecting'
+                        self.schedule_connection(device, device.open_retry_delay,\
+                                                 2 * device.open_retry_delay)
+                    continue
+
+                device.process_chunk(chunk, timestamp)
+
+            self.process_requests()
+            self.process_connections()
+
+        # close all the serial ports
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None:
+                self.unregister_device(key.data)
+
+        self.selector.close()
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
 
-        # filename of the configuration file
-        self.filename = filename
-        
-        # empty list of ids
-        self.vid_pid_s = []
-
-        # load VIDs and PIDs from file
-        self.load_from_file()
-
-    def get_vid_pid_list(self):
-        """
-        Return the list containing the valid VIDs and PIDs
-        """
-
-        return self.vid_pid_s
-
-    def load_from_file(self):
-        """
-        Load VIDs and PIDs from file
-        """
-
-        # if state = 0 the function checks if
-        # the file starts with the string CONFIG_VID_PID
-        state = 0
-
-        try: 
-            with open(self.filename, 'r') as csvfile:
-                reader = csv.reader(csvfile, delimiter=' ')
-                for row in reader:
-
-                    # checks if the file starts with CONFIG_VID_PID
-                    if state == 0:
-                        if not (row[0] == 'CONFIG_VID_PID'):
-                            raise MalformedConfigurationFile
-                        else:
-                            # go to next step, i.e., checking the header of the file
-                            state = state + 1
-                            
-                    # checks if the header is of the form 'VID PID'
-                    elif state == 1:
-                        if not (row[0] == 'VID' and row[1] == 'PID'):
-                            raise MalformedConfigurationFile
-                        else:
-                            # go to next step, i.e., reading tuples of VIDs and PIDs
-                            # if they are valid
-                            state = state + 1
-
-                    # read and store tuples of VIDs and PIDs, if they are valid
-                    else:
-                        # extract VID and PID
-                        vid = row[0]
-                        pid = row[1]
-                        
-                        # check if the row contains a 4 characters long VID and
-                        # a 4 characters long PID
-                        if (len(row[0]) != 4) or (len(row[1]) != 4):
-                            raise MalformedConfigurationFile
-
-                        # store (VID, PID) pair
-                        self.vid_pid_s.append((vid,pid))
-        
-        except (OSError, IOError) as e:
-            if getattr(e, 'errno', 0) == errno.ENOENT:
-                print('Error: Configuration file ' + self.filename + ' not found.')
-                sys.exit(1)
-        except MalformedConfigurationFile:
-            print('Error: Malformed configuration file ' + self.filename + '.')
-            sys.exit(1)
-
-        # if no (VID, PID) tuples were found exit
-        if len(self.vid_pid_s) == 0:
-            print('Error: No (VID, PID) entries found in ' + self.filename + '.')
-            sys.exit(1)
-              
 class DeviceManager(QThread):
     """
     Manage EVB1000 Tag devices connected through a serial port.
 
     Inherits from QThread to handle devices connection/disconnection
     in background.
+
+    Serial i/o is performed according to io_backend:
+    - 'threads': each Device reads from its port in its own thread
+    - 'selectors': a single SerialMultiplexer thread reads from all the ports
     """
 
+    io_backends = ('threads', 'selectors')
+
+    # time between two scans of the serial ports, in seconds, used
+    # if plugging and unplugging of devices cannot be detected
+    polling_interval = 1
+
+    # maximum time between two scans of the serial ports, in seconds, used
+    # if plugging and unplugging are detected, so that missed events are recovered
+    rescan_interval = 5.0
+
+    # maximum time spent by stop_all_devices() waiting for the threads, in seconds
+    stop_timeout = 2.0
+
     #pyqt signals are class attributes
     new_dev_connected_sig = pyqtSignal()
     dev_removed_sig = pyqtSignal()
+    port_opened_sig = pyqtSignal(str)
     
-    def __init__(self, vid_pid_list):
+    def __init__(self, vid_pid_list, io_backend = 'threads', sysfs_root = '/sys', recorder = None):
 
 
         # call Thread constructor
         QThread.__init__(self)
 
-        # empty list of ports
-        self.connected_ports = []
+        # save requested i/o backend
+        if io_backend not in self.io_backends:
+            raise ValueError('Unknown i/o backend ' + str(io_backend) + '.')
+        self.io_backend = io_backend
+
+        # instantiate the thread reading from all the devices if required
+        self.multiplexer = None
+        if self.io_backend == 'selectors':
+            self.multiplexer = SerialMultiplexer()
+            self.multiplexer.start()
+
+        # empty set of ports
+        self.connected_ports = set()
+
+        # ports attached explicitly, e.g. simulated ones, whatever their VID and PID
+        self.attached_ports = set()
+        self.attached_ports_lock = Lock()
+
+        # detection of serial devices plugged or unplugged
+        self.hotplug_monitor = HotplugMonitor()
 
         # empty dictionary of devices
         self.configured_devices = dict()
@@ -312,6 +756,15 @@ class DeviceManager(QThread):
         # store list of PIDs and VIDs of devices belonging to the EVB1000 system
         self.target_vid_pid = vid_pid_list.get_vid_pid_list()
 
+        # store serial port options of the devices
+        self.vid_pid_list = vid_pid_list
+
+        # mount point of sysfs, where some serial options are written
+        self.sysfs_root = sysfs_root
+
+        # CaptureRecorder receiving the raw bytes of all the devices, if any
+        self.recorder = recorder
+
     @property
     def new_devices(self):
 
@@ -371,8 +824,17 @@ class DeviceManager(QThread):
                 # signal GUI that some devices were removed
                 self.dev_removed_sig.emit()
 
-            # wait some time
-            sleep(1)
+            # wait until a serial device is plugged or unplugged
+            # or, if this cannot be detected, wait some time
+            #
+            # the ports are scanned again in any case when the wait expires
+            # or when ports are attached or detached
+            if self.hotplug_monitor.available:
+                timeout = self.rescan_interval
+            else:
+                timeout = self.polling_interval
+
+            self.hotplug_monitor.wait(timeout)
 
     def configure_devices(self, ports):
         """
@@ -384,14 +846,38 @@ class DeviceManager(QThread):
         new_devices = []
         
         # for each port create a new Device and start the underlying thread
+        # or hand the device to the multiplexer
         for p in ports:
-            new_device = Device(p)
+            new_device = Device(p, self.vid_pid_list.get_serial_tuning(p.vid, p.pid), self.sysfs_root)
+            new_device.register_port_opened_slot(self.port_opened_sig)
+            new_device.recorder = self.recorder
             self.configured_devices[new_device.id] = new_device
             new_devices.append(new_device)
-            new_device.start()
+            if self.multiplexer is not None:
+                self.multiplexer.add_device(new_device)
+            else:
+                new_device.start()
 
         return new_devices
 
+    def register_devices(self, devices):
+        """
+        Handle devices not backed by a serial port detected by the
+        Device Manager, e.g. ReplayDevices, whose data is delivered by
+        someone else. Devices are not started.
+
+        The GUI is signaled as for new devices connected, hence
+        register_devices() has to be called before start().
+        """
+
+        for device in devices:
+            self.configured_devices[device.id] = device
+
+        self.new_devices = list(devices)
+
+        # signal GUI that new devices are available
+        self.new_dev_connected_sig.emit()
+
     def remove_devices(self, ports):
         """
         Remove devices whose ports were removed.
@@ -407,6 +893,8 @@ class DeviceManager(QThread):
             # device id is defined as str(port.__hash__())
             device_id = str(hash(p))
             self.configured_devices[device_id].stop_device()
+            if self.multiplexer is not None:
+                self.multiplexer.remove_device(self.configured_devices[device_id])
             
             # clean configured_devices dict
             removed_device = self.configured_devices.pop(device_id)
@@ -417,15 +905,63 @@ class DeviceManager(QThread):
     def stop_all_devices(self):
         """
         Stop all devices.
+
+        Wait at most stop_timeout seconds for the threads to finish.
+
+        Return True if all the threads finished in time.
         """
+        deadline = monotonic() + self.stop_timeout
+
         # stop devices
         for device_id in self.configured_devices:
             self.configured_devices[device_id].stop_device()
 
-        # wait for thread end
-        for device_id in self.configured_devices:
-            self.configured_devices[device_id].wait()
+        # stop the multiplexer
+        threads = list(self.configured_devices.values())
+        if self.multiplexer is not None:
+            self.multiplexer.stop()
+            threads.append(self.multiplexer)
 
+        # wait for thread end, devices handled by the multiplexer have no
+        # thread of their own and wait() returns immediately for them
+        all_finished = True
+        for thread in threads:
+            remaining = max(0, deadline - monotonic())
+            if not thread.wait(int(remaining * 1000)):
+                all_finished = False
+
+        return all_finished
+
+    def attach_ports(self, ports):
+        """
+        Handle the serial ports in ports whatever their VID and PID,
+        e.g. the pseudo-terminals of a simulator.
+
+        The ports are scanned again at once, hence the new ones are
+        configured immediately, or at the first scan if attach_ports()
+        is called before start().
+        """
+
+        self.attached_ports_lock.acquire()
+        self.attached_ports |= set(ports)
+        self.attached_ports_lock.release()
+
+        # wake up the thread waiting for hotplug events
+        self.hotplug_monitor.wake_up()
+
+    def detach_ports(self, ports):
+        """
+        Stop handling the serial ports in ports, attached using attach_ports().
+
+        The devices of the ports are removed immediately.
+        """
+
+        self.attached_ports_lock.acquire()
+        self.attached_ports -= set(ports)
+        self.attached_ports_lock.release()
+
+        # wake up the thread waiting for hotplug events
+        self.hotplug_monitor.wake_up()
 
     def update_ports(self):
         """
@@ -441,28 +977,20 @@ class DeviceManager(QThread):
         
         # fetch only those ports having
         # VID:PID == a valid (VID, PID) pair in target_vid_pid
-        ports = []
+        ports = set(list_matching_ports(self.target_vid_pid))
 
-        for valid_pair in self.target_vid_pid:
-            vid_pid = valid_pair[0] + ':' + valid_pair[1]
-            ports = ports +  [p for p in list_ports.grep(vid_pid)]
-        #ports = list_ports.comports()
+        # add the ports attached explicitly
+        self.attached_ports_lock.acquire()
+        ports |= self.attached_ports
+        self.attached_ports_lock.release()
         
-        # add new ports to connected_ports
-        # and update new_ports
-        new_ports = []
-        for p in ports:
-            if not p in self.connected_ports:
-                self.connected_ports.append(p)
-                new_ports.append(p)
-
-        # remove missing ports from devices_found
-        # and update removed_ports
-        removed_ports = []
-        for p in self.connected_ports:
-            if not p in ports:
-                self.connected_ports.remove(p)
-                removed_ports.append(p)
+        # new ports are those not yet in connected_ports
+        new_ports = list(ports - self.connected_ports)
+
+        # missing ports are those in connected_ports only
+        removed_ports = list(self.connected_ports - ports)
+
+        self.connected_ports = ports
 
         return new_ports, removed_ports
 
@@ -471,3 +999,6 @@ class DeviceManager(QThread):
 
     def register_devices_removed_slot(self, slot):
         self.dev_removed_sig.connect(slot)
+
+    def register_port_opened_slot(self, slot):
+        self.port_opened_sig.connect(slot)
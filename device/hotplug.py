@@ -0,0 +1,266 @@
+# sys
+import os
+import sys
+import errno
+
+# inotify through the C library
+import ctypes
+import ctypes.util
+
+# decoding of inotify events
+import struct
+
+# waiting for events
+import select
+import socket
+
+# time measurement
+from time import monotonic, sleep
+
+# inotify constants, see inotify(7)
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# header of struct inotify_event: wd, mask, cookie, len
+INOTIFY_EVENT = struct.Struct('iIII')
+
+class HotplugMonitor:
+    """
+    Wait for serial devices being plugged or unplugged.
+
+    On Linux the directories in watch_paths are watched using inotify,
+    so that wait() returns as soon as a serial device node is created or
+    removed. Elsewhere, or if inotify is not available, wait() simply
+    waits for the timeout and callers fall back to polling.
+
+    Events may be missed, e.g. those of the nodes created before a
+    directory is watched, hence callers are expected to wait with a
+    timeout and scan the ports anyway when it expires. Directories that
+    do not exist yet, e.g. /dev/serial/by-id before the first USB serial
+    device is plugged, are watched as soon as they appear.
+
+    wake_up() interrupts a wait() in progress, on any platform, e.g.
+    when ports are attached explicitly and have to be scanned at once.
+    """
+
+    # directories containing serial device nodes and links
+    watch_paths = ('/dev', '/dev/serial/by-id')
+
+    # prefixes of the names of serial device nodes and links
+    name_prefixes = (b'tty', b'serial', b'usb-', b'rfcomm')
+
+    # time spent collecting the events following the first one, in seconds
+    settle_time = 0.05
+
+    def __init__(self, watch_paths = None):
+
+        if watch_paths is not None:
+            self.watch_paths = tuple(watch_paths)
+
+        # inotify file descriptor, None if not available
+        self.fd = None
+
+        # watched directories indexed by watch descriptor
+        self.watches = dict()
+
+        # C library and mask of the events watched
+        self.libc = None
+        self.mask = IN_CREATE | IN_DELETE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO
+
+        # socket pair used to wake up the thread blocked in wait()
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+
+        if sys.platform.startswith('linux'):
+            self.open_inotify()
+
+    @property
+    def available(self):
+        """
+        Return True if events are detected, False if callers have to poll.
+        """
+
+        return self.fd is not None
+
+    def open_inotify(self):
+        """
+        Initialize inotify and watch the directories in watch_paths.
+
+        On failure the monitor is left unavailable.
+        """
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+
+        if fd < 0:
+            return
+
+        self.libc = libc
+        self.fd = fd
+
+        self.watch_missing_paths()
+
+        # nothing to watch
+        if len(self.watches) == 0:
+            os.close(fd)
+            self.fd = None
+
+    def watch_missing_paths(self):
+        """
+        Watch the directories in watch_paths not watched yet, e.g.
+        those that did not exist when the monitor was created.
+
+        Return True if at least one directory started being watched.
+        """
+
+        if self.fd is None:
+            return False
+
+        watched = set(self.watches.values())
+
+        added = False
+        for path in self.watch_paths:
+            if path in watched:
+                continue
+
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.mask)
+            if wd >= 0:
+                self.watches[wd] = path
+                added = True
+
+        return added
+
+    def fileno(self):
+        """
+        Return the inotify file descriptor, e.g. to be used with a selector.
+        """
+
+        return self.fd
+
+    def read_events(self):
+        """
+        Read all the pending inotify events.
+
+        Return True if at least one event concerns a serial device.
+        """
+
+        relevant = False
+
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                break
+
+            offset = 0
+            while offset + INOTIFY_EVENT.size <= len(data):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+
+                # the directory was removed, watch it again when it appears
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+
+                if name.startswith(self.name_prefixes):
+                    relevant = True
+
+        return relevant
+
+    def wake_up(self):
+        """
+        Make the current, or the next, wait() return at once.
+        """
+
+        try:
+            self.wakeup_sender.send(b'\0')
+        except BlockingIOError:
+            # a wakeup is already pending
+            pass
+
+    def woken_up(self):
+        """
+        Consume the pending wakeups.
+
+        Return True if wake_up() was called.
+        """
+
+        try:
+            return len(self.wakeup_receiver.recv(4096)) > 0
+        except BlockingIOError:
+            return False
+
+    def wait(self, timeout = None):
+        """
+        Wait until a serial device is plugged or unplugged, until
+        wake_up() is called or until timeout (in seconds) expires.
+
+        If events are not available wait only for wake_up() or timeout.
+
+        Return True if a change was detected or wake_up()
+        was called, False otherwise.
+        """
+
+        if self.fd is None:
+            select.select([self.wakeup_receiver], [], [], timeout)
+            return self.woken_up()
+
+        # nodes may have been created in a directory that just appeared
+        if self.watch_missing_paths():
+            return True
+
+        deadline = None
+        if timeout is not None:
+            deadline = monotonic() + timeout
+
+        while True:
+            if deadline is not None:
+                remaining = max(0, deadline - monotonic())
+            else:
+                remaining = None
+
+            readable, _, _ = select.select([self.fd, self.wakeup_receiver], [], [], remaining)
+            if not readable:
+                return False
+
+            if self.wakeup_receiver in readable and self.woken_up():
+                return True
+
+            if self.fd in readable and self.read_events():
+                break
+
+        # devices create several nodes and links in a row
+        # hence the following events are collected too
+        sleep(self.settle_time)
+        self.read_events()
+
+        return True
+
+    def close(self):
+        """
+        Stop watching the directories.
+        """
+
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
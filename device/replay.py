@@ -0,0 +1,394 @@
+# multi-threading
+from PyQt5.QtCore import QThread
+from threading import Condition, Event
+
+# time measurement
+from time import monotonic
+
+# pyserial
+from serial.tools.list_ports_common import ListPortInfo
+
+# serial devices
+from device.device_manager import Device
+
+# raw captures
+from device.capture import CaptureReader
+
+class ReplayDevice(Device):
+    """
+    Stands in for the Device that received the data of a capture.
+
+    No serial port is opened and no thread is run: chunks are read from
+    the capture by a Replayer and handed to process_chunk(), as the
+    SerialMultiplexer does for serial devices, hence consumers of the
+    decoded messages cannot tell a ReplayDevice from a Device.
+    """
+
+    def __init__(self, recorded_port):
+
+        # path of the port in the capture, e.g. '/dev/ttyUSB0'
+        self.recorded_port = recorded_port
+
+        # the prefix keeps the id distinct from the one of a live device
+        try:
+            port = ListPortInfo('replay:' + recorded_port, skip_link_detection = True)
+        except TypeError:
+            # pyserial < 3.5
+            port = ListPortInfo('replay:' + recorded_port)
+
+        # call Device constructor
+        Device.__init__(self, port)
+
+        self.state = 'running'
+
+    def configure(self):
+        """
+        No serial port to configure.
+        """
+
+        self.serial = None
+
+    def open_port(self):
+        return True
+
+    def close(self):
+        pass
+
+class ReplayClock:
+    """
+    Maps the time of a capture to the time of the replay.
+
+    The capture time advances speed times faster than real time,
+    it can be paused and moved with seek(). If speed is None the
+    replay runs as fast as possible.
+    """
+
+    def __init__(self, start_time, speed = 1.0):
+
+        self.speed = speed
+        self.paused = False
+
+        # capture time at the anchor_time, real time
+        self.anchor_position = start_time
+        self.anchor_time = monotonic()
+
+        # incremented by seek(), so that waiting threads can notice
+        self.generation = 0
+
+        self.condition = Condition()
+
+    def position(self):
+        """
+        Return the current capture time.
+        """
+
+        if self.paused or self.speed is None:
+            return self.anchor_position
+
+        return self.anchor_position + (monotonic() - self.anchor_time) * self.speed
+
+    def set_anchor(self, position):
+        self.anchor_position = position
+        self.anchor_time = monotonic()
+
+    def pause(self):
+        with self.condition:
+            if not self.paused:
+                self.set_anchor(self.position())
+                self.paused = True
+            self.condition.notify_all()
+
+    def resume(self):
+        with self.condition:
+            if self.paused:
+                self.set_anchor(self.anchor_position)
+                self.paused = False
+            self.condition.notify_all()
+
+    def set_speed(self, speed):
+        with self.condition:
+            self.set_anchor(self.position())
+            self.speed = speed
+            self.condition.notify_all()
+
+    def seek(self, position):
+        with self.condition:
+            self.set_anchor(position)
+            self.generation += 1
+            self.condition.notify_all()
+
+    def advance(self, position):
+        """
+        Move the clock forward to position, used when replaying as fast as possible.
+        """
+
+        if self.speed is None:
+            self.anchor_position = position
+
+    def wake_up(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait_until(self, position, generation, stop_event):
+        """
+        Wait until the capture time reaches position.
+
+        Return False if the clock was moved by seek() or if stop_event
+        is set in the meantime, True otherwise.
+        """
+
+        with self.condition:
+            while not stop_event.is_set() and self.generation == generation:
+                if not self.paused:
+                    if self.speed is None:
+                        return True
+
+                    remaining = (position - self.position()) / self.speed
+                    if remaining <= 0:
+                        return True
+                else:
+                    remaining = None
+
+                self.condition.wait(remaining)
+
+        return False
+
+class Replayer(QThread):
+    """
+    Replay a capture recorded by CaptureRecorder through ReplayDevices.
+
+    Chunks are delivered with their original inter-arrival times scaled
+    by speed, e.g. speed = 10 replays a capture ten times faster,
+    or as fast as possible if speed is None. The replay can be paused,
+    resumed and moved to any time of the capture.
+
+    At the end of the capture the replay waits for a seek(), or starts
+    again if loop is True.
+
+    A ReplayDevice is created for each port of the capture before the
+    replay starts, so that all of them can be registered. Chunks of ports
+    defined later, i.e. if the capture is still being written, are skipped.
+
+    When replaying as fast as possible the replay waits for the consumers
+    to drain the messages of a device before its queue is full, so that
+    no message is dropped.
+    """
+
+    # messages waiting in the queue of a device above which
+    # the replay waits, when replaying as fast as possible
+    backpressure_threshold = Device.message_queue_size // 2
+
+    # time between two checks of the queue of a device, in seconds
+    backpressure_interval = 0.001
+
+    def __init__(self, path, speed = 1.0, loop = False):
+        # call Thread constructor
+        QThread.__init__(self)
+
+        self.reader = CaptureReader(path)
+        self.loop = loop
+
+        self.clock = ReplayClock(self.reader.start_time, speed)
+
+        # one device for each recorded port, including
+        # the ones missing from the index, if any
+        self.devices = {port: ReplayDevice(port) for port in self.reader.port_paths()}
+
+        # set when the replay has to stop
+        self.stop_event = Event()
+
+        # statistics
+        self.replayed_chunks = 0
+        self.replayed_bytes = 0
+        self.replay_time = 0.0
+        self.throttled_time = 0.0
+        self.skipped_chunks = 0
+
+    def get_devices(self):
+        """
+        Return the list of ReplayDevices, e.g. to be registered in a DeviceManager.
+        """
+
+        return list(self.devices.values())
+
+    def duration(self):
+        """
+        Return the duration of the capture, in seconds.
+        """
+
+        return self.reader.end_time() - self.reader.start_time
+
+    def position(self):
+        """
+        Return the time of the replay, in seconds from the start of the capture.
+        """
+
+        return self.clock.position() - self.reader.start_time
+
+    def pause(self):
+        self.clock.pause()
+
+    def resume(self):
+        self.clock.resume()
+
+    def set_speed(self, speed):
+        """
+        Change the speed of the replay, None means as fast as possible.
+        """
+
+        self.clock.set_speed(speed)
+
+    def seek(self, position):
+        """
+        Move the replay to position, in seconds from the start of the capture.
+        """
+
+        self.clock.seek(self.reader.start_time + position)
+
+    def stop(self):
+        """
+        Stop the replay.
+        """
+
+        self.stop_event.set()
+        self.clock.wake_up()
+
+    def wait_for_consumers(self, device, generation):
+        """
+        Wait until the messages waiting in the queue of device are
+        at most backpressure_threshold.
+
+        Return False if interrupted by seek() or stop().
+        """
+
+        start = monotonic()
+
+        try:
+            while len(device.messages) > self.backpressure_threshold:
+                if self.stop_event.wait(self.backpressure_interval):
+                    return False
+
+                if self.clock.generation != generation:
+                    return False
+        finally:
+            self.throttled_time += monotonic() - start
+
+        return True
+
+    def replay(self, position, generation):
+        """
+        Replay the capture from position, a capture time, until its end.
+
+        Return False if interrupted by seek() or stop().
+        """
+
+        start = monotonic()
+
+        try:
+            for timestamp, port, chunk in self.reader.chunks(position):
+                if not self.clock.wait_until(timestamp, generation, self.stop_event):
+                    return False
+
+                device = self.devices.get(port)
+                if device is None:
+                    # port defined after the devices were registered
+                    self.skipped_chunks += 1
+                else:
+                    if self.clock.speed is None:
+                        if not self.wait_for_consumers(device, generation):
+                            return False
+
+                    # messages are timestamped with the time they were recorded
+                    device.process_chunk(chunk, self.reader.wall_time(timestamp))
+
+                    self.replayed_chunks += 1
+                    self.replayed_bytes += len(chunk)
+
+                # the clock reaches timestamp once the chunk was delivered
+                self.clock.advance(timestamp)
+        finally:
+            self.replay_time += monotonic() - start
+
+        return True
+
+    def run(self):
+        """
+        Thread main method.
+        """
+
+        # the replay starts now, whatever the time elapsed since the
+        # Replayer was created, from the position set by seek() if any
+        with self.clock.condition:
+            self.clock.set_anchor(self.clock.anchor_position)
+
+        while not self.stop_event.is_set():
+            # position set by the last seek(), the clock has already moved
+            # past it hence chunks received at that time would be skipped
+            with self.clock.condition:
+                generation = self.clock.generation
+                position = self.clock.anchor_position
+
+            # partial lines belong to the previous position
+            for device in self.devices.values():
+                device.parser.reset()
+
+            if self.replay(position, generation):
+                if self.loop:
+                    self.seek(0)
+                    continue
+
+                # wait for a seek() or stop()
+                with self.clock.condition:
+                    while not self.stop_event.is_set() and self.clock.generation == generation:
+                        self.clock.condition.wait()
+
+    def statistics(self):
+        """
+        Return a dictionary containing the number of chunks and bytes
+        replayed, the chunks skipped, the time spent replaying, the part
+        of it spent waiting for the consumers and the resulting throughput,
+        which does not include the waits.
+        """
+
+        decoding_time = self.replay_time - self.throttled_time
+        if decoding_time > 0:
+            throughput = self.replayed_bytes / decoding_time
+        else:
+            throughput = 0.0
+
+        return {'replayed_chunks': self.replayed_chunks,
+                'replayed_bytes': self.replayed_bytes,
+                'skipped_chunks': self.skipped_chunks,
+                'replay_time': self.replay_time,
+                'throttled_time': self.throttled_time,
+                'bytes_per_second': throughput}
+
+if __name__ == '__main__':
+    # benchmark the decoding of a capture replayed as fast as possible
+    import sys
+    from time import sleep
+
+    replayer = Replayer(sys.argv[1], speed = None)
+    devices = replayer.get_devices()
+
+    replayer.start()
+
+    # consume the messages as the GUI does until the end of the capture
+    received = 0
+    while True:
+        sleep(0.005)
+        received += sum(len(device.drain()) for device in devices)
+
+        if replayer.clock.position() >= replayer.reader.end_time():
+            break
+
+    replayer.stop()
+    replayer.wait()
+    received += sum(len(device.drain()) for device in devices)
+
+    stats = replayer.statistics()
+    print('replayed ' + str(stats['replayed_bytes']) + ' bytes in ' +\
+          format(stats['replay_time'], '.3f') + ' s (' +\
+          format(stats['bytes_per_second'] / 1e6, '.1f') + ' MB/s), ' +\
+          str(received) + ' messages received, ' +\
+          str(sum(device.total_dropped_messages for device in devices)) + ' dropped')
@@ -0,0 +1,206 @@
+# sys
+import os
+
+# pyserial
+from serial.serialutil import SerialException
+
+class InvalidSerialTuning(Exception):
+        pass
+
+def parse_bool(value):
+    """
+    Parse a boolean option, e.g. '1', 'yes', 'on', 'true'.
+    """
+
+    value = value.lower()
+
+    if value in ('1', 'yes', 'on', 'true'):
+        return True
+    elif value in ('0', 'no', 'off', 'false'):
+        return False
+
+    raise ValueError('invalid boolean ' + value)
+
+def parse_positive_int(value):
+    """
+    Parse an integer option greater than zero.
+    """
+
+    number = int(value)
+
+    if number <= 0:
+        raise ValueError('invalid positive integer ' + value)
+
+    return number
+
+def parse_latency_timer(value):
+    """
+    Parse a latency timer, in milliseconds, as accepted by FTDI drivers.
+    """
+
+    number = int(value)
+
+    if not 1 <= number <= 255:
+        raise ValueError('latency timer out of range [1, 255] ' + value)
+
+    return number
+
+class SerialTuning:
+    """
+    Serial port options of the devices having a given VID:PID.
+
+    Options are given in the configuration file as key=value tokens
+    following the VID and PID, e.g.
+
+        0403 6015 latency_timer=1 low_latency=1
+
+    - baudrate: baud rate of the port
+    - latency_timer: latency timer of FTDI bridges, in milliseconds,
+      written to sysfs (Linux only)
+    - low_latency: set the ASYNC_LOW_LATENCY flag of the port (Linux only)
+    - read_buffer_size: maximum number of bytes read at once from the port
+    - rx_buffer_size: size of the receive buffer of the driver (Windows only)
+
+    Options not given are left untouched, except the baud rate.
+    """
+
+    # option parsers indexed by option name
+    option_parsers = {'baudrate': parse_positive_int,
+                      'latency_timer': parse_latency_timer,
+                      'low_latency': parse_bool,
+                      'read_buffer_size': parse_positive_int,
+                      'rx_buffer_size': parse_positive_int}
+
+    default_baudrate = 115200
+
+    def __init__(self, options = None):
+
+        self.baudrate = self.default_baudrate
+        self.latency_timer = None
+        self.low_latency = None
+        self.read_buffer_size = None
+        self.rx_buffer_size = None
+
+        if options is not None:
+            for name, value in options.items():
+                setattr(self, name, value)
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        """
+        Build a SerialTuning from a list of 'key=value' strings.
+
+        Raise InvalidSerialTuning if a token is not valid.
+        """
+
+        options = dict()
+
+        for token in tokens:
+            name, separator, value = token.partition('=')
+
+            if separator != '=' or name not in cls.option_parsers:
+                raise InvalidSerialTuning('Unknown serial option ' + token)
+
+            try:
+                options[name] = cls.option_parsers[name](value)
+            except ValueError:
+                raise InvalidSerialTuning('Invalid value of serial option ' + token)
+
+        return cls(options)
+
+    def configure(self, serial_port):
+        """
+        Set the options of a serial.Serial instance that
+        have to be set before the port is opened.
+        """
+
+        serial_port.baudrate = self.baudrate
+
+    def apply(self, serial_port, sysfs_root = '/sys'):
+        """
+        Apply the options of an open serial.Serial instance that
+        depend on the operating system and on the driver.
+
+        sysfs_root is the mount point of sysfs, it can be replaced
+        e.g. by a fake directory tree.
+
+        Return a list of strings describing the outcome of each option,
+        failures do not raise exceptions since the port is usable anyway.
+        """
+
+        report = ['baudrate ' + str(self.baudrate)]
+
+        if self.latency_timer is not None:
+            report.append(self.apply_latency_timer(serial_port.port, sysfs_root))
+
+        if self.low_latency is not None:
+            report.append(self.apply_low_latency(serial_port))
+
+        if self.rx_buffer_size is not None:
+            report.append(self.apply_rx_buffer_size(serial_port))
+
+        if self.read_buffer_size is not None:
+            report.append('read_buffer_size ' + str(self.read_buffer_size))
+
+        return report
+
+    def latency_timer_path(self, port_path, sysfs_root = '/sys'):
+        """
+        Return the sysfs file containing the latency timer
+        of the usb-serial device at port_path.
+        """
+
+        # port_path may be a link, e.g. in /dev/serial/by-id
+        name = os.path.basename(os.path.realpath(port_path))
+
+        return os.path.join(sysfs_root, 'bus', 'usb-serial', 'devices', name, 'latency_timer')
+
+    def apply_latency_timer(self, port_path, sysfs_root = '/sys'):
+        """
+        Write the latency timer to sysfs, if different from the current one.
+        """
+
+        path = self.latency_timer_path(port_path, sysfs_root)
+
+        try:
+            with open(path, 'r') as f:
+                current = int(f.read().strip())
+
+            if current != self.latency_timer:
+                with open(path, 'w') as f:
+                    f.write(str(self.latency_timer))
+
+        except FileNotFoundError:
+            return 'latency_timer not available'
+        except (OSError, ValueError) as e:
+            return 'latency_timer failed (' + str(e) + ')'
+
+        return 'latency_timer ' + str(current) + ' -> ' + str(self.latency_timer) + ' ms'
+
+    def apply_low_latency(self, serial_port):
+        """
+        Set or unset the ASYNC_LOW_LATENCY flag of the port.
+        """
+
+        try:
+            serial_port.set_low_latency_mode(self.low_latency)
+        except (AttributeError, NotImplementedError):
+            return 'low_latency not supported'
+        except (ValueError, OSError) as e:
+            return 'low_latency failed (' + str(e) + ')'
+
+        return 'low_latency ' + ('on' if self.low_latency else 'off')
+
+    def apply_rx_buffer_size(self, serial_port):
+        """
+        Set the size of the receive buffer of the driver.
+        """
+
+        try:
+            serial_port.set_buffer_size(rx_size = self.rx_buffer_size)
+        except AttributeError:
+            return 'rx_buffer_size not supported'
+        except (SerialException, ValueError, OSError) as e:
+            return 'rx_buffer_size failed (' + str(e) + ')'
+
+        return 'rx_buffer_size ' + str(self.rx_buffer_size)
@@ -0,0 +1,470 @@
+# sys
+import os
+import tty
+
+# multi-threading
+from threading import Thread, Event
+
+# time measurement
+from time import monotonic
+
+# random trajectories and corruption
+import random
+import math
+
+# pyserial
+from serial.tools.list_ports_common import ListPortInfo
+
+# EVB1000 messages
+from device.decoder import message_schemas
+from device.decoder import TagPositionReport, AnchorPositionsReport, TagPoseEstimate
+
+class CircularTrajectory:
+    """
+    Tag moving along a horizontal circle, heading along the tangent.
+    """
+
+    def __init__(self, center = (0.0, 0.0, 1.0), radius = 1.0, period = 10.0, phase = 0.0):
+
+        self.center = center
+        self.radius = radius
+        self.period = period
+        self.phase = phase
+
+    def pose(self, t):
+        """
+        Return the pose (x, y, z, R, P, Y) at time t, in seconds.
+        """
+
+        angle = self.phase + 2 * math.pi * t / self.period
+
+        x = self.center[0] + self.radius * math.cos(angle)
+        y = self.center[1] + self.radius * math.sin(angle)
+
+        return x, y, self.center[2], 0.0, 0.0, angle + math.pi / 2
+
+class RandomWalkTrajectory:
+    """
+    Tag moving randomly within a box, with a smooth random velocity.
+    """
+
+    def __init__(self, start = (0.0, 0.0, 1.0), speed = 0.5,\
+                 bounds = ((-2.0, 2.0), (-2.0, 2.0), (0.0, 2.0)), seed = None):
+
+        self.position = list(start)
+        self.speed = speed
+        self.bounds = bounds
+        self.random = random.Random(seed)
+
+        # current heading (rad) and time of the last pose
+        self.heading = self.random.uniform(-math.pi, math.pi)
+        self.last_time = None
+
+    def pose(self, t):
+        """
+        Return the pose (x, y, z, R, P, Y) at time t, in seconds.
+
+        Times are expected to be increasing.
+        """
+
+        if self.last_time is not None:
+            dt = t - self.last_time
+
+            # change heading slowly
+            self.heading += self.random.gauss(0, 1.0) * math.sqrt(max(dt, 0))
+
+            self.position[0] += self.speed * math.cos(self.heading) * dt
+            self.position[1] += self.speed * math.sin(self.heading) * dt
+
+            # bounce on the bounds
+            for i, (low, high) in enumerate(self.bounds[:2]):
+                if not low <= self.position[i] <= high:
+                    self.position[i] = min(max(self.position[i], low), high)
+                    self.heading += math.pi
+
+        self.last_time = t
+
+        return self.position[0], self.position[1], self.position[2], 0.0, 0.0, self.heading
+
+class ScriptedTrajectory:
+    """
+    Tag moving through a list of waypoints (t, x, y, z, R, P, Y),
+    linearly interpolated and repeated at the end of the script.
+    """
+
+    def __init__(self, waypoints):
+
+        if len(waypoints) == 0:
+            raise ValueError('At least one waypoint is required.')
+
+        self.waypoints = sorted(waypoints)
+
+        # duration of the script
+        self.duration = self.waypoints[-1][0]
+
+    def pose(self, t):
+        """
+        Return the pose (x, y, z, R, P, Y) at time t, in seconds.
+        """
+
+        if self.duration > 0:
+            t = t % self.duration
+
+        previous = self.waypoints[0]
+        for waypoint in self.waypoints[1:]:
+            if waypoint[0] >= t:
+                span = waypoint[0] - previous[0]
+                alpha = (t - previous[0]) / span if span > 0 else 1.0
+
+                return tuple(p + alpha * (n - p) for p, n in zip(previous[1:], waypoint[1:]))
+
+            previous = waypoint
+
+        return tuple(previous[1:])
+
+class SimulatedTag:
+    """
+    Tag sending its pose at a given rate.
+
+    message_type is 'kmf' (position and attitude), 'tpr' (position only)
+    or 'both', i.e. a 'tpr' and a 'kmf' message for each pose, as the
+    EVB1000 boards send the raw position and the estimated pose.
+    """
+
+    message_types = {'kmf': ('kmf',), 'tpr': ('tpr',), 'both': ('tpr', 'kmf')}
+
+    def __init__(self, tag_id, trajectory, rate = 100.0, message_type = 'both'):
+
+        if message_type not in self.message_types:
+            raise ValueError('Unknown message type ' + str(message_type) + '.')
+
+        self.tag_id = tag_id
+        self.trajectory = trajectory
+        self.period = 1.0 / rate
+        self.schemas = [message_schemas[msg_type] for msg_type in self.message_types[message_type]]
+
+        # time of the next message, relative to the start of the simulation
+        self.next_time = 0.0
+
+    def messages(self, t):
+        """
+        Return the list of the message lines coding the pose at time t.
+        """
+
+        x, y, z, roll, pitch, yaw = self.trajectory.pose(t)
+
+        lines = []
+        for schema in self.schemas:
+            if schema.msg_type == 'kmf':
+                record = TagPoseEstimate(self.tag_id, x, y, z, roll, pitch, yaw)
+            else:
+                record = TagPositionReport(self.tag_id, x, y, z)
+
+            lines.append(schema.encode(record))
+
+        return lines
+
+class SimulatedPort:
+    """
+    Pseudo-terminal emulating the serial port of an EVB1000 board.
+
+    The simulator writes on the master side, the slave side is a
+    serial device, e.g. /dev/pts/N, that Device can open in place of
+    a real port. The slave side is kept open so that the pseudo-terminal
+    is not released while Device closes and opens it again.
+    """
+
+    def __init__(self, tags):
+
+        self.tags = tags
+
+        self.master, self.slave = os.openpty()
+
+        # no echo nor line processing
+        tty.setraw(self.slave)
+
+        # never block the simulator if the port is not read
+        os.set_blocking(self.master, False)
+
+        # path of the serial device
+        self.path = os.ttyname(self.slave)
+
+        # lines waiting to be written, e.g. during a burst
+        self.pending = []
+
+        # time at which a burst ends, None if no burst is in progress
+        self.burst_end = None
+
+        # statistics
+        self.sent_messages = 0
+        self.sent_bytes = 0
+        self.dropped_bytes = 0
+
+    def port_info(self):
+        """
+        Return a ListPortInfo describing the slave side, to be used with Device.
+        """
+
+        try:
+            return ListPortInfo(self.path, skip_link_detection = True)
+        except TypeError:
+            # pyserial < 3.5
+            return ListPortInfo(self.path)
+
+    def write(self, data):
+        """
+        Write to the master side, bytes that do not fit
+        in the pseudo-terminal are dropped and counted.
+        """
+
+        try:
+            written = os.write(self.master, data)
+        except BlockingIOError:
+            written = 0
+        except OSError:
+            # the slave side was closed
+            written = 0
+
+        self.sent_bytes += written
+        self.dropped_bytes += len(data) - written
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+class Simulator(Thread):
+    """
+    Emulate EVB1000 boards sending tpr, apr and kmf messages
+    through pseudo-terminals, e.g. for load testing without physical tags:
+
+        simulator = Simulator(number_of_tags = 50, rate = 100)
+        simulator.start()
+        device_manager.attach_ports(simulator.port_infos())
+
+    Each tag is connected through its own pseudo-terminal and sends
+    its pose at rate Hz along a trajectory (random walks unless
+    trajectories are given) and the anchors positions every anchors_period
+    seconds. message_type selects the messages sent for each pose,
+    as in SimulatedTag.
+
+    Faults can be injected:
+    - corruption_probability: probability that a line is corrupted, i.e.
+      a byte is replaced, the line is truncated or garbage is prepended
+    - burst_probability: probability, each second, that a port holds its
+      messages for burst_duration seconds and then writes them at once,
+      as a stalled USB bridge does
+    """
+
+    # positions of the anchors a0, a1, a2, a3
+    anchors = ((-2.0, -2.0, 2.0), (2.0, -2.0, 2.0), (2.0, 2.0, 2.0), (-2.0, 2.0, 2.0))
+
+    def __init__(self, number_of_tags = 1, rate = 100.0, message_type = 'both',\
+                 trajectories = None, anchors_period = 1.0,\
+                 corruption_probability = 0.0, burst_probability = 0.0,\
+                 burst_duration = 0.1, seed = None):
+        # call Thread constructor
+        Thread.__init__(self, daemon = True)
+
+        self.random = random.Random(seed)
+
+        if trajectories is None:
+            trajectories = [RandomWalkTrajectory(seed = self.random.random()) for i in range(number_of_tags)]
+        elif len(trajectories) != number_of_tags:
+            raise ValueError('One trajectory for each tag is required.')
+
+        # one port for each tag
+        self.ports = [SimulatedPort([SimulatedTag(tag_id, trajectory, rate, message_type)])\
+                      for tag_id, trajectory in enumerate(trajectories)]
+
+        self.anchors_period = anchors_period
+        self.corruption_probability = corruption_probability
+        self.burst_probability = burst_probability
+        self.burst_duration = burst_duration
+
+        # number of lines corrupted
+        self.corrupted_messages = 0
+
+        # set when the simulation has to stop
+        self.stop_event = Event()
+
+    def port_infos(self):
+        """
+        Return the ListPortInfo of all the simulated ports.
+        """
+
+        return [port.port_info() for port in self.ports]
+
+    def anchors_message(self, tag_id):
+        """
+        Return the message line coding the positions of the anchors.
+        """
+
+        coordinates = [c for anchor in self.anchors for c in anchor]
+
+        return message_schemas['apr'].encode(AnchorPositionsReport(tag_id, *coordinates))
+
+    def corrupt(self, line):
+        """
+        Return a corrupted copy of line.
+        """
+
+        self.corrupted_messages += 1
+
+        fault = self.random.randrange(3)
+
+        if fault == 0:
+            # replace a byte with a random one
+            i = self.random.randrange(len(line))
+            return line[:i] + bytes([self.random.randrange(256)]) + line[i + 1:]
+        elif fault == 1:
+            # truncate the line, merging it with the next one
+            return line[:self.random.randrange(len(line) - 2)]
+        else:
+            # prepend garbage
+            return bytes(self.random.randrange(256) for i in range(self.random.randrange(1, 32))) + line
+
+    def stop(self):
+        """
+        Stop the simulation.
+        """
+
+        self.stop_event.set()
+
+    def run(self):
+        """
+        Thread main method.
+        """
+
+        start = monotonic()
+
+        next_anchors_time = 0.0
+        burst_check_time = 0.0
+
+        while not self.stop_event.is_set():
+            t = monotonic() - start
+
+            # the same time is used for all the tags
+            # hence a tick produces a single write for each port
+            send_anchors = t >= next_anchors_time
+            if send_anchors:
+                next_anchors_time = t + self.anchors_period
+
+            check_bursts = t >= burst_check_time
+            if check_bursts:
+                burst_check_time = t + 1.0
+
+            for port in self.ports:
+                # lines generated in this tick
+                new = []
+
+                for tag in port.tags:
+                    if send_anchors:
+                        new.append(self.anchors_message(tag.tag_id))
+
+                    # messages due since the last tick, if the simulator
+                    # lags more than a second the messages are skipped
+                    if t - tag.next_time > 1.0:
+                        tag.next_time = t
+
+                    while tag.next_time <= t:
+                        new.extend(tag.messages(tag.next_time))
+                        tag.next_time += tag.period
+
+                # only the new lines are corrupted, those held
+                # during a burst already had their chance
+                if self.corruption_probability > 0:
+                    new = [self.corrupt(line) if self.random.random() < self.corruption_probability else line\
+                           for line in new]
+
+                port.sent_messages += len(new)
+
+                lines = port.pending + new
+
+                # start a burst
+                if check_bursts and port.burst_end is None and\
+                   self.random.random() < self.burst_probability:
+                    port.burst_end = t + self.burst_duration
+
+                if port.burst_end is not None and t < port.burst_end:
+                    # hold the messages
+                    port.pending = lines
+                    continue
+
+                port.burst_end = None
+                port.pending = []
+
+                if lines:
+                    port.write(b''.join(lines))
+
+            # wait for the next message due
+            next_time = min([tag.next_time for port in self.ports for tag in port.tags] + [next_anchors_time])
+            self.stop_event.wait(max(0, next_time - (monotonic() - start)))
+
+        for port in self.ports:
+            port.close()
+
+    def statistics(self):
+        """
+        Return a dictionary containing the number of messages, bytes
+        sent and dropped and the number of messages corrupted.
+        """
+
+        return {'sent_messages': sum(port.sent_messages for port in self.ports),
+                'sent_bytes': sum(port.sent_bytes for port in self.ports),
+                'dropped_bytes': sum(port.dropped_bytes for port in self.ports),
+                'corrupted_messages': self.corrupted_messages}
+
+if __name__ == '__main__':
+    # load test of the device layer, the messages sent by the
+    # simulated tags are read and decoded by Device threads
+    import argparse
+    from time import sleep
+
+    from device.device_manager import Device
+
+    parser = argparse.ArgumentParser(description = 'EVB1000 simulator load test')
+    parser.add_argument('--tags', type = int, default = 50)
+    parser.add_argument('--rate', type = float, default = 100.0)
+    parser.add_argument('--duration', type = float, default = 10.0)
+    parser.add_argument('--corruption', type = float, default = 0.0)
+    parser.add_argument('--bursts', type = float, default = 0.0)
+    parser.add_argument('--messages', choices = sorted(SimulatedTag.message_types), default = 'both')
+    args = parser.parse_args()
+
+    simulator = Simulator(args.tags, args.rate, args.messages,\
+                          corruption_probability = args.corruption,\
+                          burst_probability = args.bursts)
+
+    devices = [Device(port) for port in simulator.port_infos()]
+    for device in devices:
+        device.start()
+
+    simulator.start()
+
+    received = 0
+    end = monotonic() + args.duration
+    while monotonic() < end:
+        sleep(0.1)
+        received += sum(len(device.drain()) for device in devices)
+
+    simulator.stop()
+    for device in devices:
+        device.stop_device()
+    for device in devices:
+        device.wait()
+    received += sum(len(device.drain()) for device in devices)
+
+    stats = simulator.statistics()
+    errors = dict()
+    for device in devices:
+        for name, count in device.parser.error_counts.items():
+            errors[name] = errors.get(name, 0) + count
+
+    print('sent ' + str(stats['sent_messages']) + ' messages (' +\
+          format(stats['sent_messages'] / args.duration, '.0f') + ' msg/s), ' +\
+          str(stats['corrupted_messages']) + ' corrupted, ' +\
+          str(stats['dropped_bytes']) + ' bytes dropped by the ptys')
+    print('received ' + str(received) + ' messages (' +\
+          format(received / args.duration, '.0f') + ' msg/s), ' +\
+          str(sum(device.total_dropped_messages for device in devices)) + ' dropped by the devices')
+    print('parser errors ' + str(errors))
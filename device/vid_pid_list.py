@@ -0,0 +1,133 @@
+# sys
+import sys
+import errno
+
+# csv required by class DeviceVIDPIDList
+import csv
+
+# pyserial
+from serial.tools import list_ports
+
+# serial port options
+from device.serial_tuning import SerialTuning, InvalidSerialTuning
+
+def list_matching_ports(vid_pid_s):
+    """
+    Return the list of serial ports whose underlying usb device
+    matches one of the (VID, PID) pairs in vid_pid_s.
+
+    Ports are enumerated once whatever the number of pairs.
+    """
+
+    # pairs as integers, as stored in ListPortInfo
+    targets = set((int(vid, 16), int(pid, 16)) for vid, pid in vid_pid_s)
+
+    return [p for p in list_ports.comports() if (p.vid, p.pid) in targets]
+
+class MalformedConfigurationFile(Exception):
+        pass
+
+class DeviceVIDPIDList:
+    """
+    Store VIDs and PIDs for devices that are part of the EVB1000 system.
+
+    Each VID and PID may be followed by serial port options, see SerialTuning.
+    """
+
+    def __init__(self, filename):
+
+        # filename of the configuration file
+        self.filename = filename
+        
+        # empty list of ids
+        self.vid_pid_s = []
+
+        # serial port options indexed by (VID, PID) as integers
+        self.serial_tunings = dict()
+
+        # load VIDs and PIDs from file
+        self.load_from_file()
+
+    def get_vid_pid_list(self):
+        """
+        Return the list containing the valid VIDs and PIDs
+        """
+
+        return self.vid_pid_s
+
+    def get_serial_tuning(self, vid, pid):
+        """
+        Return the SerialTuning of the devices having the
+        given VID and PID (integers, as in ListPortInfo).
+        """
+
+        return self.serial_tunings.get((vid, pid), SerialTuning())
+
+    def load_from_file(self):
+        """
+        Load VIDs and PIDs from file
+        """
+
+        # if state = 0 the function checks if
+        # the file starts with the string CONFIG_VID_PID
+        state = 0
+
+        try: 
+            with open(self.filename, 'r') as csvfile:
+                reader = csv.reader(csvfile, delimiter=' ')
+                for row in reader:
+
+                    # checks if the file starts with CONFIG_VID_PID
+                    if state == 0:
+                        if not (row[0] == 'CONFIG_VID_PID'):
+                            raise MalformedConfigurationFile
+                        else:
+                            # go to next step, i.e., checking the header of the file
+                            state = state + 1
+                            
+                    # checks if the header is of the form 'VID PID'
+                    elif state == 1:
+                        if not (row[0] == 'VID' and row[1] == 'PID'):
+                            raise MalformedConfigurationFile
+                        else:
+                            # go to next step, i.e., reading tuples of VIDs and PIDs
+                            # if they are valid
+                            state = state + 1
+
+                    # read and store tuples of VIDs and PIDs, if they are valid
+                    else:
+                        # extract VID and PID
+                        vid = row[0]
+                        pid = row[1]
+                        
+                        # check if the row contains a 4 characters long VID and
+                        # a 4 characters long PID
+                        if (len(row[0]) != 4) or (len(row[1]) != 4):
+                            raise MalformedConfigurationFile
+
+                        # store (VID, PID) pair
+                        self.vid_pid_s.append((vid,pid))
+
+                        # store serial port options, if any
+                        try:
+                            key = (int(vid, 16), int(pid, 16))
+                        except ValueError:
+                            raise MalformedConfigurationFile
+                        options = [token for token in row[2:] if token]
+                        self.serial_tunings[key] = SerialTuning.from_tokens(options)
+        
+        except (OSError, IOError) as e:
+            if getattr(e, 'errno', 0) == errno.ENOENT:
+                print('Error: Configuration file ' + self.filename + ' not found.')
+                sys.exit(1)
+        except MalformedConfigurationFile:
+            print('Error: Malformed configuration file ' + self.filename + '.')
+            sys.exit(1)
+        except InvalidSerialTuning as e:
+            print('Error: ' + str(e) + ' in ' + self.filename + '.')
+            sys.exit(1)
+
+        # if no (VID, PID) tuples were found exit
+        if len(self.vid_pid_s) == 0:
+            print('Error: No (VID, PID) entries found in ' + self.filename + '.')
+            sys.exit(1)
@@ -0,0 +1,428 @@
+# compression
+import zlib
+import lzma
+
+# file layout
+import struct
+import json
+
+# merge of the samples of several ports by time
+import heapq
+
+# numpy
+import numpy as np
+
+# EVB1000 messages
+from device.decoder import StreamParser, message_schemas
+
+# raw captures
+from device.capture import CaptureReader, CaptureRecorder
+
+# archive file layout
+#
+# MAGIC, the compressed chunks, the index (JSON, utf-8) and a TRAILER
+# containing the offset of the index and MAGIC again.
+#
+# Each chunk contains up to chunk_size samples of one message type
+# received from one port. Its columns (timestamp, sequence number, tag_id
+# and the value fields of the message) are delta encoded, byte shuffled
+# and compressed one by one, so that each column can be decoded alone.
+MAGIC = b'EVBARC01'
+TRAILER = struct.Struct('<Q8s')
+
+# compression functions indexed by codec name
+codecs = {'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+          'lzma': (lzma.compress, lzma.decompress)}
+
+class InvalidArchiveFile(Exception):
+        pass
+
+def column_dtypes(msg_type):
+    """
+    Return the list of (column name, integer dtype) of the chunks of msg_type.
+
+    Timestamps are stored in microseconds, tag ids and values (float32
+    as sent by the EVB1000) as their 32 bits patterns, hence values
+    are stored without any loss. The sequence number is the position of
+    the message in the capture, it keeps the order of the messages
+    having the same timestamp.
+    """
+
+    schema = message_schemas[msg_type]
+
+    return [('timestamp', np.int64), ('sequence', np.int64), ('tag_id', np.int32)] +\
+           [(field, np.int32) for field in schema.value_fields]
+
+def encode_column(column):
+    """
+    Delta encode an integer column and shuffle its bytes, i.e. store
+    the first byte of all the values, then the second one and so on.
+
+    Integer arithmetic wraps around, hence the encoding is exact.
+    """
+
+    deltas = np.diff(column, prepend = column.dtype.type(0))
+
+    return deltas.view(np.uint8).reshape(-1, column.itemsize).T.tobytes()
+
+def decode_column(data, dtype, rows):
+    """
+    Inverse of encode_column().
+    """
+
+    dtype = np.dtype(dtype)
+
+    deltas = np.frombuffer(data, np.uint8).reshape(dtype.itemsize, rows).T.copy().view(dtype)
+
+    return np.cumsum(deltas.ravel(), dtype = dtype)
+
+class ArchiveWriter:
+    """
+    Write the samples decoded from a capture in a compressed archive.
+
+    Samples are buffered for each (port, message type) and written as a
+    chunk every chunk_size samples. start_time and wall_start_time are
+    those of the capture, so that it can be rebuilt.
+    """
+
+    def __init__(self, path, codec = 'zlib', chunk_size = 4096, start_time = 0.0, wall_start_time = 0.0):
+
+        if codec not in codecs:
+            raise ValueError('Unknown codec ' + str(codec) + '.')
+
+        self.codec = codec
+        self.compress = codecs[codec][0]
+        self.chunk_size = chunk_size
+
+        self.file = open(path, 'xb')
+        self.file.write(MAGIC)
+
+        # index written at the end of the archive
+        self.index = {'codec': codec,
+                      'chunk_size': chunk_size,
+                      'start_time': start_time,
+                      'wall_start_time': wall_start_time,
+                      'ports': [],
+                      'chunks': []}
+
+        # port indices indexed by port path
+        self.port_indices = dict()
+
+        # samples not yet written, lists of (timestamp, sequence number, record)
+        # indexed by (port index, message type)
+        self.pending = dict()
+
+        # number of messages added so far
+        self.sequence = 0
+
+    def add(self, port, timestamp, record):
+        """
+        Add a decoded message received from port at timestamp.
+        """
+
+        port_index = self.port_indices.get(port)
+        if port_index is None:
+            port_index = self.port_indices[port] = len(self.index['ports'])
+            self.index['ports'].append(port)
+
+        key = (port_index, record.msg_type)
+
+        samples = self.pending.setdefault(key, [])
+        samples.append((timestamp, self.sequence, record))
+        self.sequence += 1
+
+        if len(samples) == self.chunk_size:
+            self.write_chunk(key, samples)
+            self.pending[key] = []
+
+    def write_chunk(self, key, samples):
+        """
+        Encode, compress and write a chunk.
+        """
+
+        port_index, msg_type = key
+        schema = message_schemas[msg_type]
+
+        timestamps = np.array([timestamp for timestamp, sequence, record in samples])
+        records = [record for timestamp, sequence, record in samples]
+
+        columns = [np.round(timestamps * 1e6).astype(np.int64),
+                   np.array([sequence for timestamp, sequence, record in samples], dtype = np.int64),
+                   np.array([record.tag_id for record in records], dtype = np.uint32).view(np.int32)]
+        for field in schema.value_fields:
+            values = np.array([getattr(record, field) for record in records], dtype = np.float32)
+            columns.append(values.view(np.int32))
+
+        offset = self.file.tell()
+        sizes = []
+        for column in columns:
+            data = self.compress(encode_column(column))
+            self.file.write(data)
+            sizes.append(len(data))
+
+        self.index['chunks'].append({'port': port_index,
+                                     'msg_type': msg_type,
+                                     'rows': len(samples),
+                                     't_min': float(timestamps[0]),
+                                     't_max': float(timestamps[-1]),
+                                     'offset': offset,
+                                     'sizes': sizes})
+
+    def close(self):
+        """
+        Write the pending samples and the index.
+        """
+
+        for key, samples in self.pending.items():
+            if samples:
+                self.write_chunk(key, samples)
+        self.pending = dict()
+
+        index_offset = self.file.tell()
+        self.file.write(json.dumps(self.index).encode('utf-8'))
+        self.file.write(TRAILER.pack(index_offset, MAGIC))
+
+        self.file.close()
+
+class ArchiveReader:
+    """
+    Read an archive written by ArchiveWriter.
+
+    The index is loaded when the archive is opened, the chunks are read and
+    decompressed only when a query touches them, i.e. when their time
+    range [t_min, t_max] overlaps the one requested.
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise InvalidArchiveFile
+
+            f.seek(-TRAILER.size, 2)
+            index_offset, magic = TRAILER.unpack(f.read(TRAILER.size))
+            if magic != MAGIC:
+                # the archive was not closed
+                raise InvalidArchiveFile
+
+            f.seek(index_offset)
+            self.index = json.loads(f.read()[:-TRAILER.size].decode('utf-8'))
+
+        self.decompress = codecs[self.index['codec']][1]
+        self.ports = self.index['ports']
+        self.start_time = self.index['start_time']
+        self.wall_start_time = self.index['wall_start_time']
+
+        # number of chunks decompressed, e.g. to check the queries
+        self.decompressed_chunks = 0
+
+    def select_chunks(self, start_time = None, end_time = None, msg_types = None, ports = None):
+        """
+        Return the index entries of the chunks overlapping the time range,
+        of the given message types and ports (all by default).
+        """
+
+        selected = []
+
+        for chunk in self.index['chunks']:
+            if start_time is not None and chunk['t_max'] < start_time:
+                continue
+            if end_time is not None and chunk['t_min'] > end_time:
+                continue
+            if msg_types is not None and chunk['msg_type'] not in msg_types:
+                continue
+            if ports is not None and self.ports[chunk['port']] not in ports:
+                continue
+
+            selected.append(chunk)
+
+        return selected
+
+    def read_chunk(self, chunk):
+        """
+        Decompress a chunk.
+
+        Return a structured array with a float64 timestamp field, an int64
+        sequence field and the fields of MessageSchema.dtype, i.e. tag_id
+        and the values.
+        """
+
+        schema = message_schemas[chunk['msg_type']]
+        rows = chunk['rows']
+
+        with open(self.path, 'rb') as f:
+            f.seek(chunk['offset'])
+            data = f.read(sum(chunk['sizes']))
+
+        dtype = np.dtype([('timestamp', np.float64), ('sequence', np.int64)] + schema.dtype.descr)
+        samples = np.empty(rows, dtype = dtype)
+
+        offset = 0
+        for (name, column_dtype), size in zip(column_dtypes(chunk['msg_type']), chunk['sizes']):
+            column = decode_column(self.decompress(data[offset:offset + size]), column_dtype, rows)
+            offset += size
+
+            if name == 'timestamp':
+                samples[name] = column / 1e6
+            elif name == 'sequence':
+                samples[name] = column
+            else:
+                samples[name] = column.view(samples.dtype[name])
+
+        self.decompressed_chunks += 1
+
+        return samples
+
+    def arrays(self, msg_type, start_time = None, end_time = None, ports = None):
+        """
+        Generator of the samples of msg_type between start_time and end_time,
+        chunk by chunk.
+
+        Yield tuples (port, structured array), see read_chunk().
+        """
+
+        for chunk in self.select_chunks(start_time, end_time, (msg_type,), ports):
+            samples = self.read_chunk(chunk)
+
+            mask = np.ones(len(samples), dtype = bool)
+            if start_time is not None:
+                mask &= samples['timestamp'] >= start_time
+            if end_time is not None:
+                mask &= samples['timestamp'] <= end_time
+
+            yield self.ports[chunk['port']], samples[mask]
+
+    def stream_records(self, chunks, start_time, end_time):
+        """
+        Generator of the records of a sequence of chunks, in time order.
+
+        Yield tuples (timestamp, sequence number, port, MessageRecord).
+        """
+
+        for chunk in chunks:
+            schema = message_schemas[chunk['msg_type']]
+            port = self.ports[chunk['port']]
+
+            for sample in self.read_chunk(chunk):
+                timestamp = float(sample['timestamp'])
+
+                if start_time is not None and timestamp < start_time:
+                    continue
+                if end_time is not None and timestamp > end_time:
+                    return
+
+                record = schema.record_class(*[sample[name].item() for name in schema.dtype.names])
+
+                yield timestamp, int(sample['sequence']), port, record
+
+    def records(self, start_time = None, end_time = None):
+        """
+        Generator of all the messages between start_time and end_time,
+        in time order.
+
+        Yield tuples (timestamp, port, MessageRecord).
+        """
+
+        # chunks of the same port and message type are in time order
+        streams = dict()
+        for chunk in self.select_chunks(start_time, end_time):
+            streams.setdefault((chunk['port'], chunk['msg_type']), []).append(chunk)
+
+        merged = heapq.merge(*[self.stream_records(chunks, start_time, end_time) for chunks in streams.values()],\
+                             key = lambda item: item[:2])
+
+        for timestamp, sequence, port, record in merged:
+            yield timestamp, port, record
+
+    def lines(self, start_time = None, end_time = None):
+        """
+        Generator of the messages between start_time and end_time
+        coded as the EVB1000 sends them, in time order.
+
+        Yield tuples (timestamp, port, line).
+        """
+
+        for timestamp, port, record in self.records(start_time, end_time):
+            yield timestamp, port, message_schemas[record.msg_type].encode(record)
+
+def capture_to_archive(capture_path, archive_path, codec = 'zlib', chunk_size = 4096):
+    """
+    Decode a capture recorded by CaptureRecorder and write its messages
+    in an archive. Messages are timestamped with the time of the chunk
+    that completed them, invalid data is not archived.
+
+    Return the ArchiveWriter, e.g. to inspect its index.
+    """
+
+    reader = CaptureReader(capture_path)
+    writer = ArchiveWriter(archive_path, codec, chunk_size, reader.start_time, reader.wall_start_time)
+
+    # the stream of each port is parsed on its own
+    parsers = dict()
+
+    for timestamp, port, chunk in reader.chunks():
+        parser = parsers.get(port)
+        if parser is None:
+            parser = parsers[port] = StreamParser()
+
+        for record in parser.feed(chunk):
+            writer.add(port, timestamp, record)
+
+    writer.close()
+
+    return writer
+
+def archive_to_capture(archive_path, capture_path, start_time = None, end_time = None):
+    """
+    Write the messages of an archive between start_time and end_time
+    in a capture, e.g. to be replayed by a Replayer.
+
+    The messages of a port with the same timestamp are written as one chunk.
+    """
+
+    reader = ArchiveReader(archive_path)
+    recorder = CaptureRecorder(capture_path, start_time = reader.start_time,\
+                               wall_start_time = reader.wall_start_time)
+
+    pending_key = None
+    pending_lines = []
+
+    for timestamp, port, line in reader.lines(start_time, end_time):
+        if (timestamp, port) != pending_key:
+            if pending_lines:
+                recorder.write_chunk(pending_key[0], pending_key[1], b''.join(pending_lines))
+            pending_key = (timestamp, port)
+            pending_lines = []
+
+        pending_lines.append(line)
+
+    if pending_lines:
+        recorder.write_chunk(pending_key[0], pending_key[1], b''.join(pending_lines))
+
+    # the recorder thread was never started, close() closes the files
+    recorder.close()
+
+if __name__ == '__main__':
+    # convert a capture to an archive or an archive to a capture, e.g.
+    #     python -m storage.archive pack session.cap session.arc
+    #     python -m storage.archive unpack session.arc replay.cap
+    import os
+    import sys
+
+    command, source, destination = sys.argv[1:4]
+
+    if command == 'pack':
+        codec = sys.argv[4] if len(sys.argv) > 4 else 'zlib'
+        writer = capture_to_archive(source, destination, codec)
+
+        samples = sum(chunk['rows'] for chunk in writer.index['chunks'])
+        print(str(samples) + ' messages in ' + str(len(writer.index['chunks'])) + ' chunks, ' +\
+              str(os.path.getsize(source)) + ' -> ' + str(os.path.getsize(destination)) + ' bytes (' +\
+              format(os.path.getsize(source) / os.path.getsize(destination), '.1f') + 'x)')
+    elif command == 'unpack':
+        archive_to_capture(source, destination)
+    else:
+        print('Unknown command ' + command + '.')
+        sys.exit(1)
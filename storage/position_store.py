@@ -0,0 +1,316 @@
+# sys
+import os
+
+# manifest
+import json
+
+# numpy
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# time measurement
+from time import monotonic
+
+# name of the manifest file in the store directory
+MANIFEST = 'manifest.json'
+
+class PositionStore:
+    """
+    Persistent columnar store of the tag poses.
+
+    The samples of each tag are stored in fixed-size chunks, each one a
+    memory-mapped .npy file containing an array of shape
+    (number of columns, chunk_size), one row for each column, so that
+    each column of a chunk is contiguous on disk and can be mapped
+    without copies. Columns are named after the decoder fields:
+
+        timestamp, x, y, z, R, P, Y
+
+    where timestamp is the wall clock time (seconds since the epoch) at
+    which the message was read from the serial port, or recorded in the
+    capture being replayed, and R, P, Y are NaN for samples without
+    attitude ('tpr' messages).
+
+    A manifest (manifest.json) lists the chunks of each tag with the number
+    of valid rows and their minimum and maximum timestamp. It is rewritten
+    atomically when a chunk is full, on flush() and every flush_interval
+    seconds, hence readers only see rows that were committed.
+
+    The store is opened for appending (mode 'a', created if missing)
+    or read-only (mode 'r'). Appending is not thread safe: a single
+    producer, e.g. the GUI thread, is expected.
+    """
+
+    columns = ('timestamp', 'x', 'y', 'z', 'R', 'P', 'Y')
+
+    def __init__(self, path, mode = 'a', chunk_size = 65536, flush_interval = 5.0):
+
+        if mode not in ('a', 'r'):
+            raise ValueError('Unknown mode ' + str(mode) + '.')
+
+        self.path = path
+        self.mode = mode
+        self.flush_interval = flush_interval
+
+        manifest_path = os.path.join(path, MANIFEST)
+
+        if os.path.exists(manifest_path):
+            self.load_manifest()
+        elif mode == 'a':
+            os.makedirs(path, exist_ok = True)
+
+            self.chunk_size = chunk_size
+            self.tag_chunks = dict()
+
+            self.write_manifest()
+        else:
+            raise FileNotFoundError(manifest_path)
+
+        # memory-mapped chunks indexed by (tag id, chunk index)
+        self.mapped_chunks = dict()
+
+        # plain ndarray views on the chunks being written, cheaper
+        # to index than np.memmap, indexed by tag id
+        self.write_views = dict()
+
+        # time of the last flush
+        self.last_flush = monotonic()
+
+    def load_manifest(self):
+        """
+        Load the chunks listed in the manifest.
+        """
+
+        with open(os.path.join(self.path, MANIFEST), 'r') as f:
+            manifest = json.load(f)
+
+        self.chunk_size = manifest['chunk_size']
+
+        # chunks indexed by tag id, each chunk is a dictionary with
+        # keys 'file', 'rows', 't_min' and 't_max'
+        self.tag_chunks = {int(tag_id): chunks for tag_id, chunks in manifest['tags'].items()}
+
+    def refresh(self):
+        """
+        Reload the manifest of a store opened read-only, so that
+        the samples committed by a writer in the meantime are seen.
+        """
+
+        if self.mode == 'r':
+            self.load_manifest()
+
+    def tags(self):
+        """
+        Return the sorted list of the ids of the tags in the store.
+        """
+
+        return sorted(self.tag_chunks)
+
+    def chunks(self, tag_id):
+        """
+        Return the list of the chunks of tag_id, each one a dictionary
+        with keys 'file', 'rows', 't_min' and 't_max'.
+        """
+
+        return self.tag_chunks.get(tag_id, [])
+
+    def number_of_samples(self, tag_id):
+        """
+        Return the number of samples of tag_id.
+        """
+
+        return sum(chunk['rows'] for chunk in self.chunks(tag_id))
+
+    def chunk_array(self, tag_id, index):
+        """
+        Return the memory-mapped array of shape (number of columns, chunk_size)
+        of a chunk, including the rows not yet committed.
+        """
+
+        key = (tag_id, index)
+
+        array = self.mapped_chunks.get(key)
+        if array is None:
+            chunk_path = os.path.join(self.path, self.tag_chunks[tag_id][index]['file'])
+            array = np.load(chunk_path, mmap_mode = 'r+' if self.mode == 'a' else 'r')
+            self.mapped_chunks[key] = array
+
+        return array
+
+    def write_view(self, tag_id):
+        """
+        Return a plain ndarray view on the last chunk of tag_id.
+        """
+
+        view = self.write_views.get(tag_id)
+        if view is None:
+            view = self.chunk_array(tag_id, len(self.tag_chunks[tag_id]) - 1).view(np.ndarray)
+            self.write_views[tag_id] = view
+
+        return view
+
+    def chunk(self, tag_id, index):
+        """
+        Return a view of shape (number of columns, rows) on the
+        committed rows of a chunk, no data is copied.
+        """
+
+        return self.chunk_array(tag_id, index)[:, :self.tag_chunks[tag_id][index]['rows']]
+
+    def column_index(self, name):
+        """
+        Return the row of column name in the chunks.
+        """
+
+        return self.columns.index(name)
+
+    def new_chunk(self, tag_id):
+        """
+        Create a new empty chunk for tag_id and return its index.
+        """
+
+        chunks = self.tag_chunks.setdefault(tag_id, [])
+        index = len(chunks)
+
+        tag_dir = 'tag_' + str(tag_id)
+        os.makedirs(os.path.join(self.path, tag_dir), exist_ok = True)
+
+        chunk_file = os.path.join(tag_dir, 'chunk_' + format(index, '06d') + '.npy')
+        array = open_memmap(os.path.join(self.path, chunk_file), mode = 'w+',\
+                            dtype = np.float64, shape = (len(self.columns), self.chunk_size))
+
+        chunks.append({'file': chunk_file, 'rows': 0, 't_min': None, 't_max': None})
+        self.mapped_chunks[(tag_id, index)] = array
+
+        return index
+
+    def append_block(self, tag_id, block):
+        """
+        Append the samples of tag_id in block, an array of shape
+        (N, number of columns) whose rows are sorted by timestamp.
+
+        Timestamps older than the last one stored for the tag are raised to
+        it, so that the timestamp columns stay sorted even if the clock is
+        moved backwards.
+        """
+
+        block = np.asarray(block, dtype = np.float64)
+        if len(block) == 0:
+            return
+
+        chunks = self.tag_chunks.get(tag_id)
+        if chunks:
+            last_time = chunks[-1]['t_max']
+            if last_time is not None and block[0, 0] < last_time:
+                block = block.copy()
+                np.maximum(block[:, 0], last_time, out = block[:, 0])
+
+        written = 0
+        while written < len(block):
+            chunks = self.tag_chunks.get(tag_id)
+            if not chunks or chunks[-1]['rows'] == self.chunk_size:
+                # the previous chunk is full, commit it and release its map
+                if chunks:
+                    self.flush()
+                    self.mapped_chunks.pop((tag_id, len(chunks) - 1), None)
+                    self.write_views.pop(tag_id, None)
+                index = self.new_chunk(tag_id)
+            else:
+                index = len(chunks) - 1
+
+            chunk = self.tag_chunks[tag_id][index]
+            array = self.write_view(tag_id)
+
+            rows = chunk['rows']
+            n = min(self.chunk_size - rows, len(block) - written)
+
+            # one slice write for each column
+            array[:, rows:rows + n] = block[written:written + n].T
+
+            if chunk['t_min'] is None:
+                chunk['t_min'] = float(block[written, 0])
+            chunk['t_max'] = float(block[written + n - 1, 0])
+            chunk['rows'] = rows + n
+
+            written += n
+
+        if monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def append(self, tag_id, timestamp, x, y, z, R = np.nan, P = np.nan, Y = np.nan):
+        """
+        Append a single sample of tag_id.
+        """
+
+        chunks = self.tag_chunks.get(tag_id)
+
+        # fast path, the sample fits in the last chunk and keeps it sorted
+        if chunks and chunks[-1]['rows'] < self.chunk_size and\
+           chunks[-1]['t_max'] is not None and timestamp >= chunks[-1]['t_max']:
+            chunk = chunks[-1]
+            rows = chunk['rows']
+
+            self.write_view(tag_id)[:, rows] = (timestamp, x, y, z, R, P, Y)
+
+            chunk['t_max'] = float(timestamp)
+            chunk['rows'] = rows + 1
+
+            if monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+            return
+
+        self.append_block(tag_id, [[timestamp, x, y, z, R, P, Y]])
+
+    def append_message(self, message, timestamp):
+        """
+        Append the pose contained in a decoded 'tpr' or 'kmf' message
+        received at timestamp. Other messages are ignored.
+        """
+
+        if message.msg_type == 'kmf':
+            self.append(message.tag_id, timestamp, message.x, message.y, message.z,\
+                        message.R, message.P, message.Y)
+        elif message.msg_type == 'tpr':
+            self.append(message.tag_id, timestamp, message.x, message.y, message.z)
+
+    def write_manifest(self):
+        """
+        Write the manifest atomically.
+        """
+
+        manifest = {'columns': list(self.columns),
+                    'chunk_size': self.chunk_size,
+                    'tags': {str(tag_id): chunks for tag_id, chunks in self.tag_chunks.items()}}
+
+        manifest_path = os.path.join(self.path, MANIFEST)
+        temporary_path = manifest_path + '.tmp'
+
+        with open(temporary_path, 'w') as f:
+            json.dump(manifest, f)
+
+        os.replace(temporary_path, manifest_path)
+
+    def flush(self):
+        """
+        Write the samples to disk and commit them in the manifest.
+        """
+
+        if self.mode != 'a':
+            return
+
+        for array in self.mapped_chunks.values():
+            array.flush()
+
+        self.write_manifest()
+
+        self.last_flush = monotonic()
+
+    def close(self):
+        """
+        Commit the samples and release the memory maps.
+        """
+
+        self.flush()
+
+        self.mapped_chunks = dict()
+        self.write_views = dict()
@@ -0,0 +1,236 @@
+# numpy
+import numpy as np
+
+# binary search on the chunk metadata
+import bisect
+
+# timestamps of any numeric type
+import numbers
+
+# times of day
+from datetime import datetime
+
+# position store
+from storage.position_store import PositionStore
+
+def to_timestamp(value, reference = None):
+    """
+    Convert a time to a timestamp (seconds since the epoch).
+
+    value can be a timestamp (any real number, including NumPy
+    scalars, e.g. taken from the store), a datetime, an ISO string, e.g.
+    '2024-05-03 14:02', or a local time of day, e.g. '14:02' or '14:02:30',
+    taken on the day of reference (a timestamp, today by default).
+    None is returned unchanged, i.e. an unbounded time.
+    """
+
+    if value is None:
+        return value
+
+    if isinstance(value, (numbers.Real, np.number)):
+        return float(value)
+
+    if isinstance(value, datetime):
+        return value.timestamp()
+
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        pass
+
+    # time of day
+    parts = [int(part) for part in value.split(':')]
+    if not 2 <= len(parts) <= 3:
+        raise ValueError('Invalid time ' + value + '.')
+
+    if reference is None:
+        day = datetime.now()
+    else:
+        day = datetime.fromtimestamp(reference)
+
+    hour, minute = parts[0], parts[1]
+    second = parts[2] if len(parts) == 3 else 0
+
+    return day.replace(hour = hour, minute = minute, second = second, microsecond = 0).timestamp()
+
+class TimeRange:
+    """
+    Samples of a tag between two times, stored in a PositionStore.
+
+    No data is read when the range is built: it is a list of slices of
+    chunks, (chunk index, first row, end row), and the samples are
+    accessed through views on the memory-mapped chunks. Column names are
+    those of PositionStore.columns, i.e. the decoder fields.
+    """
+
+    def __init__(self, store, tag_id, slices):
+
+        self.store = store
+        self.tag_id = tag_id
+        self.slices = slices
+
+    def __len__(self):
+        return sum(end - begin for index, begin, end in self.slices)
+
+    def chunk_views(self, columns = None):
+        """
+        Generator of the samples, chunk by chunk.
+
+        Yield a dictionary of views, one for each column in columns
+        (all by default), indexed by column name.
+        """
+
+        if columns is None:
+            columns = self.store.columns
+
+        rows = [self.store.column_index(name) for name in columns]
+
+        for index, begin, end in self.slices:
+            chunk = self.store.chunk(self.tag_id, index)
+
+            yield {name: chunk[row, begin:end] for name, row in zip(columns, rows)}
+
+    def column(self, name):
+        """
+        Return the samples of a column.
+
+        If the range lies within a chunk a view is returned,
+        otherwise the views on the chunks are concatenated.
+        """
+
+        views = [views[name] for views in self.chunk_views((name,))]
+
+        if len(views) == 0:
+            return np.empty(0)
+        elif len(views) == 1:
+            return views[0]
+
+        return np.concatenate(views)
+
+    @property
+    def timestamps(self):
+        return self.column('timestamp')
+
+    def to_records(self, columns = None):
+        """
+        Return the samples as a structured array with fields tag_id and
+        the columns, in the same order as in the decoder records.
+        """
+
+        if columns is None:
+            columns = self.store.columns
+
+        dtype = np.dtype([('tag_id', np.uint32)] + [(name, np.float64) for name in columns])
+        records = np.empty(len(self), dtype = dtype)
+        records['tag_id'] = self.tag_id
+
+        offset = 0
+        for views in self.chunk_views(columns):
+            n = len(views[columns[0]])
+            for name in columns:
+                records[name][offset:offset + n] = views[name]
+            offset += n
+
+        return records
+
+def find_slices(store, tag_id, start_time = None, end_time = None):
+    """
+    Return the list of the slices (chunk index, first row, end row)
+    of the samples of tag_id with start_time <= timestamp <= end_time.
+
+    Chunks are selected with a binary search on their minimum and
+    maximum timestamps, rows with a binary search on the timestamps of
+    the selected chunks, hence only the pages touched by the searches
+    are read from disk.
+    """
+
+    chunks = [(index, chunk) for index, chunk in enumerate(store.chunks(tag_id)) if chunk['rows'] > 0]
+
+    t_mins = [chunk['t_min'] for index, chunk in chunks]
+    t_maxs = [chunk['t_max'] for index, chunk in chunks]
+
+    # first chunk ending after start_time and first chunk starting after end_time
+    first = 0 if start_time is None else bisect.bisect_left(t_maxs, start_time)
+    last = len(chunks) if end_time is None else bisect.bisect_right(t_mins, end_time)
+
+    timestamp_row = store.column_index('timestamp')
+
+    slices = []
+    for index, chunk in chunks[first:last]:
+        begin = 0
+        end = chunk['rows']
+
+        if start_time is not None and start_time > chunk['t_min'] or\
+           end_time is not None and end_time < chunk['t_max']:
+            timestamps = store.chunk(tag_id, index)[timestamp_row]
+
+            if start_time is not None and start_time > chunk['t_min']:
+                begin = int(np.searchsorted(timestamps, start_time, side = 'left'))
+
+            if end_time is not None and end_time < chunk['t_max']:
+                end = int(np.searchsorted(timestamps, end_time, side = 'right'))
+
+        if end > begin:
+            slices.append((index, begin, end))
+
+    return slices
+
+def select(store, tag_id, start_time = None, end_time = None):
+    """
+    Return the TimeRange of the samples of tag_id between start_time and
+    end_time (see to_timestamp(), times of day refer to the day of the
+    first sample of the tag), the whole history by default.
+    """
+
+    reference = None
+    chunks = store.chunks(tag_id)
+    if chunks and chunks[0]['t_min'] is not None:
+        reference = chunks[0]['t_min']
+
+    start_time = to_timestamp(start_time, reference)
+    end_time = to_timestamp(end_time, reference)
+
+    return TimeRange(store, tag_id, find_slices(store, tag_id, start_time, end_time))
+
+def select_tags(store, start_time = None, end_time = None, tag_ids = None):
+    """
+    Return a dictionary of the TimeRanges of the tags in tag_ids
+    (all by default) indexed by tag id.
+    """
+
+    if tag_ids is None:
+        tag_ids = store.tags()
+
+    return {tag_id: select(store, tag_id, start_time, end_time) for tag_id in tag_ids}
+
+def stream(store, tag_id, start_time = None, end_time = None, columns = None):
+    """
+    Generator of the samples of tag_id between start_time and end_time,
+    chunk by chunk, e.g. to process ranges larger than the memory.
+
+    Yield a dictionary of views indexed by column name.
+    """
+
+    return select(store, tag_id, start_time, end_time).chunk_views(columns)
+
+if __name__ == '__main__':
+    # print a summary of the samples of a tag, e.g.
+    #     python -m storage.query positions/ 7 14:02 14:05
+    import sys
+
+    store = PositionStore(sys.argv[1], 'r')
+    tag_id = int(sys.argv[2])
+    start_time = sys.argv[3] if len(sys.argv) > 3 else None
+    end_time = sys.argv[4] if len(sys.argv) > 4 else None
+
+    time_range = select(store, tag_id, start_time, end_time)
+
+    print('tag ' + str(tag_id) + ': ' + str(len(time_range)) + ' samples in ' +\
+          str(len(time_range.slices)) + ' chunks')
+
+    if len(time_range) > 0:
+        timestamps = time_range.timestamps
+        print('from ' + str(datetime.fromtimestamp(timestamps[0])) +\
+              ' to ' + str(datetime.fromtimestamp(timestamps[-1])))
+        for name in ('x', 'y', 'z'):
+            print(name + ' mean ' + format(np.mean(time_range.column(name)), '.3f'))
@@ -9,7 +9,7 @@ from device.device_manager import DeviceManager
 from device.device_manager import DeviceVIDPIDList
 
 # multi-threading
-from PyQt5.QtCore import pyqtSignal, pyqtSlot, QThread
+from PyQt5.QtCore import pyqtSlot, QThread
         
 class MockGUI(QThread):
     """
@@ -34,6 +34,10 @@ class MockGUI(QThread):
             print('New device connected: ' + dev.port.device)
             dev.register_new_data_available_slot(self.new_data_available)
 
+            # drain the messages received before the slot was connected,
+            # the device would not signal again until drained
+            self.new_data_available(dev.id)
+
     @pyqtSlot(str)
     def new_data_available(self, device_id):
         
@@ -41,7 +45,13 @@ class MockGUI(QThread):
         device = self.dev_man.device(device_id)
 
         # print new data
-        print(device_id + ' ' + str(device.last_data))
+        for data in device.drain():
+            print(device_id + ' ' + str(data))
+
+        # print messages lost
+        dropped = device.dropped_messages
+        if dropped > 0:
+            print(device_id + ' ' + str(dropped) + ' messages dropped')
 
     def run(self):
         while True:
@@ -65,14 +65,16 @@ class Color:
 
     def get_color_shade(self, resolution = 1):
         """
-        Return a list of colors sorted by ascending alpha channel.
+        Return an array of RGBA colors sorted by ascending alpha channel.
         """
         if resolution == 1:
             alpha_channels = [1]
         else:
             alpha_channels =  np.linspace(0, 1, resolution)
 
-        # generate the shade of the color
-        color_shade = [self.color + [alpha] for alpha in alpha_channels]
+        # generate the shade of the color as an array of RGBA rows
+        color_shade = np.empty((len(alpha_channels), 4))
+        color_shade[:, :3] = self.color
+        color_shade[:, 3] = alpha_channels
         
         return color_shade
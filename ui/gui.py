@@ -1,6 +1,6 @@
 #PyQt5
 from PyQt5 import QtWidgets
-from PyQt5.QtCore import pyqtSlot
+from PyQt5.QtCore import pyqtSlot, QTimer
 import sys
 
 # QtDesigner generated classes
@@ -20,6 +20,9 @@ import ui.color_palette
 # Matplotlib class
 from canvas.matplotlib_viewer_canvas import MatplotlibViewerCanvas
 
+# batched delivery of data from devices
+from device.data_coalescer import DataCoalescer
+
 # for logging
 from time import localtime, strftime
 
@@ -27,10 +30,13 @@ class EVB1000ViewerMainWindow(QtWidgets.QMainWindow):
     """
     Main window class of EVB1000 Viewer
     """
-    def __init__(self, device_manager = None):
+    def __init__(self, device_manager = None, position_store = None):
         # call QMainWindow constructor
         super().__init__()
 
+        # PositionStore receiving the poses of the tags, if any
+        self.position_store = position_store
+
         # set up the user interface
         self.ui = Ui_EVB1000ViewerMainWindow()
         self.ui.setupUi(self)
@@ -38,9 +44,15 @@ class EVB1000ViewerMainWindow(QtWidgets.QMainWindow):
         # instantiate MatplotlibViewerCanvas
         frame_rate = 25.0
         tag_positions_buffer_size = 10
+        # redraw only tags that changed on top of a cached background
+        render_mode = 'blit'
+        # draw all the tags with a single scatter and a single collection of segments
+        batch_tags = True
         self.mpl_canvas = MatplotlibViewerCanvas(self.ui.matPlotGroupBox,\
                                                  frame_rate,\
-                                                 tag_positions_buffer_size)
+                                                 tag_positions_buffer_size,\
+                                                 render_mode,\
+                                                 batch_tags)
 
         # instantiate the Logger
         self.logger = Logger(self.ui.logLabel, self.ui.logScrollArea)
@@ -60,7 +72,27 @@ class EVB1000ViewerMainWindow(QtWidgets.QMainWindow):
         if self.dev_man != None:
             self.dev_man.register_new_devices_connected_slot(self.new_devices_connected)
             self.dev_man.register_devices_removed_slot(self.devices_removed)
+            self.dev_man.register_port_opened_slot(self.device_port_opened)
+
+        # rate at which data from devices is delivered to the GUI,
+        # if None data is delivered as soon as it is available
+        delivery_rate = frame_rate
+
+        # instantiate the DataCoalescer
+        self.coalescer = None
+        if self.dev_man != None and delivery_rate != None:
+            self.coalescer = DataCoalescer(self.dev_man, delivery_rate)
+            self.coalescer.register_new_batch_available_slot(self.new_batch_available)
             
+        # log the frame time measurements and the delivery metrics
+        # every statistics_interval seconds, if None they are not logged
+        statistics_interval = 60.0
+        self.statistics_timer = None
+        if statistics_interval != None:
+            self.statistics_timer = QTimer(self)
+            self.statistics_timer.timeout.connect(self.log_statistics)
+            self.statistics_timer.start(int(statistics_interval * 1000))
+
         # empty dictionary of tags widgets
         self.tags_widgets = dict()
 
@@ -70,6 +102,14 @@ class EVB1000ViewerMainWindow(QtWidgets.QMainWindow):
         # remeber if the anchors position were already set 
         self.anc_positions_set = False
 
+        # samples received and not yet handed to the canvas, so that
+        # the canvas is updated once per batch:
+        # tag IDs and positions of the raw positions, in order of arrival
+        self.pending_raw_tag_IDs = []
+        self.pending_raw_positions = []
+        # last estimated pose of each tag, the previous ones are never drawn
+        self.pending_estimated_poses = dict()
+
     @pyqtSlot()
     def new_devices_connected(self):
         """
@@ -84,12 +124,34 @@ class EVB1000ViewerMainWindow(QtWidgets.QMainWindow):
             self.logger.ev_tag_connected(str(dev))
 
             # register new_data_available slot
-            dev.register_new_data_available_slot(self.new_data_available)
+            if self.coalescer != None:
+                self.coalescer.register_device(dev)
+            else:
+                dev.register_new_data_available_slot(self.new_data_available)
 
             # add tag widget to the layout
             # device id is used as key
             self.tags_widgets[dev.id] = TagItem(self.ui, str(dev))
+
+            # drain the messages received before the slot was connected,
+            # the device would not signal again until drained
+            if self.coalescer == None:
+                self.new_data_available(dev.id)
             
+    @pyqtSlot(str)
+    def device_port_opened(self, device_id):
+        """
+        Log the serial options applied when the port of a device was opened.
+        """
+        # retrieve device from device manager
+        try:
+            dev = self.dev_man.device(device_id)
+        except KeyError:
+            # the device was removed in the meantime
+            return
+
+        self.logger.ev_serial_port_opened(str(dev), dev.tuning_report)
+
     @pyqtSlot()
     def devices_removed(self):
         """
@@ -124,16 +186,66 @@ class EVB1000ViewerMainWindow(QtWidgets.QMainWindow):
             # hasn't stopped yet
             return
 
-        # get last data
-        data = device.last_data
+        # get all the pending data
+        messages, timestamps = device.drain_with_timestamps()
+        dropped = device.dropped_messages
+
+        self.handle_messages(device, messages, timestamps, dropped)
 
-        # handle according to message type
-        # 'tpr' contains raw trilateration data
-        # 'kmf' contains estimated position and attitude
-        if data['msg_type'] == 'tpr' or data['msg_type'] == 'kmf':
-            self.handle_tag_report_rcvd(device_id, data)
-        elif data['msg_type'] == 'apr':
-            self.handle_anch_report_rcvd(data)
+        # update canvas with new positions and poses
+        self.flush_tag_samples()
+
+    @pyqtSlot(list)
+    def new_batch_available(self, batch):
+        """
+        Handle a batch of messages delivered by the DataCoalescer.
+        """
+
+        for device, messages, timestamps, dropped in batch:
+            self.handle_messages(device, messages, timestamps, dropped)
+
+        # update canvas with the new positions and poses of all the devices
+        self.flush_tag_samples()
+
+    def flush_tag_samples(self):
+        """
+        Hand the tag samples collected by handle_tag_report_rcvd() to the canvas,
+        all the raw positions with a single homogeneous transformation.
+        """
+
+        if self.pending_raw_tag_IDs:
+            self.mpl_canvas.set_tags_raw_positions(self.pending_raw_tag_IDs, self.pending_raw_positions)
+
+            self.pending_raw_tag_IDs = []
+            self.pending_raw_positions = []
+
+        for tag_id, pose in self.pending_estimated_poses.items():
+            self.mpl_canvas.set_tag_estimated_pose(tag_id, *pose)
+
+        self.pending_estimated_poses = dict()
+
+    def handle_messages(self, device, messages, timestamps, dropped):
+        """
+        Handle the messages received from a device, their
+        reception times and the number of messages it dropped.
+        """
+
+        # report messages lost because the GUI fell behind
+        if dropped > 0:
+            self.logger.ev_messages_dropped(str(device), dropped)
+
+        for data, timestamp in zip(messages, timestamps):
+            # store the poses, if required
+            if self.position_store is not None:
+                self.position_store.append_message(data, timestamp)
+
+            # handle according to message type
+            # 'tpr' contains raw trilateration data
+            # 'kmf' contains estimated position and attitude
+            if data.msg_type == 'tpr' or data.msg_type == 'kmf':
+                self.handle_tag_report_rcvd(device.id, data)
+            elif data.msg_type == 'apr':
+                self.handle_anch_report_rcvd(data)
 
     def handle_tag_report_rcvd(self, device_id, data):
         """        
@@ -146,7 +258,7 @@ class EVB1000ViewerMainWindow(QtWidgets.QMainWindow):
         widget = self.tags_widgets[device_id]
 
         # get Tag ID
-        tag_id = data['tag_id']
+        tag_id = data.tag_id
 
         # data from tags are plotted only if the anchors position are already set
         # and the matplotlib canvas is configured to show them
@@ -177,27 +289,30 @@ class EVB1000ViewerMainWindow(QtWidgets.QMainWindow):
                 widget.tag_id_color = c.color_255
 
             # get Tag position or estimated position
-            x = data['x']
-            y = data['y']
-            z = data['z']
+            x = data.x
+            y = data.y
+            z = data.z
 
-            if data['msg_type'] == 'kmf':
+            if data.msg_type == 'kmf':
                 # get also estimated attitude
-                yaw = data['Y']
-                pitch = data['P']
-                roll = data['R']
-
-            if data['msg_type'] == 'tpr':
-                # update canvas with new position
-                self.mpl_canvas.set_tag_raw_position(tag_id, x, y, z)
-            elif data['msg_type'] == 'kmf':
-                # update canvas with new estimated position and attitude
-                self.mpl_canvas.set_tag_estimated_pose(tag_id, x, y, z, roll, pitch, yaw)
-
-            if data['msg_type'] == 'tpr':
+                yaw = data.Y
+                pitch = data.P
+                roll = data.R
+
+            # the canvas is updated by flush_tag_samples()
+            # once all the messages of the batch are handled
+            if data.msg_type == 'tpr':
+                # new position
+                self.pending_raw_tag_IDs.append(tag_id)
+                self.pending_raw_positions.append((x, y, z))
+            elif data.msg_type == 'kmf':
+                # new estimated position and attitude
+                self.pending_estimated_poses[tag_id] = (x, y, z, roll, pitch, yaw)
+
+            if data.msg_type == 'tpr':
                 # update widget with new position
                 widget.position = (x, y, z)
-            elif data['msg_type'] == 'kmf':
+            elif data.msg_type == 'kmf':
                 # update widget with new position
                 widget.estimated_pose = (x, y, z, roll, pitch, yaw)
             
@@ -210,10 +325,10 @@ class EVB1000ViewerMainWindow(QtWidgets.QMainWindow):
         # by the user draw the anchors
         if not self.anc_positions_set and self.mpl_canvas.is_plane_height_set():
             # extract Anchors position
-            coordinates = [[data['a0_x'], data['a0_y'], data['a0_z']],
-                           [data['a1_x'], data['a1_y'], data['a1_z']],
-                           [data['a2_x'], data['a2_y'], data['a2_z']],
-                           [data['a3_x'], data['a3_y'], data['a3_z']]]
+            coordinates = [[data.a0_x, data.a0_y, data.a0_z],
+                           [data.a1_x, data.a1_y, data.a1_z],
+                           [data.a2_x, data.a2_y, data.a2_z],
+                           [data.a3_x, data.a3_y, data.a3_z]]
         
             # evaluate basis change according to the z coordinate
             # of the fourth anchor
@@ -253,6 +368,31 @@ class EVB1000ViewerMainWindow(QtWidgets.QMainWindow):
             
             self.anc_positions_set = True
         
+    @pyqtSlot()
+    def log_statistics(self):
+        """
+        Log the frame time measurements of the canvas and,
+        if data is delivered in batches, the delivery metrics.
+        """
+
+        self.logger.ev_frame_statistics(self.mpl_canvas.frame_statistics())
+
+        if self.coalescer != None:
+            self.logger.ev_delivery_metrics(self.coalescer.metrics())
+
+    def statistics_summary(self):
+        """
+        Return the text of the frame time measurements and of
+        the delivery metrics, e.g. to be printed at exit.
+        """
+
+        text = format_frame_statistics(self.mpl_canvas.frame_statistics())
+
+        if self.coalescer != None:
+            text += '\n' + format_delivery_metrics(self.coalescer.metrics())
+
+        return text
+
     def quit(self):
         """
         Quit method.
@@ -265,6 +405,26 @@ class EVB1000ViewerMainWindow(QtWidgets.QMainWindow):
         # close the window
         self.close()
 
+def format_frame_statistics(stats):
+    """
+    Return the text of the frame time measurements, see FrameTimer.statistics().
+    """
+
+    return "Frames: " + str(stats['rendered_frames']) + " rendered, " +\
+           str(stats['skipped_frames']) + " skipped, update " +\
+           format(stats['update_mean_ms'], '.2f') + " ms (max " + format(stats['update_max_ms'], '.2f') + " ms), render " +\
+           format(stats['render_mean_ms'], '.2f') + " ms (max " + format(stats['render_max_ms'], '.2f') + " ms)."
+
+def format_delivery_metrics(metrics):
+    """
+    Return the text of the delivery metrics, see DataCoalescer.metrics().
+    """
+
+    return "Delivery: " + str(metrics['delivered_messages']) + " messages in " +\
+           str(metrics['batches']) + " batches (" + format(metrics['coalescing_ratio'], '.1f') +\
+           " per batch, max " + str(metrics['max_queue_depth']) + "), " +\
+           str(metrics['dropped_messages']) + " dropped."
+
 class Logger:
     """
     Logger class shows events during the execution of the viewer.
@@ -314,6 +474,36 @@ class Logger:
         txt = "Tag " + str(tag_id) + " removed."
         self.write_to_log(txt)
 
+    def ev_serial_port_opened(self, device_port, tuning_report):
+        """
+        Log a "serial port opened" event.
+        """
+
+        txt = "Serial port " + device_port + " opened (" + ", ".join(tuning_report) + ")."
+        self.write_to_log(txt)
+
+    def ev_frame_statistics(self, stats):
+        """
+        Log the frame time measurements of the canvas.
+        """
+
+        self.write_to_log(format_frame_statistics(stats))
+
+    def ev_delivery_metrics(self, metrics):
+        """
+        Log the metrics of the batched delivery of the data.
+        """
+
+        self.write_to_log(format_delivery_metrics(metrics))
+
+    def ev_messages_dropped(self, device_port, number_of_messages):
+        """
+        Log a "messages dropped" event.
+        """
+
+        txt = str(number_of_messages) + " messages from " + device_port + " dropped."
+        self.write_to_log(txt)
+
     def write_to_log(self, text):
         """
         Log the text "text" with a timestamp.